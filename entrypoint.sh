@@ -7,6 +7,9 @@
 # symlinking the data into the job folder, and writing the job script with the relevent paths to the input files.
 #
 # Then the job files for each release site in runtime_configuration.yaml are run - this runs Flexpart.
+# The progress of each run (simulated time, particles, throughput and ETA) is logged and written to progress.json in its job folder.
+#
+# The NetCDF output of each release site is then post-processed (compressed and rechunked).
 #
 # Finally the flexpart_ifs_utils library is called to upload the output of Flexpart to an S3 bucket.
 
@@ -31,12 +34,15 @@ names=$(grep -oP 'name: \K.*' $JOBS_DIR/runtime_configuration.yaml)
 
 for name in $names; do
     echo Running Flexpart IFS for release site: $name
-    cd $JOBS_DIR/$name
     # Run Flexpart-IFS
-    bash job
+    python -m flexpart_ifs_utils run \
+        --job_dir $JOBS_DIR/$name
 done
 
-cd $SCRIPT_DIR
+# Compress and rechunk the NetCDF output of Flexpart-IFS.
+python -m flexpart_ifs_utils postprocess \
+    --jobs_dir $JOBS_DIR
+
 # Upload output files of Flexpart-IFS to S3 bucket.
 python -m flexpart_ifs_utils upload \
     --directory $JOBS_DIR \
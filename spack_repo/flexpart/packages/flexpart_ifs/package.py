@@ -13,11 +13,14 @@ class FlexpartIfs(MakefilePackage):
     version('main', branch='main')
     version('10.4.9', tag='10.4.9')
 
+    variant('mpi', default=False, description='Build FLEXPART_MPI as well, for hybrid MPI+OpenMP runs')
+
     depends_on('eccodes +fortran')
     # WORKAROUND: '%gcc' should not be necessary, but without it, spack concretizes to nvhpc.
     depends_on('netcdf-fortran %gcc')
 
     depends_on('fortran', type='build')
+    depends_on('mpi', when='+mpi')
 
     build_directory = 'src'
 
@@ -33,17 +36,23 @@ class FlexpartIfs(MakefilePackage):
         with working_dir(self.build_directory):
             makefile = FileFilter('makefile_meteoswiss')
             # compiler
-            makefile.filter('F90 *=.*', 'F90 = ' + spack_fc)
-
-
+            makefile.filter('^F90 *=.*', 'F90 = ' + spack_fc)
+            if spec.satisfies('+mpi'):
+                makefile.filter('^MPIF90 *=.*', 'MPIF90 = ' + spec['mpi'].mpifc)
 
     def build(self, spec, prefix):
         with working_dir(self.build_directory):
             make('-f', 'makefile_meteoswiss')
+            if spec.satisfies('+mpi'):
+                # The objects of the serial build are not compiled against MPI.
+                make('-f', 'makefile_meteoswiss', 'clean')
+                make('-f', 'makefile_meteoswiss', 'mpi')
 
     def install(self, spec, prefix):
         mkdir(prefix.bin)
         install(join_path(self.build_directory, 'FLEXPART'), prefix.bin)
+        if spec.satisfies('+mpi'):
+            install(join_path(self.build_directory, 'FLEXPART_MPI'), prefix.bin)
         install_tree('options', join_path(prefix.share, 'options'))
         install_tree('options.meteoswiss',
                      join_path(prefix.share, 'options.meteoswiss'))
@@ -1,11 +1,33 @@
 """ Initializations """
 import os
+from typing import TYPE_CHECKING, Any
 
-from mchpy.audit import logger
+if TYPE_CHECKING:
+    from flexpart_ifs_utils.config.service_settings import ServiceSettings
 
-from flexpart_ifs_utils.config.service_settings import ServiceSettings
+    CONFIG: ServiceSettings
 
-CONFIG = ServiceSettings('settings.yaml', os.path.join(os.path.dirname(__file__), 'config'))
 
-# Configure logger
-logger.apply_logging_settings(CONFIG.logging)
+def load_config() -> "ServiceSettings":
+    """ Load the service settings and configure the logger, once, on first use. """
+    if "CONFIG" in globals():
+        return globals()["CONFIG"]
+
+    from mchpy.audit import logger
+
+    from flexpart_ifs_utils.config.service_settings import ServiceSettings
+
+    config = ServiceSettings('settings.yaml', os.path.join(os.path.dirname(__file__), 'config'))
+
+    # Configure logger
+    logger.apply_logging_settings(config.logging)
+
+    globals()["CONFIG"] = config
+    return config
+
+
+def __getattr__(name: str) -> Any:
+    # CONFIG is resolved lazily, so that importing the package and its modules does not read the settings.
+    if name == "CONFIG":
+        return load_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,15 +1,27 @@
 """
 This module prepares input files and data for running Flexpart-IFS, a Lagrangian particle dispersion model.
 The module handles the following tasks:
-- Downloading the model and static input data from S3 if not available locally.
+- Downloading the model and static input data from S3 if not available locally, or prefetching it as it arrives.
+- Optionally repacking the input data, and cropping the global input fields to the region of the release site.
 - Symlinking the necessary model and static data into the job folder.
 - Configuring input namelists (such as COMMAND, AVAILABLE, RELEASES, OUTGRID) based on a set of environment variables.
 - Writing the job script with the relevant paths to the input files.
-- Uploading the job output to an S3 bucket.
+- Post-processing the NetCDF output of the job: deriving emergency-response products, compressing and rechunking.
+- Uploading the job output to an S3 bucket, optionally also converted to Zarr stores.
+- Planning the particles and threads of each job to meet a deadline, from the statistics of earlier runs.
+- Skipping runs identical to a run already uploaded, whose output is copied in the output bucket instead.
 
 The main script can be used with the following commands:
 1. `generate`: Generate the necessary input files and setup the job directory for Flexpart.
-2. `upload`: Upload the output directory to an S3 bucket.
+2. `run`: Run the job script of a release site, recording the progress of Flexpart.
+3. `postprocess`: Derive products from, extract receptor series from, compress and rechunk the NetCDF output of
+   each release site.
+4. `upload`: Upload the output directory to an S3 bucket.
+5. `manifest`: Build the manifest of the input files of a forecast cycle, which `generate` reads.
+6. `serve`: Execute the run requests of a queue as a long-lived daemon: generate, run, postprocess and upload.
+7. `submit`: Put a run request for the release sites, with the EMISSION_* and SIMULATION_* variables, in the queue.
+8. `prefetch`: Download the input files of the latest cycle into the cache as they arrive, which `generate` links.
+9. `compare`: Compare the NetCDF output of two runs, exiting non-zero if it differs by more than the tolerances.
 
 Usage:
 
@@ -19,62 +31,112 @@ Usage:
         --datetime <YYYYMMDDHH>
         --site BEZ
 
+    python __main__.py run --job_dir <jobs_dir>/BEZ
+
+    python __main__.py postprocess --jobs_dir <jobs_dir>
+
     python __main__.py upload -d <jobs_dir> -i <input_directory>
+
+    python __main__.py manifest --datetime <YYYYMMDDHH> --prefix <YYYYMMDD_HH>/ [--directory <dir>] [--upload]
+
+    python __main__.py prefetch [--datetime <YYYYMMDDHH>] [--once]
+
+    python __main__.py serve -f <flexpart_dir> -j <jobs_dir> [--drain]
+
+    python __main__.py submit --datetime <YYYYMMDDHH> --site BEZ --site LEI --model IFS-Europe
+
+    python __main__.py compare --reference <jobs_dir> --candidate <jobs_dir> [--report <report.json>]
 """
 
 import argparse
+import json
 import logging
-import os
 import sys
+from datetime import datetime
 from pathlib import Path
 
-import yaml
-
-from flexpart_ifs_utils import CONFIG
-from flexpart_ifs_utils.model import EnvironmentParameters, Model
-from flexpart_ifs_utils.prepare_flexpart import (_path_list,
-                                                 prepare_job_directory,
-                                                 render_template, select_files)
-from flexpart_ifs_utils.s3_utils import (download_keys_from_bucket,
-                                         upload_output)
-
-
-def validate_env(data: dict[str, str | None]) -> None:
-    violations: list[str] = []
-    for parameter in EnvironmentParameters:
-        if parameter.name not in data:
-            violations.append(parameter.name)
-        elif data[parameter.name] is None:
-            violations.append(parameter.name)
-
-    if violations:
-        raise RuntimeError(
-            "Environment is missing variables needed to prepare runtime configuration: "
-            f"{violations}"
-        )
-
-
-def parse_env() -> dict[str, str | None]:
-    return {"EMISSION_START_YYYY": os.getenv("EMISSION_START_YYYY"),
-            "EMISSION_START_MM": os.getenv("EMISSION_START_MM"),
-            "EMISSION_START_DD": os.getenv("EMISSION_START_DD"),
-            "EMISSION_START_ZZ": os.getenv("EMISSION_START_ZZ"),
-            "EMISSION_END_YYYY": os.getenv("EMISSION_END_YYYY"),
-            "EMISSION_END_MM": os.getenv("EMISSION_END_MM"),
-            "EMISSION_END_DD": os.getenv("EMISSION_END_DD"),
-            "EMISSION_END_ZZ": os.getenv("EMISSION_END_ZZ"),
-            "SIMULATION_END_YYYY": os.getenv("SIMULATION_END_YYYY"),
-            "SIMULATION_END_MM": os.getenv("SIMULATION_END_MM"),
-            "SIMULATION_END_DD": os.getenv("SIMULATION_END_DD"),
-            "SIMULATION_END_ZZ": os.getenv("SIMULATION_END_ZZ")}
+from flexpart_ifs_utils import load_config
+from flexpart_ifs_utils.model import Model
+from flexpart_ifs_utils.stages import (generate, parse_env, postprocess, run,
+                                       upload, validate_env)
+from flexpart_ifs_utils.timing import phase, write_timings
 
+# The CLI is started several times per job, so each command imports only the modules it uses:
+# boto3, eccodes, netCDF4 and zarr take most of the startup time.
+
+_logger = logging.getLogger(__name__)
+
+
+def manifest(cycle: str, prefix: str, directory: Path | None, output: Path | None, upload_to_bucket: bool) -> None:
+    from flexpart_ifs_utils.manifest import build_manifest, upload_manifest
+
+    with phase('manifest_command'):
+        cycle_manifest = build_manifest(datetime.strptime(cycle[:10], '%Y%m%d%H'), prefix, directory)
+        if output is not None:
+            output.write_text(json.dumps(cycle_manifest, indent=1), encoding='utf-8')
+        if upload_to_bucket:
+            upload_manifest(cycle_manifest)
 
-if __name__ == '__main__':
 
-    _logger = logging.getLogger(__name__)
+def prefetch(cycle: str | None, once: bool) -> None:
+    from flexpart_ifs_utils import CONFIG
+    from flexpart_ifs_utils.prefetch import prefetch as prefetch_input
+
+    if CONFIG.main.input.prefetch is None:
+        raise RuntimeError('No prefetch settings configured, the input cache is unknown.')
+
+    prefetch_input(CONFIG.main.input.prefetch,
+                   datetime.strptime(cycle[:10], '%Y%m%d%H') if cycle is not None else None,
+                   once)
+
+
+def serve(jobs_dir: Path, flexpart_dir: Path, drain: bool) -> None:
+    from flexpart_ifs_utils import CONFIG
+    from flexpart_ifs_utils.serve import open_queue, serve_requests
+
+    if CONFIG.main.serve is None:
+        raise RuntimeError('No serve settings configured, the queue of run requests is unknown.')
+
+    serve_requests(open_queue(CONFIG.main.serve), CONFIG.main.serve, jobs_dir, flexpart_dir, drain)
+
+
+def submit(forecast_datetime: str, sites: list[str], model: Model, request_id: str | None) -> str:
+    import uuid
+
+    from flexpart_ifs_utils import CONFIG
+    from flexpart_ifs_utils.serve import RunRequest, open_queue
+
+    if CONFIG.main.serve is None:
+        raise RuntimeError('No serve settings configured, the queue of run requests is unknown.')
+
+    environment = parse_env()
+    validate_env(environment)
+
+    request = RunRequest(id=request_id or f'{forecast_datetime}_{uuid.uuid4().hex[:8]}',
+                         sites=sites,
+                         forecast_datetime=forecast_datetime,
+                         model=model,
+                         environment=environment)
+    open_queue(CONFIG.main.serve).put(request)
+    _logger.info('Submitted run request %s', request.id)
+    return request.id
+
+
+def compare(reference_dir: Path, candidate_dir: Path, report: Path | None) -> int:
+    from flexpart_ifs_utils import CONFIG
+    from flexpart_ifs_utils.compare import compare_outputs
+
+    comparisons = compare_outputs(reference_dir, candidate_dir, CONFIG.main.compare, CONFIG.main.output.max_workers)
+    if report is not None:
+        report.write_text(json.dumps([comparison.model_dump() for comparison in comparisons], indent=1),
+                          encoding='utf-8')
+    return 1 if any(comparison.failed for comparison in comparisons) else 0
+
+
+if __name__ == '__main__':
 
     parser = argparse.ArgumentParser()
-    sp = parser.add_subparsers()
+    sp = parser.add_subparsers(dest='command')
 
     p1 = sp.add_parser('upload')
     p1.add_argument('--directory',
@@ -116,65 +178,134 @@ if __name__ == '__main__':
                     choices=[m.value for m in Model],
                     required=True
                     )
+    p3 = sp.add_parser('postprocess')
+    p3.add_argument('--jobs_dir',
+                    help='Path of the jobs directory containing the output of each release site.',
+                    required=True,
+                    type=Path,
+                    )
+    p4 = sp.add_parser('run')
+    p4.add_argument('--job_dir',
+                    help='Path of the job directory of a release site.',
+                    required=True,
+                    type=Path,
+                    )
+    p5 = sp.add_parser('manifest')
+    p5.add_argument('--datetime',
+                    help='Forecast cycle, in format YYYYMMDDHH.',
+                    required=True
+                    )
+    p5.add_argument('--prefix',
+                    help='Prefix of the keys of the files of the cycle in the input bucket.',
+                    required=True
+                    )
+    p5.add_argument('--directory',
+                    help='Local directory of the files, uploaded under the prefix. Default: the objects in the bucket.',
+                    type=Path,
+                    )
+    p5.add_argument('--output',
+                    help='Path to write the manifest to.',
+                    type=Path,
+                    )
+    p5.add_argument('--upload',
+                    help='Upload the manifest next to the data of the cycle in the input bucket.',
+                    action='store_true',
+                    )
+    p6 = sp.add_parser('serve')
+    p6.add_argument('--flexpart_dir',
+                    help='Directory where the Flexpart binary lives.',
+                    required=True,
+                    type=Path,
+                    )
+    p6.add_argument('--jobs_dir',
+                    help='Path of the directory of the jobs directories of the requests.',
+                    required=True,
+                    type=Path,
+                    )
+    p6.add_argument('--drain',
+                    help='Exit once the queue is empty, instead of polling it.',
+                    action='store_true',
+                    )
+    p7 = sp.add_parser('submit')
+    p7.add_argument('--datetime',
+                    help='Forecast datetime, in format YYYYMMDDHH.',
+                    required=True
+                    )
+    p7.add_argument('--site',
+                    help='Release site, repeated for several sites.',
+                    required=True,
+                    action='append',
+                    )
+    p7.add_argument('--model',
+                    help='IFS model used by Flexpart. IFS-Global runs use nested domain over Europe (IFS-Europe).',
+                    type=str,
+                    choices=[m.value for m in Model],
+                    required=True
+                    )
+    p7.add_argument('--id',
+                    help='Identifier of the request. Default: the forecast datetime and a random suffix.',
+                    )
+    p8 = sp.add_parser('prefetch')
+    p8.add_argument('--datetime',
+                    help='Forecast cycle, in format YYYYMMDDHH. Default: the latest cycle in the bucket.',
+                    )
+    p8.add_argument('--once',
+                    help='Download the files available once, instead of polling the bucket.',
+                    action='store_true',
+                    )
+    p9 = sp.add_parser('compare')
+    p9.add_argument('--reference',
+                    help='Output tree of the reference run, e.g. its jobs directory.',
+                    required=True,
+                    type=Path,
+                    )
+    p9.add_argument('--candidate',
+                    help='Output tree of the run compared with the reference.',
+                    required=True,
+                    type=Path,
+                    )
+    p9.add_argument('--report',
+                    help='Path to write the statistics of every file and variable to, as JSON.',
+                    type=Path,
+                    )
     args = parser.parse_args()
 
-    if "directory" in args:
-        upload_output(args.directory, args.site, args.datetime, parent='output')
+    # Reads the settings and configures the logger
+    load_config()
+
+    _logger.debug('Args: %s', args)
+
+    if args.command == 'upload':
+        upload(args.directory, args.site, args.datetime)
         sys.exit(0)
 
-    FORECAST_DATETIME: str = args.datetime
-    RELEASE_SITE: str = args.site
-    JOBS_DIR: Path = args.jobs_dir
-    FLEXPART_DIR: Path = args.flexpart_dir
-    MODEL: Model = Model(args.model)
+    if args.command == 'run':
+        sys.exit(run(args.job_dir))
 
-    WORKDIR: Path = Path(os.path.abspath(__file__)).parent
-    CONFIG_TEMPLATE_PATH = WORKDIR / 'runtime_configuration.j2'
-    CONFIG_PATH =  JOBS_DIR / (CONFIG_TEMPLATE_PATH.stem + '.yaml')
+    if args.command == 'postprocess':
+        postprocess(args.jobs_dir)
+        sys.exit(0)
 
-    if not os.path.exists( JOBS_DIR ):
-        os.makedirs( JOBS_DIR )
+    if args.command == 'manifest':
+        manifest(args.datetime, args.prefix, args.directory, args.output, args.upload)
+        sys.exit(0)
 
-    _logger.info('FLEXPART directory: %s', FLEXPART_DIR)
-    _logger.info('Jobs directory: %s', JOBS_DIR)
-    _logger.debug('Args: %s', args)
+    if args.command == 'prefetch':
+        prefetch(args.datetime, args.once)
+        sys.exit(0)
 
-    environment = parse_env()
+    if args.command == 'serve':
+        serve(args.jobs_dir, args.flexpart_dir, args.drain)
+        sys.exit(0)
 
-    validate_env(environment)
+    if args.command == 'compare':
+        sys.exit(compare(args.reference, args.candidate, args.report))
+
+    if args.command == 'submit':
+        submit(args.datetime, args.site, Model(args.model), args.id)
+        sys.exit(0)
+
+    with phase('generate_command'):
+        job_dir = generate(args.datetime, args.site, args.jobs_dir, args.flexpart_dir, Model(args.model))
 
-    render_template(CONFIG_TEMPLATE_PATH, CONFIG_PATH, [RELEASE_SITE], environment)
-
-    with open(CONFIG_PATH, 'r', encoding="utf-8") as f:
-        configs = yaml.safe_load(f)
-
-    configs = [config for config in configs if config['name'] == RELEASE_SITE]
-    if not configs:
-        raise RuntimeError(f'Release site {RELEASE_SITE} does not match any known to Flexpart.')
-    if len(configs) > 1:
-        raise RuntimeError(f'Release site {RELEASE_SITE} matches multiple configs.')
-    config = configs[0]
-
-    DATA_DIR = JOBS_DIR / 'data'
-    if not os.path.exists( DATA_DIR ):
-        os.makedirs( DATA_DIR )
-
-    # Check if data already exists for the domain
-    data_paths = _path_list(DATA_DIR, MODEL)
-
-    if not data_paths:
-        # Search the db for the relevant files and download data
-        keys = select_files(config['command'],
-                            forecast_datetime=FORECAST_DATETIME,
-                            step_unit=CONFIG.main.input.step_unit,
-                            model=MODEL)
-
-        download_keys_from_bucket(keys, DATA_DIR, CONFIG.main.aws.s3.nwp_model_data)
-
-    job_dir = prepare_job_directory(
-        config,
-        JOBS_DIR,
-        FLEXPART_DIR,
-        DATA_DIR,
-        CONFIG.main.openmp_config,
-        model=MODEL)
+    write_timings(job_dir)
@@ -0,0 +1,306 @@
+"""
+The module reads the binary grid output of Flexpart, written when IOUT does not request NetCDF output:
+the header file of the output grid and the release points, and one grid_conc_<datetime>_<species> file
+(grid_time_ for backward runs) per output time and species. The files are Fortran unformatted sequential
+files, little endian with 4 byte record markers as built by makefile_meteoswiss.
+
+The fields of a grid file are sparse dumps written by concoutput.f90: for each release point and age
+class, the wet and dry deposition and the concentration, each as a record of the flat indices of the
+first cell of every run of consecutive non-zero cells, and a record of the values of all the runs, whose
+sign alternates from one run to the next. The dumps are decoded with NumPy, without a loop over the
+values: the sign changes give the run of each value, and its cell is the first cell of the run plus its
+position in the run.
+
+The files are memory-mapped, and a grid file is decoded only when the fields of its output time are
+requested, into dense arrays with the dimensions of the NetCDF output without time, or into sparse
+fields holding the flat indices and values of the non-zero cells.
+"""
+
+import logging
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+from pydantic import BaseModel
+
+from flexpart_ifs_utils.prepare_flexpart import OutputGrid
+
+_logger = logging.getLogger(__name__)
+
+_MARKER = np.dtype("<i4")
+_INT = np.dtype("<i4")
+_REAL = np.dtype("<f4")
+
+_GRID_FILE = re.compile(r"^grid_(conc|time)_(\d{14})_(\d{3})$")
+# Records of the sparse dumps of the wet deposition, dry deposition and concentration of a release point
+# and age class: the number of runs, the indices of their first cells, the number of values, the values
+_RECORDS_PER_FIELD = 4
+_FIELDS = ("wet_deposition", "dry_deposition", "concentration")
+# The output steps and the simulation options of the header, in the order of their records
+_OUTPUT_STEPS = ("loutstep", "loutaver", "loutsample")
+_OPTIONS = ("method", "lsubgrid", "lconvection", "ind_source", "ind_receptor")
+
+
+class ReleasePoint(BaseModel):
+    # Seconds of the start and end of the release relative to the simulation start
+    start: int
+    end: int
+    kindz: int
+    lon1: float
+    lat1: float
+    lon2: float
+    lat2: float
+    z1: float
+    z2: float
+    particles: int
+    name: str
+    # Mass released of each species
+    mass: list[float]
+
+
+class BinaryHeader(BaseModel):
+    # Date and time of the simulation start, the end for backward runs, as YYYYMMDD and HHMMSS
+    date: str
+    time: str
+    version: str
+    loutstep: int
+    loutaver: int
+    loutsample: int
+    grid: OutputGrid
+    outheight: list[float]
+    species: list[str]
+    numpointspec: int
+    releases: list[ReleasePoint]
+    method: int
+    lsubgrid: int
+    lconvection: int
+    ind_source: int
+    ind_receptor: int
+    lage: list[int]
+
+    @property
+    def nageclass(self) -> int:
+        return len(self.lage)
+
+    @property
+    def longitude(self) -> np.ndarray:
+        return self.grid.outlon0 + self.grid.dxout * np.arange(self.grid.numxgrid)
+
+    @property
+    def latitude(self) -> np.ndarray:
+        return self.grid.outlat0 + self.grid.dyout * np.arange(self.grid.numygrid)
+
+
+class SparseField:
+    """The non-zero cells of a field, as flat indices into an array of shape and their values."""
+
+    def __init__(self, indices: np.ndarray, values: np.ndarray, shape: tuple[int, ...]) -> None:
+        self.indices = indices
+        self.values = values
+        self.shape = shape
+
+    def to_dense(self) -> np.ndarray:
+        dense = np.zeros(int(np.prod(self.shape)), dtype=self.values.dtype)
+        dense[self.indices] = self.values
+        return dense.reshape(self.shape)
+
+
+class GridFields:
+    """The sparse fields of a grid file, indexed [pointspec][nageclass], and its time in seconds since the start."""
+
+    def __init__(self, itime: int, wet_deposition: list[list[SparseField]], dry_deposition: list[list[SparseField]],
+                 concentration: list[list[SparseField]]) -> None:
+        self.itime = itime
+        self.wet_deposition = wet_deposition
+        self.dry_deposition = dry_deposition
+        self.concentration = concentration
+
+
+class BinaryGridOutput:
+    """
+    The binary grid output of a species in the output directory of a job, its fields decoded per output time.
+    Dense fields have the dimensions (nageclass, pointspec, height, latitude, longitude) of the concentration,
+    and (nageclass, pointspec, latitude, longitude) of the deposition.
+    """
+
+    def __init__(self, output_dir: Path, species: int = 1) -> None:
+        self.header = read_header(output_dir / "header")
+        matches = sorted(
+            (match.group(2), path)
+            for path in output_dir.iterdir()
+            if (match := _GRID_FILE.match(path.name)) and int(match.group(3)) == species
+        )
+        self.paths = [path for _, path in matches]
+        self.times = [datetime.strptime(timestamp, "%Y%m%d%H%M%S") for timestamp, _ in matches]
+        _logger.info("Found %d grid files of species %03d in %s", len(self.paths), species, output_dir)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def __iter__(self) -> Iterator[tuple[datetime, np.ndarray]]:
+        """The output times and their dense concentration, one output time decoded at a time."""
+        for index, time in enumerate(self.times):
+            yield time, self.concentration(index)
+
+    def fields(self, index: int) -> GridFields:
+        """The sparse fields of the output time at index."""
+        return read_grid_fields(self.paths[index], self.header)
+
+    def concentration(self, index: int) -> np.ndarray:
+        return _stack(self.fields(index).concentration)
+
+    def deposition(self, index: int) -> tuple[np.ndarray, np.ndarray]:
+        """The dense wet and dry deposition of the output time at index."""
+        fields = self.fields(index)
+        return _stack(fields.wet_deposition), _stack(fields.dry_deposition)
+
+
+def read_header(path: Path) -> BinaryHeader:
+    """Read the header file of the binary output, written by writeheader.f90."""
+    records = iter(_read_records(path))
+
+    record = next(records)
+    date, time = _ints(record[:8])
+    version = _string(record[8:])
+    output_steps = dict(zip(_OUTPUT_STEPS, _ints(next(records))))
+    grid, outheight = _read_grid(records)
+    # Date and time of the simulation start
+    next(records)
+    numpointspec, species = _read_species(records)
+    (numpoint,) = _ints(next(records))
+    releases = [_read_release(records, len(species)) for _ in range(numpoint)]
+    options = dict(zip(_OPTIONS, _ints(next(records))))
+    lage = _ints(next(records)[4:])
+
+    return BinaryHeader(date=f"{date:08}", time=f"{time:06}", version=version, grid=grid, outheight=outheight,
+                        species=species, numpointspec=numpointspec, releases=releases, lage=lage, **output_steps,
+                        **options)
+
+
+def _read_grid(records: Iterator[np.ndarray]) -> tuple[OutputGrid, list[float]]:
+    """The output grid and the heights of its levels, from their records in the header."""
+    record = next(records)
+    outlon0, outlat0 = _reals(record[:8])
+    numxgrid, numygrid = _ints(record[8:16])
+    dxout, dyout = _reals(record[16:24])
+    grid = OutputGrid(outlon0=outlon0, outlat0=outlat0, numxgrid=numxgrid, numygrid=numygrid, dxout=dxout,
+                      dyout=dyout)
+    return grid, _reals(next(records)[4:])
+
+
+def _read_species(records: Iterator[np.ndarray]) -> tuple[int, list[str]]:
+    """The number of release points of the fields and the names of the species, from their records in the header."""
+    nspec3, numpointspec = _ints(next(records))
+    species = []
+    for _ in range(nspec3 // 3):
+        # The records of the wet and dry deposition precede the record of the concentration.
+        next(records)
+        next(records)
+        species.append(_string(next(records)[4:]))
+    return numpointspec, species
+
+
+def _read_release(records: Iterator[np.ndarray], nspecies: int) -> ReleasePoint:
+    """A release point, from its records in the header."""
+    start, end, kindz = _ints(next(records))
+    lon1, lat1, lon2, lat2, z1, z2 = _reals(next(records))
+    particles, _ = _ints(next(records))
+    name = _string(next(records))
+    mass = []
+    for _ in range(nspecies):
+        # The mass is written once for each of the three fields of the species.
+        mass.append(_reals(next(records))[0])
+        next(records)
+        next(records)
+    return ReleasePoint(start=start, end=end, kindz=kindz, lon1=lon1, lat1=lat1, lon2=lon2, lat2=lat2, z1=z1, z2=z2,
+                        particles=particles, name=name, mass=mass)
+
+
+def read_orography(path: Path, header: BinaryHeader) -> np.ndarray:
+    """The topography of the output grid in the header file, with dimensions (latitude, longitude)."""
+    records = _read_records(path)
+    # The last records of the header, one per longitude
+    rows = records[len(records) - header.grid.numxgrid:]
+    return np.stack([row.view(_REAL) for row in rows], axis=1)
+
+
+def read_grid_fields(path: Path, header: BinaryHeader) -> GridFields:
+    """Decode the sparse dumps of the grid file at path, written by concoutput.f90."""
+    records = _read_records(path)
+    (itime,) = _ints(records[0])
+    shape_2d = (header.grid.numygrid, header.grid.numxgrid)
+    shape_3d = (len(header.outheight), *shape_2d)
+    # The flat indices of the concentration count the heights from 1.
+    offsets = {"wet_deposition": 0, "dry_deposition": 0, "concentration": header.grid.numxgrid * header.grid.numygrid}
+
+    fields: dict[str, list[list[SparseField]]] = {name: [] for name in _FIELDS}
+    position = 1
+    for _ in range(header.numpointspec):
+        for name in _FIELDS:
+            fields[name].append([])
+        for _ in range(header.nageclass):
+            for name in _FIELDS:
+                starts = records[position + 1].view(_INT)
+                values = records[position + 3].view(_REAL)
+                indices, values = decode_sparse(starts, values)
+                shape = shape_3d if name == "concentration" else shape_2d
+                fields[name][-1].append(SparseField(indices - offsets[name], values, shape))
+                position += _RECORDS_PER_FIELD
+    return GridFields(itime, **fields)
+
+
+def decode_sparse(starts: np.ndarray, values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    The flat indices and values of the cells of a sparse dump, from the first cell of each run of non-zero
+    cells and the values of all the runs, whose sign alternates between runs.
+    """
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=_REAL)
+    negative = values < 0
+    new_run = np.empty(len(values), dtype=bool)
+    new_run[0] = True
+    np.not_equal(negative[1:], negative[:-1], out=new_run[1:])
+    run = np.cumsum(new_run) - 1
+    if run[-1] + 1 != len(starts):
+        raise RuntimeError(f"Sparse dump of {len(starts)} runs has values of {run[-1] + 1} runs")
+    run_start = np.flatnonzero(new_run)
+    indices = starts.astype(np.int64)[run] + (np.arange(len(values)) - run_start[run])
+    return indices, np.abs(values)
+
+
+def _stack(fields: list[list[SparseField]]) -> np.ndarray:
+    """Dense array of fields indexed [pointspec][nageclass], with the age class as the first dimension."""
+    return np.stack([np.stack([field.to_dense() for field in ages]) for ages in fields], axis=1)
+
+
+def _read_records(path: Path) -> list[np.ndarray]:
+    """The records of a Fortran unformatted sequential file, as byte views of the memory-mapped file."""
+    if path.stat().st_size == 0:
+        return []
+    data = np.memmap(path, dtype=np.uint8, mode="r")
+    records = []
+    offset = 0
+    while offset < len(data):
+        (length,) = data[offset:offset + 4].view(_MARKER)
+        end = offset + 4 + length
+        if end + 4 > len(data) or data[end:end + 4].view(_MARKER)[0] != length:
+            raise RuntimeError(f"Invalid Fortran record of {length} bytes at offset {offset} of {path}")
+        records.append(data[offset + 4:end])
+        offset = end + 4
+    return records
+
+
+def _ints(record: np.ndarray) -> list[int]:
+    """The 4 byte integers of a record."""
+    return [int(value) for value in record.view(_INT)]
+
+
+def _reals(record: np.ndarray) -> list[float]:
+    """The 4 byte reals of a record."""
+    return [float(value) for value in record.view(_REAL)]
+
+
+def _string(record: np.ndarray) -> str:
+    return record.tobytes().decode("ascii", errors="replace").strip()
@@ -0,0 +1,142 @@
+"""
+The module holds the catalogue of the GRIB objects of the input bucket in columns: the keys,
+and NumPy arrays of the forecast reference times, steps and domains of the objects. A model object
+per key and a loop over them to compute valid times with datetime arithmetic cost time and memory
+in proportion to the whole bucket, which retains many cycles, whereas only a window of one cycle
+is selected from it.
+
+The valid times are computed for all objects at once, and sorted once, so that selecting a time
+window is a binary search. Objects of several cycles valid at the same time in the same domain
+are deduplicated, keeping the latest cycle. Objects without a domain in their metadata are assigned
+the prefix of their file name, dispc or dispf.
+"""
+
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable
+
+import numpy as np
+
+# Minutes per step, for the configured step unit of the input
+_STEP_MINUTES = {"minutes": 1, "hours": 60}
+
+
+class GribCatalogue:
+    """Keys of GRIB objects with their forecast reference time, step and domain, in arrays indexed alike."""
+
+    def __init__(self, keys: list[str], cycles: np.ndarray, steps: np.ndarray, domains: np.ndarray,
+                 domain_names: list[str]) -> None:
+        self.keys = np.array([sys.intern(key) for key in keys], dtype=object)
+        self.cycles = cycles.astype("datetime64[m]")
+        self.steps = steps.astype(np.float64)
+        self.domains = domains.astype(np.int16)
+        self.domain_names = domain_names
+        # Valid times sorted, and the order sorting them, by step unit
+        self._sorted: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+
+    @classmethod
+    def from_metadata(cls, objects: Iterable[tuple[str, dict[str, str]]]) -> "GribCatalogue":
+        """The catalogue of (key, user metadata) pairs, from the 'data' entry of the user metadata of each object."""
+        return cls.from_records((key, json.loads(user_metadata["data"])) for key, user_metadata in objects)
+
+    @classmethod
+    def from_records(cls, records: Iterable[tuple[str, dict[str, Any]]]) -> "GribCatalogue":
+        """The catalogue of (key, metadata) pairs, the metadata holding the date, time, step and domain of objects."""
+        keys: list[str] = []
+        dates: list[int] = []
+        times: list[int] = []
+        steps: list[float] = []
+        domains: list[int] = []
+        domain_codes: dict[str, int] = {}
+
+        for key, metadata in records:
+            missing = [k for k in ("time", "date", "step") if k not in metadata]
+            if missing:
+                raise KeyError(f"S3 object '{key}' is missing required metadata keys: {missing}")
+            keys.append(key)
+            dates.append(int(metadata["date"]))
+            times.append(int(metadata["time"]))
+            steps.append(float(metadata["step"]))
+            domain = metadata.get("domain") or _name_prefix(key)
+            domains.append(domain_codes.setdefault(domain, len(domain_codes)))
+
+        return cls(keys, _cycles(np.array(dates, dtype=np.int64), np.array(times, dtype=np.int64)),
+                   np.array(steps), np.array(domains), list(domain_codes))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def valid_times(self, step_unit: str) -> np.ndarray:
+        """The valid time of each object, its forecast reference time plus its step in step_unit."""
+        step_unit = step_unit.lower()
+        if step_unit not in _STEP_MINUTES:
+            raise ValueError(f"Steps must be provided in either minutes or hours, not {step_unit}")
+        minutes = np.rint(self.steps * _STEP_MINUTES[step_unit]).astype(np.int64)
+        return self.cycles + minutes.astype("timedelta64[m]")
+
+    def covers(self, start: datetime, end: datetime, step_unit: str) -> bool:
+        """Whether objects are valid at or before start and at or after end."""
+        valid, _ = self._sorted_valid_times(step_unit)
+        return bool(len(valid)) and valid[0] <= _minutes(start) and valid[-1] >= _minutes(end)
+
+    def latest_cycle(self) -> datetime | None:
+        """The latest forecast reference time of the objects, None if there are none."""
+        return self.cycles.max().astype(datetime) if len(self) else None
+
+    def cycle_keys(self, cycle: datetime) -> list[str]:
+        """The keys of the objects of the forecast started at cycle, by step."""
+        indices: np.ndarray = np.flatnonzero(self.cycles == _minutes(cycle))
+        return self.keys[indices[np.argsort(self.steps[indices], kind="stable")]].tolist()
+
+    def select(
+        self,
+        start: datetime,
+        end: datetime,
+        step_unit: str,
+        latest_cycle: datetime | None = None,
+    ) -> list[str]:
+        """
+        The keys of the objects valid between start and end inclusive, of forecasts started at latest_cycle
+        or before, if given. Of the objects valid at the same time in the same domain, only the one of
+        the latest cycle is kept. The keys are sorted by domain and valid time.
+        """
+        valid, order = self._sorted_valid_times(step_unit)
+        lo = np.searchsorted(valid, _minutes(start), side="left")
+        hi = np.searchsorted(valid, _minutes(end), side="right")
+        selected, selected_valid = order[lo:hi], valid[lo:hi]
+        if latest_cycle is not None:
+            mask = self.cycles[selected] <= _minutes(latest_cycle)
+            selected, selected_valid = selected[mask], selected_valid[mask]
+
+        # Sorted by domain, valid time and latest cycle first, the first of each (domain, valid time) is kept.
+        by_domain = np.lexsort((-self.cycles[selected].astype(np.int64), selected_valid, self.domains[selected]))
+        selected, selected_valid = selected[by_domain], selected_valid[by_domain]
+        domains = self.domains[selected]
+        first = np.ones(len(selected), dtype=bool)
+        first[1:] = (domains[1:] != domains[:-1]) | (selected_valid[1:] != selected_valid[:-1])
+        return self.keys[selected[first]].tolist()
+
+    def _sorted_valid_times(self, step_unit: str) -> tuple[np.ndarray, np.ndarray]:
+        if step_unit not in self._sorted:
+            valid = self.valid_times(step_unit)
+            order = np.argsort(valid, kind="stable")
+            self._sorted[step_unit] = valid[order], order
+        return self._sorted[step_unit]
+
+
+def _minutes(time: datetime) -> np.datetime64:
+    """time as a datetime64 in minutes, the unit of the forecast reference and valid times of the catalogue."""
+    return np.datetime64(time.isoformat(timespec="minutes"), "m")
+
+
+def _cycles(dates: np.ndarray, times: np.ndarray) -> np.ndarray:
+    """Forecast reference times from dates as YYYYMMDD and times as HHMM integers."""
+    months = (dates // 10000 - 1970) * 12 + dates // 100 % 100 - 1
+    days = months.astype("datetime64[M]").astype("datetime64[D]") + (dates % 100 - 1).astype("timedelta64[D]")
+    return days.astype("datetime64[m]") + (times // 100 * 60 + times % 100).astype("timedelta64[m]")
+
+
+def _name_prefix(key: str) -> str:
+    return Path(key).name.rstrip("0123456789")
@@ -0,0 +1,64 @@
+"""
+The module verifies downloaded objects against a checksum computed while their body is streamed,
+so that a corrupted download is caught without reading the file a second time.
+
+An object is verified against the SHA-256 stored in its 'sha256' user metadata if present,
+otherwise against its ETag when the ETag is the MD5 of the content: objects uploaded in a single
+part without KMS encryption. The ETags of multipart uploads depend on the part size used by the
+uploader and are not verified, only the size of these objects is.
+"""
+
+import hashlib
+import logging
+import re
+from typing import Any
+
+_logger = logging.getLogger(__name__)
+
+SHA256_METADATA_KEY = "sha256"
+
+_MD5_ETAG = re.compile(r"^[0-9a-f]{32}$")
+
+
+def expected_checksum(response: dict[str, Any]) -> tuple[str, str] | None:
+    """The algorithm and hex digest the body of a GetObject or HeadObject response can be verified against."""
+    metadata = response.get("Metadata") or {}
+    if SHA256_METADATA_KEY in metadata:
+        return "sha256", metadata[SHA256_METADATA_KEY].lower()
+
+    etag = (response.get("ETag") or "").strip('"')
+    if _MD5_ETAG.match(etag) and response.get("ServerSideEncryption") != "aws:kms":
+        return "md5", etag
+
+    return None
+
+
+class StreamingChecksum:
+    """Checksum and size of an object body, updated chunk by chunk as it is streamed."""
+
+    def __init__(self, key: str, response: dict[str, Any]) -> None:
+        self.key = key
+        self.expected = expected_checksum(response)
+        self.expected_size: int | None = response.get("ContentLength")
+        self.size = 0
+        self._hash = hashlib.new(self.expected[0]) if self.expected else None
+
+    def update(self, chunk: bytes) -> None:
+        self.size += len(chunk)
+        if self._hash is not None:
+            self._hash.update(chunk)
+
+    def verify(self) -> None:
+        """Raise a RuntimeError if the size or the checksum of the streamed body do not match the object."""
+        if self.expected_size is not None and self.size != self.expected_size:
+            raise RuntimeError(f"Downloaded {self.size} bytes of {self.key}, expected {self.expected_size}.")
+
+        if self.expected is None or self._hash is None:
+            _logger.debug("No checksum to verify %s against, only its size was checked.", self.key)
+            return
+
+        algorithm, digest = self.expected
+        if self._hash.hexdigest() != digest:
+            raise RuntimeError(
+                f"{algorithm} checksum of {self.key} is {self._hash.hexdigest()}, expected {digest}."
+            )
@@ -0,0 +1,112 @@
+"""
+The module converts the NetCDF output of Flexpart into Zarr stores, so that consumers of the
+output bucket can read single output times or species with byte-range requests instead of
+downloading whole NetCDF files. The stores use the Zarr v2 format with consolidated metadata,
+which xarray and other Zarr readers open directly from S3.
+"""
+
+import glob
+import logging
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any
+
+import netCDF4
+import numcodecs
+import numpy as np
+import zarr
+
+from flexpart_ifs_utils.config.service_settings import ZarrConfig
+from flexpart_ifs_utils.timing import timed
+
+_logger = logging.getLogger(__name__)
+
+
+@timed("convert_to_zarr")
+def convert_output_to_zarr(
+    jobs_dir: Path,
+    zarr_config: ZarrConfig,
+    max_workers: int,
+) -> list[Path]:
+    """Convert the NetCDF output of all release sites in jobs_dir to Zarr stores next to the NetCDF files."""
+    path_list = sorted(Path(f) for f in glob.iglob(f"{jobs_dir}/*/output/*.nc"))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(convert_to_zarr, path, path.with_suffix(".zarr"), zarr_config)
+            for path in path_list
+        ]
+        return [future.result() for future in futures]
+
+
+def convert_to_zarr(path: Path, store_path: Path, zarr_config: ZarrConfig) -> Path:
+    """Write the NetCDF file at path as a Zarr store, chunked by output time."""
+    _logger.info("Converting %s to Zarr store %s", path, store_path)
+
+    if store_path.exists():
+        shutil.rmtree(store_path)
+
+    compressor = numcodecs.Blosc(cname="zstd", clevel=zarr_config.complevel, shuffle=numcodecs.Blosc.SHUFFLE)
+
+    with netCDF4.Dataset(path, "r") as src:
+        src.set_auto_maskandscale(False)
+
+        root = zarr.open_group(store_path, mode="w", zarr_format=2)
+        root.attrs.update({name: _to_json(src.getncattr(name)) for name in src.ncattrs()})
+
+        for name, var in src.variables.items():
+            attrs = {attr: _to_json(var.getncattr(attr)) for attr in var.ncattrs() if attr != "_FillValue"}
+            attrs["_ARRAY_DIMENSIONS"] = list(var.dimensions)
+
+            array = root.create_array(
+                name,
+                shape=var.shape,
+                chunks=_chunks(var, zarr_config.time_chunk),
+                dtype=var.dtype,
+                compressors=compressor,
+                fill_value=var.getncattr("_FillValue") if "_FillValue" in var.ncattrs() else None,
+                attributes=attrs,
+            )
+            _copy_by_time(var, array, zarr_config.time_chunk)
+
+    zarr.consolidate_metadata(store_path)
+    return store_path
+
+
+def _chunks(var: netCDF4.Variable, time_chunk: int) -> tuple[int, ...]:
+    """One chunk holds the full horizontal field for time_chunk output times of one level/release/age class."""
+    if "time" not in var.dimensions or var.ndim == 1:
+        return tuple(max(size, 1) for size in var.shape)
+
+    chunks = []
+    for dim, size in zip(var.dimensions, var.shape):
+        if dim in ("latitude", "longitude"):
+            chunks.append(max(size, 1))
+        elif dim == "time":
+            chunks.append(max(min(time_chunk, size), 1))
+        else:
+            chunks.append(1)
+    return tuple(chunks)
+
+
+def _copy_by_time(var: netCDF4.Variable, array: zarr.Array, time_chunk: int) -> None:
+    if "time" not in var.dimensions or var.ndim == 1:
+        array[...] = var[...]
+        return
+
+    time_axis = var.dimensions.index("time")
+    n_times = var.shape[time_axis]
+    for start in range(0, n_times, time_chunk):
+        index = [slice(None)] * var.ndim
+        index[time_axis] = slice(start, min(start + time_chunk, n_times))
+        array[tuple(index)] = var[tuple(index)]
+
+
+def _to_json(value: Any) -> Any:
+    """NetCDF attributes are numpy scalars or arrays, Zarr attributes must be JSON serializable."""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
@@ -0,0 +1,176 @@
+"""
+The module compares the NetCDF output of two runs of Flexpart, to check that a change of the threads,
+of the MPI build or of the compiler flags keeps the output within tolerances. The output trees are
+compared file by file, by the paths of their .nc files relative to the tree, and variable by variable.
+
+Variables with a time dimension are read a few output times at a time, so the memory used is bounded by
+the size of the fields of a block of output times, and the statistics are accumulated over the blocks:
+
+- the maximum absolute error, and the maximum relative error, the maximum absolute error relative to the
+  maximum absolute value of the reference,
+- the mass error, the difference of the sums of the fields relative to the sum of the reference, which
+  checks the mass balance of concentrations and depositions,
+- the Pearson correlation of the fields with the reference.
+
+A variable fails if its relative error or mass error exceeds the tolerances, or its correlation is below
+the minimum. Files or variables present in one of the trees only, and variables of different shapes or
+of different character values, fail too.
+"""
+
+import glob
+import logging
+import math
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import netCDF4
+import numpy as np
+from pydantic import BaseModel
+
+from flexpart_ifs_utils.config.service_settings import CompareConfig
+from flexpart_ifs_utils.netcdf_output import time_blocks
+from flexpart_ifs_utils.timing import timed
+
+_logger = logging.getLogger(__name__)
+
+
+class VariableComparison(BaseModel):
+    name: str
+    max_abs_error: float | None = None
+    max_rel_error: float | None = None
+    mass_error: float | None = None
+    correlation: float | None = None
+    failures: list[str] = []
+
+
+class FileComparison(BaseModel):
+    path: str
+    variables: list[VariableComparison] = []
+    failures: list[str] = []
+
+    @property
+    def failed(self) -> bool:
+        return bool(self.failures) or any(variable.failures for variable in self.variables)
+
+
+class _Moments:
+    """Sums over the blocks of a variable, from which its statistics are computed."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.max_abs_error = 0.
+        self.max_abs_reference = 0.
+        self.sums = np.zeros(5)
+
+    def add(self, reference: np.ndarray, candidate: np.ndarray) -> None:
+        reference, candidate = reference.astype(np.float64).ravel(), candidate.astype(np.float64).ravel()
+        if reference.size == 0:
+            return
+        self.count += reference.size
+        self.max_abs_error = max(self.max_abs_error, float(np.max(np.abs(candidate - reference))))
+        self.max_abs_reference = max(self.max_abs_reference, float(np.max(np.abs(reference))))
+        self.sums += [reference.sum(), candidate.sum(), reference @ reference, candidate @ candidate,
+                      reference @ candidate]
+
+    def comparison(self, name: str, config: CompareConfig) -> VariableComparison:
+        sum_ref, sum_cand, sum_ref2, sum_cand2, sum_prod = self.sums
+        max_rel_error = _ratio(self.max_abs_error, self.max_abs_reference)
+        mass_error = _ratio(abs(sum_cand - sum_ref), abs(sum_ref))
+
+        var_ref = sum_ref2 - sum_ref ** 2 / max(self.count, 1)
+        var_cand = sum_cand2 - sum_cand ** 2 / max(self.count, 1)
+        covariance = sum_prod - sum_ref * sum_cand / max(self.count, 1)
+        if var_ref > 0 and var_cand > 0:
+            correlation = float(covariance / math.sqrt(var_ref * var_cand))
+        else:
+            # Constant fields are correlated if they are equal.
+            correlation = 1. if self.max_abs_error == 0 else 0.
+
+        failures = []
+        if max_rel_error > config.max_rel_error:
+            failures.append(f"relative error {max_rel_error:.3g} above {config.max_rel_error:.3g}")
+        if mass_error > config.max_mass_error:
+            failures.append(f"mass error {mass_error:.3g} above {config.max_mass_error:.3g}")
+        if correlation < config.min_correlation:
+            failures.append(f"correlation {correlation:.6f} below {config.min_correlation:.6f}")
+        return VariableComparison(name=name, max_abs_error=self.max_abs_error, max_rel_error=max_rel_error,
+                                  mass_error=mass_error, correlation=correlation, failures=failures)
+
+
+@timed("compare")
+def compare_outputs(reference_dir: Path, candidate_dir: Path, config: CompareConfig,
+                    max_workers: int) -> list[FileComparison]:
+    """Compare the NetCDF files of the output trees reference_dir and candidate_dir, a file per process."""
+    reference = _nc_files(reference_dir)
+    candidate = _nc_files(candidate_dir)
+
+    comparisons = [FileComparison(path=path, failures=["missing in the candidate output"])
+                   for path in sorted(reference - candidate)]
+    comparisons += [FileComparison(path=path, failures=["missing in the reference output"])
+                    for path in sorted(candidate - reference)]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(compare_files, reference_dir / path, candidate_dir / path, path, config)
+            for path in sorted(reference & candidate)
+        ]
+        comparisons += [future.result() for future in futures]
+
+    for comparison in comparisons:
+        for failure in comparison.failures:
+            _logger.error("%s: %s", comparison.path, failure)
+        for variable in comparison.variables:
+            for failure in variable.failures:
+                _logger.error("%s, %s: %s", comparison.path, variable.name, failure)
+    _logger.info("Compared %d files, %d out of tolerance", len(comparisons),
+                 sum(comparison.failed for comparison in comparisons))
+    return comparisons
+
+
+def compare_files(reference_path: Path, candidate_path: Path, name: str, config: CompareConfig) -> FileComparison:
+    _logger.info("Comparing %s with %s", candidate_path, reference_path)
+    comparison = FileComparison(path=name)
+
+    with netCDF4.Dataset(reference_path, "r") as reference, netCDF4.Dataset(candidate_path, "r") as candidate:
+        reference.set_auto_maskandscale(False)
+        candidate.set_auto_maskandscale(False)
+
+        for var_name in sorted(set(candidate.variables) - set(reference.variables)):
+            comparison.failures.append(f"variable {var_name} missing in the reference output")
+        for var_name, ref_var in reference.variables.items():
+            if var_name not in candidate.variables:
+                comparison.failures.append(f"variable {var_name} missing in the candidate output")
+                continue
+            comparison.variables.append(compare_variables(var_name, ref_var, candidate[var_name], config))
+    return comparison
+
+
+def compare_variables(name: str, reference: netCDF4.Variable, candidate: netCDF4.Variable,
+                      config: CompareConfig) -> VariableComparison:
+    if reference.shape != candidate.shape or reference.dimensions != candidate.dimensions:
+        return VariableComparison(name=name, failures=[
+            f"dimensions {candidate.dimensions} {candidate.shape} differ from {reference.dimensions} {reference.shape}"
+        ])
+    if reference.dtype.kind not in "biuf":
+        equal = np.array_equal(reference[...], candidate[...])
+        return VariableComparison(name=name, failures=[] if equal else ["values differ"])
+
+    moments = _Moments()
+    if "time" in reference.dimensions and reference.ndim > 1:
+        time_axis = reference.dimensions.index("time")
+        for (_, ref_block), (_, cand_block) in zip(time_blocks(reference, time_axis, config.time_chunk),
+                                                   time_blocks(candidate, time_axis, config.time_chunk)):
+            moments.add(ref_block, cand_block)
+    else:
+        moments.add(np.asarray(reference[...]), np.asarray(candidate[...]))
+    return moments.comparison(name, config)
+
+
+def _nc_files(directory: Path) -> set[str]:
+    return {Path(f).relative_to(directory).as_posix() for f in glob.iglob(f"{directory}/**/*.nc", recursive=True)}
+
+
+def _ratio(error: float, scale: float) -> float:
+    if scale == 0:
+        return 0. if error == 0 else math.inf
+    return error / scale
@@ -1,7 +1,14 @@
+from typing import Literal
+
 from mchpy.audit.logger import LoggingSettings
 from mchpy.config.base_settings import BaseServiceSettings
 from pydantic import BaseModel
 
+# Compression codecs and levels accepted by netCDF4.Dataset.createVariable
+CompressionCodec = Literal["zlib", "szip", "zstd", "bzip2", "blosc_lz", "blosc_lz4", "blosc_lz4hc", "blosc_zlib",
+                           "blosc_zstd"]
+CompressionLevel = Literal[0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
+
 
 class Bucket(BaseModel):
     region: str
@@ -12,21 +19,120 @@ class S3(BaseModel):
     nwp_model_data: Bucket
     output: Bucket
 
+class TransferConfig(BaseModel):
+    engine: str
+    max_concurrency: int
+    part_size: int
+
 class AWS(BaseModel):
     s3: S3
+    transfer: TransferConfig
+
+class SubsetConfig(BaseModel):
+    lon_extent: float
+    lat_extent: float
+    margin: float
+    max_workers: int
+
+class RepackConfig(BaseModel):
+    packing_type: str
+    bits_per_value: int | None
+    max_workers: int
+
+class PrefetchConfig(BaseModel):
+    cache_dir: str
+    poll_interval: float
+    max_bandwidth: int | None
+    max_disk_usage: int | None
 
 class InputSettings(BaseModel):
     step_unit: str
+    subset: SubsetConfig | None
+    repack: RepackConfig | None
+    prefetch: PrefetchConfig | None
+
+class MPIConfig(BaseModel):
+    ranks: int
+    launcher: str
+    binding: str | None
 
 class OpenMPConfig(BaseModel):
     num_threads: int
     stack_size: str
+    mpi: MPIConfig | None
+
+class ScratchConfig(BaseModel):
+    path: str
+    stage_input: bool
+
+class CompressionConfig(BaseModel):
+    compression: CompressionCodec
+    complevel: CompressionLevel
+    time_chunk: int
+    spatial_chunk: int
+    significant_digits: int | None
+
+class ZarrConfig(BaseModel):
+    time_chunk: int
+    complevel: int
+
+class ParticleDumpConfig(BaseModel):
+    chunk_size: int
+    complevel: int
+    bbox: list[float] | None
+    interval: int | None
+
+class DerivedProductsConfig(BaseModel):
+    sites: list[str]
+    time_chunk: int
+    arrival_threshold: float
+    thresholds: list[float]
+
+class ReceptorsConfig(BaseModel):
+    path: str
+    sites: list[str]
+    time_chunk: int
+
+class OutputSettings(BaseModel):
+    max_workers: int
+    memoize: bool
+    compression: CompressionConfig | None
+    zarr: ZarrConfig | None
+    particles: ParticleDumpConfig | None
+    derived_products: DerivedProductsConfig | None
+    receptors: ReceptorsConfig | None
+
+class ServeConfig(BaseModel):
+    queue_type: str
+    queue_path: str
+    max_concurrent_runs: int
+    poll_interval: float
+
+class PlannerConfig(BaseModel):
+    stats_path: str
+    deadline: float
+    thread_counts: list[int]
+    min_particles: int
+    max_particles: int
+    min_runs: int
+    max_runs: int
+
+class CompareConfig(BaseModel):
+    max_rel_error: float
+    max_mass_error: float
+    min_correlation: float
+    time_chunk: int
 
 class AppSettings(BaseModel):
     app_name: str
     aws: AWS
     input: InputSettings
+    output: OutputSettings
     openmp_config: OpenMPConfig
+    scratch: ScratchConfig | None
+    serve: ServeConfig | None
+    planner: PlannerConfig | None
+    compare: CompareConfig
 
 class ServiceSettings(BaseServiceSettings):
     logging: LoggingSettings
@@ -0,0 +1,165 @@
+"""
+The module derives emergency-response products from the NetCDF output of Flexpart:
+the time-integrated concentration, the peak concentration and the plume arrival time,
+exceedance maps for a set of concentration thresholds, and the total wet, dry and
+total deposition. The concentration fields are read a few output times at a time,
+so memory use is bounded by the size of one horizontal field per accumulated product.
+The products of grid_conc_<datetime>.nc are written to derived_<datetime>.nc in the same directory.
+"""
+
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import netCDF4
+import numpy as np
+
+from flexpart_ifs_utils.config.service_settings import DerivedProductsConfig
+from flexpart_ifs_utils.netcdf_output import (CONCENTRATION, DEPOSITION,
+                                              grid_conc_files, time_blocks)
+from flexpart_ifs_utils.timing import timed
+
+_logger = logging.getLogger(__name__)
+
+_COORDINATES = ("latitude", "longitude", "height")
+
+
+@timed("derive_products")
+def derive_products(
+    jobs_dir: Path,
+    config: DerivedProductsConfig,
+    max_workers: int,
+) -> list[Path]:
+    """Derive the products for the configured release sites found in jobs_dir, one output file per process."""
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(derive_products_from_file, path, config)
+                   for path in grid_conc_files(jobs_dir, config.sites)]
+        return [future.result() for future in futures]
+
+
+def derive_products_from_file(path: Path, config: DerivedProductsConfig) -> Path:
+    out_path = path.with_name(path.name.replace("grid_conc_", "derived_", 1))
+    _logger.info("Deriving products from %s into %s", path, out_path)
+
+    thresholds = np.asarray(config.thresholds, dtype=np.float32)
+
+    with netCDF4.Dataset(path, "r") as src, netCDF4.Dataset(out_path, "w", format="NETCDF4") as dst:
+        src.set_auto_maskandscale(False)
+        times = src["time"][:].astype(np.float64)
+        # Flexpart output times are the ends of the averaging intervals, in seconds since the simulation start.
+        durations = np.diff(times, prepend=0.)
+
+        _init_output(src, dst, len(thresholds))
+        dst["threshold"][:] = thresholds
+
+        deposition_totals: dict[str, np.ndarray] = {}
+
+        for name, var in src.variables.items():
+            if CONCENTRATION.match(name):
+                integral, peak, arrival = _accumulate_concentration(
+                    var, times, durations, config.arrival_threshold, config.time_chunk
+                )
+                dims = _without_time(var.dimensions)
+                units = var.getncattr("units")
+                _write(dst, f"{name}_integrated", dims, integral, f"{units} s",
+                       "time-integrated concentration")
+                _write(dst, f"{name}_peak", dims, peak, units, "peak concentration")
+                _write(dst, f"{name}_arrival_time", dims, arrival, "seconds",
+                       f"first output time with concentration above {config.arrival_threshold} {units}")
+                exceedance = dst.createVariable(f"{name}_exceedance", "i1", ("threshold", *dims), zlib=True)
+                exceedance.long_name = "peak concentration exceeds threshold"
+                exceedance[:] = (peak[np.newaxis, ...] > _expand(thresholds, peak.ndim + 1)).astype(np.int8)
+
+            elif match := DEPOSITION.match(name):
+                total = _accumulate_sum(var, config.time_chunk)
+                dims = _without_time(var.dimensions)
+                _write(dst, f"{name}_total", dims, total, var.getncattr("units"), f"total {match.group(1)} deposition")
+
+                species = match.group(2)
+                if species in deposition_totals:
+                    _write(dst, f"TD_{species}_total", dims, deposition_totals.pop(species) + total,
+                           var.getncattr("units"), "total deposition")
+                else:
+                    deposition_totals[species] = total
+
+    return out_path
+
+
+def _accumulate_concentration(
+    var: netCDF4.Variable,
+    times: np.ndarray,
+    durations: np.ndarray,
+    arrival_threshold: float,
+    time_chunk: int,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    time_axis = var.dimensions.index("time")
+    shape = _without_time(var.shape, time_axis)
+
+    integral = np.zeros(shape, dtype=np.float64)
+    peak = np.zeros(shape, dtype=np.float32)
+    arrival = np.full(shape, np.nan, dtype=np.float32)
+
+    for start, block in time_blocks(var, time_axis, time_chunk):
+        stop = start + block.shape[time_axis]
+        weights = _expand(durations[start:stop], block.ndim, time_axis)
+        integral += (block * weights).sum(axis=time_axis)
+        peak = np.maximum(peak, block.max(axis=time_axis))
+
+        above = block > arrival_threshold
+        first = np.take(times[start:stop], above.argmax(axis=time_axis))
+        arrival = np.where(np.isnan(arrival) & above.any(axis=time_axis), first, arrival)
+
+    return integral.astype(np.float32), peak, arrival
+
+
+def _accumulate_sum(var: netCDF4.Variable, time_chunk: int) -> np.ndarray:
+    """Flexpart writes the deposition accumulated over each output interval, the total is their sum."""
+    time_axis = var.dimensions.index("time")
+    total = np.zeros(_without_time(var.shape, time_axis), dtype=np.float64)
+    for _, block in time_blocks(var, time_axis, time_chunk):
+        total += block.sum(axis=time_axis)
+    return total.astype(np.float32)
+
+
+def _init_output(src: netCDF4.Dataset, dst: netCDF4.Dataset, n_thresholds: int) -> None:
+    dst.title = "FLEXPART derived products"
+    dst.source = src.filepath()
+    for name, dim in src.dimensions.items():
+        if name != "time":
+            dst.createDimension(name, len(dim))
+    dst.createDimension("threshold", n_thresholds)
+    dst.createVariable("threshold", "f4", ("threshold",))
+
+    for name in _COORDINATES:
+        if name in src.variables:
+            var = src[name]
+            out = dst.createVariable(name, var.dtype, var.dimensions)
+            out.setncatts({attr: var.getncattr(attr) for attr in var.ncattrs()})
+            out[:] = var[:]
+
+
+def _write(
+    dst: netCDF4.Dataset,
+    name: str,
+    dims: tuple[str, ...],
+    data: np.ndarray,
+    units: str,
+    long_name: str,
+) -> None:
+    out = dst.createVariable(name, "f4", dims, zlib=True, fill_value=np.float32(np.nan))
+    out.units = units
+    out.long_name = long_name
+    out[:] = data
+
+
+def _without_time(values: tuple, time_axis: int | None = None) -> tuple:
+    if time_axis is None:
+        time_axis = values.index("time")
+    return values[:time_axis] + values[time_axis + 1:]
+
+
+def _expand(values: np.ndarray, ndim: int, axis: int = 0) -> np.ndarray:
+    """Reshape a 1D array to broadcast along axis of an ndim array."""
+    shape = [1] * ndim
+    shape[axis] = len(values)
+    return values.reshape(shape)
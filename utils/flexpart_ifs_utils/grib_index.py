@@ -0,0 +1,319 @@
+"""
+The module indexes the messages of GRIB edition 1 and 2 files by walking their section lengths,
+without decoding or copying the data sections. For each message the index holds its offset and
+length, edition, parameter, level, reference date and time, and step, read from the fixed octets
+of section 1 (and section 4 for edition 2).
+
+Files are read through a reader: local files are memory-mapped, so only the pages holding the
+headers are read from disk, and S3 objects are read with ranged GETs of the message headers.
+The index serves metadata queries, validation of the message framing, and fetching or subsetting
+single messages by their byte range, without creating an eccodes handle per query.
+
+For edition 2 messages holding several fields (repeated sections 2 to 7), the first field is indexed.
+"""
+
+import mmap
+from pathlib import Path
+from types import TracebackType
+from typing import Any, Iterator, Protocol
+
+from pydantic import BaseModel
+
+# Hours per unit of the indicator of unit of time range, by edition: GRIB1 code table 4 and GRIB2 code
+# table 4.4 differ from unit 13 on, 15 minutes in GRIB1 and seconds in GRIB2.
+_HOURS_PER_TIME_UNIT = {
+    1: {0: 1 / 60, 1: 1., 2: 24., 10: 3., 11: 6., 12: 12., 13: 1 / 4, 14: 1 / 2, 254: 1 / 3600},
+    2: {0: 1 / 60, 1: 1., 2: 24., 10: 3., 11: 6., 12: 12., 13: 1 / 3600},
+}
+_STEP_UNITS = {
+    1: {0: "m", 1: "h", 2: "D", 10: "3h", 11: "6h", 12: "12h", 13: "15m", 14: "30m", 254: "s"},
+    2: {0: "m", 1: "h", 2: "D", 10: "3h", 11: "6h", 12: "12h", 13: "s"},
+}
+
+# GRIB1 time range indicators for which the step is the end of the time range (P2)
+_GRIB1_RANGE_END = (2, 3, 4, 5)
+# GRIB2 product definition templates and the offset in section 4 of the length of their statistical time range,
+# which follows the indicator of its unit
+_GRIB2_TIME_RANGE_OFFSET = {8: 49, 11: 52}
+
+# Size of the blocks read by S3RangeReader, enough for the headers of a message in one request
+_S3_BLOCK_SIZE = 64 * 1024
+# Size of the block read for the header of the first message of an object, enough for sections 0 to 4
+_HEADER_BLOCK_SIZE = 1024
+
+
+class GribMessage(BaseModel):
+    offset: int
+    length: int
+    edition: int
+    # GRIB1: table2Version.indicatorOfParameter, GRIB2: discipline.parameterCategory.parameterNumber
+    parameter: str
+    discipline: int | None
+    level_type: int
+    # Value of the (first) level as encoded, e.g. in hPa for GRIB1 and Pa for GRIB2 isobaric levels
+    level: float
+    # Reference date and time as YYYYMMDD and HHMM, as the mars.date and mars.time keys of eccodes
+    date: str
+    time: str
+    # End of the forecast step, in step_units and in hours
+    step: int
+    step_units: str
+    step_hours: float
+
+
+class GribReader(Protocol):
+    size: int
+
+    def read(self, offset: int, length: int) -> bytes | memoryview:
+        """Return length bytes at offset, or fewer at the end of the file."""
+
+
+class MmapReader:
+    """Reader of a local file, memory-mapped so that reads are views of the mapped pages."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.size = path.stat().st_size
+        self._file = open(path, "rb")  # pylint: disable=consider-using-with
+        self._mmap: mmap.mmap | None = None
+        self._view: memoryview = memoryview(b"")
+        if self.size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._view = memoryview(self._mmap)
+
+    def read(self, offset: int, length: int) -> memoryview:
+        return self._view[offset:offset + length]
+
+    def close(self) -> None:
+        self._view.release()
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "MmapReader":
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, exc: BaseException | None,
+                 traceback: TracebackType | None) -> None:
+        self.close()
+
+
+class S3RangeReader:
+    """Reader of an S3 object with ranged GETs, caching the last block read."""
+
+    def __init__(self, client: Any, bucket_name: str, key: str, size: int | None = None,
+                 block_size: int = _S3_BLOCK_SIZE) -> None:
+        self.client = client
+        self.bucket_name = bucket_name
+        self.key = key
+        self.size = size if size is not None else client.head_object(Bucket=bucket_name, Key=key)["ContentLength"]
+        self.block_size = block_size
+        self._block_offset = -1
+        self._block = b""
+
+    def read(self, offset: int, length: int) -> bytes:
+        end = min(offset + length, self.size)
+        if not self._block_offset <= offset <= end <= self._block_offset + len(self._block):
+            self._block_offset = offset
+            self._block = self.get_range(offset, max(length, self.block_size))
+        return self._block[offset - self._block_offset:end - self._block_offset]
+
+    def get_range(self, offset: int, length: int) -> bytes:
+        end = min(offset + length, self.size) - 1
+        if end < offset:
+            return b""
+        response = self.client.get_object(Bucket=self.bucket_name, Key=self.key, Range=f"bytes={offset}-{end}")
+        return response["Body"].read()
+
+
+def index_file(path: Path) -> list[GribMessage]:
+    """Index the messages of a local GRIB file."""
+    with MmapReader(path) as reader:
+        return list(scan(reader, str(path)))
+
+
+def index_object(client: Any, bucket_name: str, key: str, size: int | None = None) -> list[GribMessage]:
+    """Index the messages of a GRIB object in S3, reading only the headers of its messages."""
+    return list(scan(S3RangeReader(client, bucket_name, key, size), key))
+
+
+def read_object_header(client: Any, bucket_name: str, key: str, size: int | None = None) -> GribMessage:
+    """
+    The first message of a GRIB object in S3, decoded from its headers only: in general a single ranged GET
+    of the first kilobyte of the object. Its end is not checked, the object is not read past the headers.
+    """
+    return read_header(S3RangeReader(client, bucket_name, key, size, block_size=_HEADER_BLOCK_SIZE), key)
+
+
+def read_header(reader: GribReader, name: str = "") -> GribMessage:
+    """The first message of the file read by reader, from its headers only."""
+    return _message_at(reader, 0, name)
+
+
+def scan(reader: GribReader, name: str = "", max_messages: int | None = None) -> Iterator[GribMessage]:
+    """
+    Yield the messages of the file read by reader, checking that it is a sequence of complete messages:
+    each starting with 'GRIB' and ending with '7777' at the offset given by its total length.
+    A RuntimeError is raised at the first message that is not.
+    """
+    offset = 0
+    n_messages = 0
+    while offset < reader.size and (max_messages is None or n_messages < max_messages):
+        message = _message_at(reader, offset, name)
+
+        if offset + message.length > reader.size:
+            raise RuntimeError(f"GRIB message at offset {offset} of {name} is truncated.")
+        if bytes(reader.read(offset + message.length - 4, 4)) != b"7777":
+            raise RuntimeError(f"GRIB message at offset {offset} of {name} does not end with 7777.")
+
+        yield message
+        offset += message.length
+        n_messages += 1
+
+
+def _message_at(reader: GribReader, offset: int, name: str) -> GribMessage:
+    header = bytes(reader.read(offset, 16))
+    if len(header) < 16 or header[:4] != b"GRIB":
+        raise RuntimeError(f"No GRIB message at offset {offset} of {name}.")
+
+    edition = header[7]
+    if edition == 1:
+        return _grib1_message(reader, offset, header)
+    if edition == 2:
+        return _grib2_message(reader, offset, header)
+    raise RuntimeError(f"Unsupported GRIB edition {edition} at offset {offset} of {name}.")
+
+
+def _grib1_message(reader: GribReader, offset: int, header: bytes) -> GribMessage:
+    length = _uint(header, 4, 3)
+    section1_length = _uint(reader.read(offset + 8, 3), 0, 3)
+    pds = bytes(reader.read(offset + 8, section1_length))
+    if len(pds) < 28:
+        raise RuntimeError(f"GRIB1 section 1 at offset {offset} is truncated.")
+
+    if length & 0x800000:
+        length = _grib1_large_length(reader, offset, length, section1_length, pds[7])
+
+    # Octets of section 1 are 1-based in the GRIB1 specification, pds[i] is octet i + 1.
+    time_unit, p1, p2, time_range_indicator = pds[17], pds[18], pds[19], pds[20]
+    if time_range_indicator == 10:
+        step = p1 * 256 + p2
+    elif time_range_indicator in _GRIB1_RANGE_END:
+        step = p2
+    else:
+        step = p1
+
+    year = (pds[24] - 1) * 100 + pds[12]
+    return GribMessage(
+        offset=offset,
+        length=length,
+        edition=1,
+        parameter=f"{pds[3]}.{pds[8]}",
+        discipline=None,
+        level_type=pds[9],
+        level=float(_uint(pds, 10, 2)),
+        date=f"{year:04}{pds[13]:02}{pds[14]:02}",
+        time=f"{pds[15]:02}{pds[16]:02}",
+        step=step,
+        step_units=_step_units(1, time_unit),
+        step_hours=step * _hours_per_time_unit(1, time_unit),
+    )
+
+
+def _grib1_large_length(reader: GribReader, offset: int, length: int, section1_length: int, flags: int) -> int:
+    """
+    GRIB1 messages over 8 MB store their length in units of 120 bytes, flagged by the top bit.
+    The length of section 4 is then below 120, and the actual length is corrected by it, as in eccodes.
+    """
+    section_offset = offset + 8 + section1_length
+    for present in (flags & 0x80, flags & 0x40):  # sections 2 and 3
+        if present:
+            section_offset += _uint(reader.read(section_offset, 3), 0, 3)
+    section4_length = _uint(reader.read(section_offset, 3), 0, 3)
+    if section4_length < 120:
+        return (length & 0x7fffff) * 120 - section4_length + 4
+    return length
+
+
+def _grib2_message(reader: GribReader, offset: int, header: bytes) -> GribMessage:
+    length = _uint(header, 8, 8)
+    discipline = header[6]
+
+    section_offset = offset + 16
+    section1 = b""
+    section4 = b""
+    while not section4:
+        section_header = bytes(reader.read(section_offset, 5))
+        if len(section_header) < 5 or section_header[:4] == b"7777":
+            raise RuntimeError(f"GRIB2 message at offset {offset} has no section 4.")
+        section_length, number = _uint(section_header, 0, 4), section_header[4]
+        if number == 1:
+            section1 = bytes(reader.read(section_offset, section_length))
+        elif number == 4:
+            section4 = bytes(reader.read(section_offset, section_length))
+        section_offset += section_length
+
+    if len(section1) < 19 or len(section4) < 34:
+        raise RuntimeError(f"GRIB2 sections 1 or 4 of the message at offset {offset} are truncated.")
+
+    # Octets are 1-based in the GRIB2 specification, section[i] is octet i + 1.
+    template = _uint(section4, 7, 2)
+    time_unit = section4[17]
+    step = _uint(section4, 18, 4)
+    if template in _GRIB2_TIME_RANGE_OFFSET and len(section4) >= _GRIB2_TIME_RANGE_OFFSET[template] + 4:
+        # Statistically processed fields: the step is the end of the time range.
+        step += _time_range_length(section4, _GRIB2_TIME_RANGE_OFFSET[template], time_unit, offset)
+
+    scale_factor = _int(section4, 23, 1)
+    scaled_value = _int(section4, 24, 4)
+
+    return GribMessage(
+        offset=offset,
+        length=length,
+        edition=2,
+        parameter=f"{discipline}.{section4[9]}.{section4[10]}",
+        discipline=discipline,
+        level_type=section4[22],
+        level=scaled_value / 10**scale_factor if scale_factor else float(scaled_value),
+        date=f"{_uint(section1, 12, 2):04}{section1[14]:02}{section1[15]:02}",
+        time=f"{section1[16]:02}{section1[17]:02}",
+        step=step,
+        step_units=_step_units(2, time_unit),
+        step_hours=step * _hours_per_time_unit(2, time_unit),
+    )
+
+
+def _time_range_length(section4: bytes, range_offset: int, time_unit: int, offset: int) -> int:
+    """The length of the statistical time range at range_offset of section 4, in the unit of the forecast time."""
+    length, range_unit = _uint(section4, range_offset, 4), section4[range_offset - 1]
+    if range_unit == time_unit:
+        return length
+    range_seconds = round(length * _hours_per_time_unit(2, range_unit) * 3600)
+    unit_seconds = round(_hours_per_time_unit(2, time_unit) * 3600)
+    if range_seconds % unit_seconds:
+        raise RuntimeError(f"Time range of {length} in unit {range_unit} of the message at offset {offset} is not a "
+                           f"whole number of unit {time_unit} of its forecast time.")
+    return range_seconds // unit_seconds
+
+
+def _uint(data: bytes | memoryview, start: int, size: int) -> int:
+    return int.from_bytes(data[start:start + size], "big")
+
+
+def _int(data: bytes | memoryview, start: int, size: int) -> int:
+    """GRIB integers are sign and magnitude, the sign being the top bit. All ones is the missing value."""
+    value = _uint(data, start, size)
+    if value == (1 << 8 * size) - 1:
+        return 0
+    sign_bit = 1 << (8 * size - 1)
+    return -(value & ~sign_bit) if value & sign_bit else value
+
+
+def _hours_per_time_unit(edition: int, time_unit: int) -> float:
+    if time_unit not in _HOURS_PER_TIME_UNIT[edition]:
+        raise RuntimeError(f"Unsupported unit of time range {time_unit} of GRIB{edition}.")
+    return _HOURS_PER_TIME_UNIT[edition][time_unit]
+
+
+def _step_units(edition: int, time_unit: int) -> str:
+    return _STEP_UNITS[edition].get(time_unit, str(time_unit))
@@ -2,11 +2,14 @@
 import logging
 from pathlib import Path
 from datetime import datetime, timedelta
+from typing import Any
 
-from eccodes import (CodesInternalError, codes_count_in_file, codes_get_string,
-                     codes_grib_new_from_file, codes_release)
 from pydantic import BaseModel
 
+from flexpart_ifs_utils.grib_index import (GribMessage, MmapReader, index_file,
+                                           read_object_header, scan)
+from flexpart_ifs_utils.timing import count
+
 _logger = logging.getLogger(__name__)
 
 class RunMetadata(BaseModel):
@@ -19,48 +22,50 @@ class GribMetadata(RunMetadata):
 
 def extract_metadata_from_grib_file(path: Path) -> GribMetadata:
     """ This function assumes all GRIB messages in the file have the same forecast datetime, step."""
+    with MmapReader(path) as reader:
+        message = next(scan(reader, str(path), max_messages=1), None)
+    if message is None:
+        msg = f"Could not read grib file {path}."
+        _logger.error(msg)
+        raise RuntimeError(msg)
+
+    count(objects=1)
+
+    return metadata_from_message(message)
+
+
+def extract_metadata_from_grib_object(client: Any, bucket_name: str, key: str, size: int | None = None) -> GribMetadata:
+    """The metadata of the first message of a GRIB object in S3, read with a ranged GET of its headers."""
+    return metadata_from_message(read_object_header(client, bucket_name, key, size))
 
-    with open(path, "rb") as f:
-        gid = codes_grib_new_from_file(f)
-        if gid is None:
-            msg = f"Could not read grib file {path}."
-            _logger.exception(msg)
-            raise RuntimeError(msg)
-
-        fcst_date = codes_get_string(gid, 'mars.date')
-        fcst_time = codes_get_string(gid, 'mars.time')
-        step = codes_get_string(gid, 'mars.step').split('-')[-1]
-        step_units = codes_get_string(gid, 'stepUnits')
-
-        # If step units is in minutes convert to hours.
-        # See https://github.com/ecmwf/eccodes/blob/develop/definitions/stepUnits.table
-        if step_units == 'm':
-            step_hr = int(step)/60.0
-        elif step_units == 'h':
-            step_hr = float(step)
-        else:
-            raise RuntimeError('Only hour and minute step units supported.')
-
-        codes_release(gid)
 
+def metadata_from_message(message: GribMessage) -> GribMetadata:
     return GribMetadata(
-        date = fcst_date,
-        time = fcst_time,
-        step = step_hr
+        date = message.date,
+        time = message.time,
+        step = message.step_hours
         )
 
 
 def _is_grib_file(file_path: Path) -> bool:
-    """Check if a file is a GRIB file using eccodes."""
-
+    """Check if a file is a GRIB file from the framing of its messages."""
     try:
-        with open(file_path, 'rb') as f:
-            gid = codes_count_in_file(f)
-            if not gid:
-                return False
-    except CodesInternalError:
+        check_grib_framing(file_path)
+        return True
+    except (OSError, RuntimeError):
         return False
-    return True
+
+
+def check_grib_framing(path: Path) -> int:
+    """
+    Check that the file is a non-empty sequence of complete GRIB messages, each starting with 'GRIB'
+    and ending with '7777' at the offset given by its total length, and return the number of messages.
+    Only the message headers and end markers are read, not the data sections.
+    """
+    num_messages = len(index_file(path))
+    if num_messages == 0:
+        raise RuntimeError(f"No GRIB message in {path}.")
+    return num_messages
 
 
 def _get_valid_datetime(
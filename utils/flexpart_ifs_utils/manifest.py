@@ -0,0 +1,197 @@
+"""
+The module builds and reads the manifests of the forecast cycles of the input bucket. A manifest is
+a JSON object stored next to the data of its cycle, listing for each GRIB file of the cycle its key,
+forecast reference date and time, step, valid time, domain, size and checksum.
+
+Selecting the input files of a run from the manifest of its cycle takes a single GET, whereas
+listing the bucket takes a request per object of every cycle retained. The manifest is published
+by the data ingest with the manifest command, built from the objects under the prefix of the cycle
+in the bucket or from a local directory of the files before they are uploaded.
+"""
+
+import hashlib
+import json
+import logging
+import re
+from datetime import datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Any
+
+from botocore.exceptions import ClientError
+
+import flexpart_ifs_utils
+from flexpart_ifs_utils.checksum import expected_checksum
+from flexpart_ifs_utils.config.service_settings import Bucket
+from flexpart_ifs_utils.grib_utils import (GribMetadata, _get_valid_datetime,
+                                           _is_grib_file,
+                                           extract_metadata_from_grib_file)
+from flexpart_ifs_utils.s3_utils import (_create_s3_client, _input_bucket,
+                                         _with_data_metadata)
+
+if TYPE_CHECKING:
+    from flexpart_ifs_utils.catalogue import GribCatalogue
+
+_logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+
+# Domains of the files, from the prefix of their name
+_DOMAINS = {"dispc": "GLOBAL", "dispf": "EUROPE"}
+
+_CHUNK_SIZE = 1024 * 1024
+
+_CYCLE_PREFIX = re.compile(r"\d{8}_\d{2}/")
+
+# Catalogues of the manifests read, by cycle, kept by the serve daemon. None reads the manifest on every call.
+_catalogues: dict[datetime, "GribCatalogue"] | None = None
+
+# Key, GRIB metadata, size, checksum as algorithm:digest and domain of a file listed in a manifest
+_Object = tuple[str, GribMetadata, int, str | None, str | None]
+
+
+def cycle_prefix(cycle: datetime) -> str:
+    """The prefix of the keys of the data of a forecast cycle in the input bucket."""
+    return f"{cycle:%Y%m%d_%H}/"
+
+
+def manifest_key(cycle: datetime) -> str:
+    """The key of the manifest of a forecast cycle, next to the data of the cycle."""
+    return f"{cycle_prefix(cycle)}{MANIFEST_NAME}"
+
+
+def latest_cycle(bucket: Bucket | None = None) -> datetime | None:
+    """
+    The latest forecast cycle with data in the input bucket, from the prefixes of the cycles listed with a
+    delimiter, a request per thousand cycles instead of a request per object. None if there is no cycle prefix.
+    """
+    bucket = _input_bucket(bucket)
+    paginator = _create_s3_client(bucket).get_paginator("list_objects_v2")
+    cycles = []
+    for page in paginator.paginate(Bucket=bucket.name, Delimiter="/"):
+        for common_prefix in page.get("CommonPrefixes", []):
+            if _CYCLE_PREFIX.fullmatch(common_prefix["Prefix"]):
+                cycles.append(datetime.strptime(common_prefix["Prefix"], "%Y%m%d_%H/"))
+    return max(cycles, default=None)
+
+
+def build_manifest(cycle: datetime, prefix: str, directory: Path | None = None,
+                   bucket: Bucket | None = None) -> dict[str, Any]:
+    """
+    The manifest of the GRIB files of cycle: the files in directory, to be uploaded with keys starting with prefix,
+    or if no directory is given the objects under prefix in the input bucket.
+    Files of other forecast cycles, and files which are not GRIB files, are left out.
+    """
+    step_unit = flexpart_ifs_utils.CONFIG.main.input.step_unit
+    if directory is not None:
+        # The step of the GRIB metadata is in hours, the step of the manifest in the configured step unit.
+        objects = _directory_objects(directory, prefix, 60. if step_unit.lower() == "minutes" else 1.)
+    else:
+        objects = _bucket_objects(_input_bucket(bucket), prefix)
+
+    entries = []
+    for key, metadata, size, checksum, domain in objects:
+        if (int(metadata.date), int(metadata.time)) != (int(f"{cycle:%Y%m%d}"), int(f"{cycle:%H%M}")):
+            _logger.warning("Leaving %s of cycle %s %s out of the manifest of %s", key, metadata.date, metadata.time,
+                            cycle)
+            continue
+        entry = {
+            "key": key,
+            "date": metadata.date,
+            "time": metadata.time,
+            "step": metadata.step,
+            "valid_time": _get_valid_datetime(Path(key), metadata, step_unit).isoformat(),
+            "size": size,
+            "checksum": checksum,
+        }
+        if domain := domain or _DOMAINS.get(Path(key).name[:5]):
+            entry["domain"] = domain
+        entries.append(entry)
+
+    _logger.info("Manifest of cycle %s lists %d files", cycle, len(entries))
+    return {"cycle": cycle.isoformat(), "step_unit": step_unit, "objects": entries}
+
+
+def upload_manifest(manifest: dict[str, Any], bucket: Bucket | None = None) -> str:
+    """Upload the manifest to its key in the input bucket, and return the key."""
+    bucket = _input_bucket(bucket)
+    key = manifest_key(datetime.fromisoformat(manifest["cycle"]))
+    _create_s3_client(bucket).put_object(
+        Bucket=bucket.name, Key=key, Body=json.dumps(manifest).encode(), ContentType="application/json"
+    )
+    _logger.info("Uploaded the manifest to bucket: %s with key: %s", bucket.name, key)
+    return key
+
+
+def keep_manifests() -> None:
+    """Keep the catalogues of the manifests read, for the runs of the same cycle."""
+    global _catalogues  # pylint: disable=global-statement
+    if _catalogues is None:
+        _catalogues = {}
+
+
+def read_manifest(cycle: datetime, bucket: Bucket | None = None) -> "GribCatalogue | None":
+    """The catalogue of the manifest of cycle in the input bucket, read with one GET, or None if it has none."""
+    from flexpart_ifs_utils.catalogue import GribCatalogue
+
+    if _catalogues is not None and cycle in _catalogues:
+        return _catalogues[cycle]
+
+    bucket = _input_bucket(bucket)
+    key = manifest_key(cycle)
+    try:
+        response = _create_s3_client(bucket).get_object(Bucket=bucket.name, Key=key)
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            _logger.info("No manifest %s in bucket %s", key, bucket.name)
+            return None
+        raise
+
+    manifest = json.loads(response["Body"].read())
+    _logger.info("Read the manifest %s of %d files", key, len(manifest["objects"]))
+    catalogue = GribCatalogue.from_records((entry["key"], entry) for entry in manifest["objects"])
+    if _catalogues is not None:
+        _catalogues[cycle] = catalogue
+    return catalogue
+
+
+def _directory_objects(directory: Path, prefix: str, step_factor: float) -> list[_Object]:
+    objects: list[_Object] = []
+    for path in sorted(directory.rglob("*")):
+        if not path.is_file() or path.name.startswith("."):
+            continue
+        if not _is_grib_file(path):
+            _logger.warning("Leaving %s out of the manifest, it is not a GRIB file", path)
+            continue
+        key = prefix + path.relative_to(directory).as_posix()
+        metadata = extract_metadata_from_grib_file(path)
+        metadata.step *= step_factor
+        objects.append((key, metadata, path.stat().st_size, _sha256(path), None))
+    return objects
+
+
+def _bucket_objects(bucket: Bucket, prefix: str) -> list[_Object]:
+    client = _create_s3_client(bucket)
+    heads: dict[str, dict[str, Any]] = {}
+    paginator = client.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket.name, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            if Path(obj["Key"]).name != MANIFEST_NAME:
+                heads[obj["Key"]] = client.head_object(Bucket=bucket.name, Key=obj["Key"])
+
+    objects: list[_Object] = []
+    with_metadata = ((key, head.get("Metadata") or {}, head["ContentLength"]) for key, head in heads.items())
+    for key, user_metadata in _with_data_metadata(bucket, with_metadata, client):
+        data = json.loads(user_metadata["data"])
+        metadata = GribMetadata(date=data["date"], time=data["time"], step=float(data["step"]))
+        checksum = expected_checksum(heads[key])
+        objects.append((key, metadata, heads[key]["ContentLength"], ":".join(checksum) if checksum else None,
+                        data.get("domain")))
+    return objects
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_CHUNK_SIZE):
+            digest.update(chunk)
+    return f"sha256:{digest.hexdigest()}"
@@ -0,0 +1,166 @@
+"""
+The module memoizes the output of runs in the output bucket, so that a run identical to one already
+uploaded is skipped. Operators re-trigger identical runs (same site, cycle and emission window), which
+would otherwise download the input and run Flexpart again.
+
+The run key of a job is a SHA-256 digest over the keys and ETags of its input objects, its rendered
+COMMAND, RELEASES and OUTGRID namelists, the input and output settings which change its output and the
+FLEXPART binary. Once the output of a run is uploaded, a record of its objects and their ETags is stored
+under runs/<run key>.json in the output bucket.
+
+generate looks the run key up before downloading the input. If a record is found and its objects are
+unchanged, the job directory holds the record instead of a job: run skips Flexpart, and upload copies
+the objects server-side to the prefix of the run, or references them if they are already there.
+"""
+
+import hashlib
+import json
+import logging
+from pathlib import Path
+from typing import Any
+
+from botocore.exceptions import ClientError
+from pydantic import BaseModel
+
+import flexpart_ifs_utils
+from flexpart_ifs_utils.config.service_settings import Bucket
+from flexpart_ifs_utils.model import Model
+from flexpart_ifs_utils.prepare_flexpart import (flexpart_executable,
+                                                 render_namelists)
+from flexpart_ifs_utils.s3_utils import (_create_s3_client, _input_bucket,
+                                         _output_bucket, _output_metadata,
+                                         _output_prefix)
+from flexpart_ifs_utils.timing import count, timed
+
+_logger = logging.getLogger(__name__)
+
+# The run key of a job, and the record of the identical run whose output it reuses, in the job directory
+RUN_KEY_FILE = "run_key"
+MEMO_FILE = "memo.json"
+
+_RECORDS_PREFIX = "runs"
+
+_CHUNK_SIZE = 1024 * 1024
+
+
+class RunRecord(BaseModel):
+    run_key: str
+    prefix: str
+    # ETags of the output objects, by key
+    objects: dict[str, str]
+
+
+@timed("run_key")
+def compute_run_key(keys: list[str], configuration: dict, flexpart_dir: Path, model: Model,
+                    bucket: Bucket | None = None) -> str:
+    """The run key of the job of configuration with the input objects of keys, read with a HEAD per object."""
+    bucket = _input_bucket(bucket)
+    client = _create_s3_client(bucket)
+    settings = flexpart_ifs_utils.CONFIG.main
+    content: dict[str, Any] = {
+        "inputs": [[key, client.head_object(Bucket=bucket.name, Key=key)["ETag"]] for key in sorted(keys)],
+        "namelists": render_namelists(configuration, flexpart_dir, model),
+        "model": model.value,
+        # The cache of the input and the number of workers do not change the output.
+        "input": settings.input.model_dump(exclude={"prefetch"}),
+        "output": settings.output.model_dump(exclude={"max_workers", "memoize"}),
+        "flexpart": _sha256(flexpart_executable(flexpart_dir, settings.openmp_config)),
+    }
+    run_key = hashlib.sha256(json.dumps(content, sort_keys=True).encode()).hexdigest()
+    _logger.info("Run key of %s: %s", configuration["name"], run_key)
+    return run_key
+
+
+def find_run(run_key: str, bucket: Bucket | None = None) -> RunRecord | None:
+    """The record of the run of run_key, if there is one and its output objects are unchanged."""
+    bucket = _output_bucket(bucket)
+    client = _create_s3_client(bucket)
+    try:
+        response = client.get_object(Bucket=bucket.name, Key=_record_key(run_key))
+    except ClientError as exc:
+        if exc.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    record = RunRecord.model_validate_json(response["Body"].read())
+
+    # The output of a later run of the same site and cycle may have replaced the objects of the record.
+    etags = _etags(client, bucket, record.prefix)
+    if any(etags.get(key) != etag for key, etag in record.objects.items()):
+        _logger.info("The output of run %s under %s has changed since it was recorded", run_key, record.prefix)
+        return None
+    _logger.info("Found the output of an identical run under %s", record.prefix)
+    return record
+
+
+def skip_job(job_dir: Path, run_key: str, record: RunRecord) -> Path:
+    """Create job_dir holding the record of the identical run instead of a job, and return it."""
+    job_dir.mkdir(parents=True)
+    write_run_key(job_dir, run_key)
+    (job_dir / MEMO_FILE).write_text(record.model_dump_json(), encoding="utf-8")
+    return job_dir
+
+
+def write_run_key(job_dir: Path, run_key: str) -> None:
+    (job_dir / RUN_KEY_FILE).write_text(run_key, encoding="utf-8")
+
+
+@timed("memoize")
+def publish_run(job_dir: Path, site: str, forecast_datetime: str, uploaded: list[str],
+                bucket: Bucket | None = None) -> None:
+    """
+    Record the output uploaded by the job in job_dir, or copy the output of the identical run it skipped to
+    the prefix of the run. Jobs without a run key, whose input was not selected from the bucket, are skipped.
+    """
+    bucket = _output_bucket(bucket)
+    prefix = _output_prefix(forecast_datetime, site)
+
+    if (job_dir / MEMO_FILE).exists():
+        record = RunRecord.model_validate_json((job_dir / MEMO_FILE).read_text(encoding="utf-8"))
+        if record.prefix == prefix:
+            _logger.info("The output of the identical run is already under %s", prefix)
+            return
+        _copy_run(record, prefix, _output_metadata(forecast_datetime, site), bucket)
+        return
+
+    if not (job_dir / RUN_KEY_FILE).exists() or not uploaded:
+        _logger.info("No run key or no output in %s, the output is not recorded", job_dir)
+        return
+    run_key = (job_dir / RUN_KEY_FILE).read_text(encoding="utf-8")
+    client = _create_s3_client(bucket)
+    etags = _etags(client, bucket, prefix)
+    record = RunRecord(run_key=run_key, prefix=prefix, objects={key: etags[key] for key in uploaded})
+    client.put_object(Bucket=bucket.name, Key=_record_key(run_key), Body=record.model_dump_json().encode(),
+                      ContentType="application/json")
+    _logger.info("Recorded the output of run %s under %s", run_key, prefix)
+
+
+def _copy_run(record: RunRecord, prefix: str, metadata: dict[str, str], bucket: Bucket) -> None:
+    client = _create_s3_client(bucket)
+    for key in record.objects:
+        new_key = prefix + key[len(record.prefix):]
+        _logger.info("Copying %s to %s", key, new_key)
+        # A managed copy, in parts for large objects, with the metadata of the run.
+        client.copy({"Bucket": bucket.name, "Key": key}, bucket.name, new_key,
+                    ExtraArgs={"Metadata": metadata, "MetadataDirective": "REPLACE"})
+        count(objects=1)
+
+
+def _etags(client: Any, bucket: Bucket, prefix: str) -> dict[str, str]:
+    paginator = client.get_paginator("list_objects_v2")
+    return {
+        obj["Key"]: obj["ETag"]
+        for page in paginator.paginate(Bucket=bucket.name, Prefix=f"{prefix}/")
+        for obj in page.get("Contents", [])
+    }
+
+
+def _record_key(run_key: str) -> str:
+    return f"{_RECORDS_PREFIX}/{run_key}.json"
+
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
@@ -0,0 +1,37 @@
+"""
+The module holds what the readers of the NetCDF output of Flexpart share: the names of its concentration
+and deposition fields, the grid_conc_<datetime>.nc files of the release sites of a jobs directory, and the
+reading of a field a few output times at a time, which bounds the memory used by the size of a block of
+output times whatever the length of the simulation.
+"""
+
+import glob
+import re
+from pathlib import Path
+from typing import Iterator
+
+import netCDF4
+import numpy as np
+
+# Concentration fields of each species, as mass or volume mixing ratio
+CONCENTRATION = re.compile(r"spec\d{3}_(mr|pptv)$")
+# Wet and dry deposition fields of each species
+DEPOSITION = re.compile(r"(WD|DD)_(spec\d{3})$")
+
+
+def grid_conc_files(jobs_dir: Path, sites: list[str]) -> list[Path]:
+    """The NetCDF output files of the release sites in jobs_dir."""
+    return sorted(
+        Path(f)
+        for site in sites
+        for f in glob.iglob(f"{jobs_dir}/{site}/output/grid_conc_*.nc")
+    )
+
+
+def time_blocks(var: netCDF4.Variable, time_axis: int, time_chunk: int) -> Iterator[tuple[int, np.ndarray]]:
+    """The blocks of time_chunk output times of var in single precision, with the index of their first time."""
+    n_times = var.shape[time_axis]
+    for start in range(0, n_times, time_chunk):
+        index = [slice(None)] * var.ndim
+        index[time_axis] = slice(start, min(start + time_chunk, n_times))
+        yield start, np.asarray(var[tuple(index)], dtype=np.float32)
@@ -0,0 +1,150 @@
+"""
+The module converts the particle position dumps of Flexpart, the partposit_<datetime> files written by
+partoutput.f90 when IPOUT is set (partposit_end for IPOUT=2), into Zarr stores with one array per column,
+which consumers read column by column instead of parsing the Fortran records one particle at a time.
+
+A dump is a Fortran unformatted sequential file, little endian with 4 byte record markers: a record with
+the time of the dump, one record per particle with its release point, position, release time, the
+topography, potential vorticity, specific humidity, density, mixing height, tropopause and temperature
+at its position and its mass of each species, and a final record of -99999 and -9999.9 values. As all
+particle records have the same size, including their markers, the file is memory-mapped as an array of
+records with a structured dtype and converted chunk by chunk, so the memory used is bounded by the chunk
+size whatever the number of particles.
+
+The particles can be filtered to a longitude and latitude box, and the dumps to the output times at a
+given interval. The dumps are converted in parallel, one per process, to stores next to the dumps.
+
+The dumps of the positions averaged over the output interval, partposit_average_<datetime> for IPOUT=3,
+and the compressed dumps of partoutput_short.f90, shortposit_<datetime>, have other record layouts and
+are not converted.
+"""
+
+import glob
+import logging
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numcodecs
+import numpy as np
+import zarr
+
+from flexpart_ifs_utils.config.service_settings import ParticleDumpConfig
+from flexpart_ifs_utils.timing import count, timed
+
+_logger = logging.getLogger(__name__)
+
+_DUMP_FILE = re.compile(r"^partposit_(\d{14}|end)$")
+# Size of the record of the time of the dump, with its markers
+_TIME_RECORD_SIZE = 12
+# Columns of a particle record after its release point, and before the mass of each species
+_COLUMNS = [
+    ("longitude", "<f4"),
+    ("latitude", "<f4"),
+    ("height", "<f4"),
+    ("release_time", "<i4"),
+    ("topography", "<f4"),
+    ("pv", "<f4"),
+    ("qv", "<f4"),
+    ("density", "<f4"),
+    ("hmix", "<f4"),
+    ("tropopause", "<f4"),
+    ("temperature", "<f4"),
+]
+# Release point of the record closing the dump
+_END_MARKER = -99999
+
+
+@timed("convert_particles")
+def convert_particle_dumps(jobs_dir: Path, config: ParticleDumpConfig, max_workers: int) -> list[Path]:
+    """Convert the particle dumps of all release sites in jobs_dir to Zarr stores next to the dumps."""
+    path_list = sorted(
+        Path(f) for f in glob.iglob(f"{jobs_dir}/*/output/partposit_*") if _DUMP_FILE.match(Path(f).name)
+    )
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(convert_partposit, path, path.with_name(f"{path.name}.zarr"), config)
+            for path in path_list
+        ]
+        return [store for future in futures if (store := future.result()) is not None]
+
+
+def convert_partposit(path: Path, store_path: Path, config: ParticleDumpConfig) -> Path | None:
+    """
+    Write the particle dump at path as a Zarr store, or nothing if its output time is not at the configured
+    interval. Returns the path of the store written.
+    """
+    itime = read_dump_time(path)
+    if config.interval is not None and itime % config.interval != 0:
+        _logger.info("Skipping %s, %d s after the start of the simulation", path, itime)
+        return None
+    _logger.info("Converting %s to Zarr store %s", path, store_path)
+
+    records = _map_records(path)
+    nspec = records.dtype["mass"].shape[0]
+
+    if store_path.exists():
+        shutil.rmtree(store_path)
+    compressor = numcodecs.Blosc(cname="zstd", clevel=config.complevel, shuffle=numcodecs.Blosc.SHUFFLE)
+    root = zarr.open_group(store_path, mode="w", zarr_format=2)
+    root.attrs.update({"itime": itime})
+    arrays = {
+        name: root.create_array(name, shape=(0,), chunks=(config.chunk_size,), dtype=dtype, compressors=compressor,
+                                attributes={"_ARRAY_DIMENSIONS": ["particle"]})
+        for name, dtype in [("release_point", "<i4"), *_COLUMNS]
+    }
+    arrays["mass"] = root.create_array(
+        "mass", shape=(0, nspec), chunks=(config.chunk_size, nspec), dtype="<f4", compressors=compressor,
+        attributes={"_ARRAY_DIMENSIONS": ["particle", "species"]})
+
+    converted = 0
+    for start in range(0, len(records), config.chunk_size):
+        chunk = records[start:start + config.chunk_size]
+        _check_markers(chunk, path, start)
+        selected = chunk[_select(chunk, config.bbox)]
+        for name, array in arrays.items():
+            array.append(selected[name])
+        converted += len(selected)
+
+    zarr.consolidate_metadata(store_path)
+    count(nbytes=path.stat().st_size, objects=1)
+    _logger.info("Converted %d of the %d particles of %s", converted, len(records) - 1, path)
+    return store_path
+
+
+def read_dump_time(path: Path) -> int:
+    """The time of the particle dump at path, in seconds since the start of the simulation."""
+    marker, itime, _ = np.fromfile(path, dtype="<i4", count=3)
+    if marker != 4:
+        raise RuntimeError(f"{path} does not start with the record of the time of a particle dump")
+    return int(itime)
+
+
+def _map_records(path: Path) -> np.ndarray:
+    """The particle records of the dump at path, and its final record, memory-mapped."""
+    (length,) = np.fromfile(path, dtype="<i4", count=1, offset=_TIME_RECORD_SIZE)
+    # The record of a particle holds 4 byte values: its release point, the columns and the mass of each species.
+    nspec = length // 4 - 1 - len(_COLUMNS)
+    dtype = np.dtype([("head", "<i4"), ("release_point", "<i4"), *_COLUMNS, ("mass", "<f4", (nspec,)), ("tail", "<i4")])
+    size = path.stat().st_size - _TIME_RECORD_SIZE
+    if nspec < 1 or size % dtype.itemsize != 0:
+        raise RuntimeError(f"{path} is not a particle dump of records of {length} bytes")
+    return np.memmap(path, dtype=dtype, mode="r", offset=_TIME_RECORD_SIZE, shape=(size // dtype.itemsize,))
+
+
+def _check_markers(chunk: np.ndarray, path: Path, start: int) -> None:
+    length = chunk.dtype.itemsize - 8
+    if np.any(chunk["head"] != length) or np.any(chunk["tail"] != length):
+        raise RuntimeError(f"Invalid record markers in the records {start} to {start + len(chunk)} of {path}")
+
+
+def _select(chunk: np.ndarray, bbox: list[float] | None) -> np.ndarray:
+    """Mask of the particles of chunk in bbox, [west, south, east, north] in degrees, excluding the final record."""
+    mask = chunk["release_point"] != _END_MARKER
+    if bbox is not None:
+        west, south, east, north = bbox
+        mask &= (chunk["longitude"] >= west) & (chunk["longitude"] <= east)
+        mask &= (chunk["latitude"] >= south) & (chunk["latitude"] <= north)
+    return mask
@@ -0,0 +1,169 @@
+"""
+The module plans the number of particles and OpenMP threads of a job so that it completes within
+a wall-clock deadline. The particle counts of the RELEASES namelists are static, while the run time
+varies with the simulation length, the meteorology and the number of threads.
+
+The wall time, particles released, simulated hours and threads of each completed run are recorded in
+a local SQLite store. Before a run, a cost model is fitted by least squares to the runs of the same
+model:
+
+    wall_time = c0 + c1 * hours + c2 * particles * hours / threads + c3 * particles * hours
+
+a fixed cost, the cost of reading the input, and the parallel and serial parts of the particle
+computations. For each configured thread count, the largest number of particles whose predicted
+wall time meets the deadline is computed, and the largest of these is planned, with the fewest
+threads reaching it. The plan is applied by setting PARTS in the RELEASES namelists, through the
+runtime configuration, and the number of threads of the job script.
+
+The threads of a run of FLEXPART_MPI are those of all its ranks, the configured thread counts are those
+of each rank.
+"""
+
+import logging
+import re
+import sqlite3
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from pydantic import BaseModel
+
+from flexpart_ifs_utils.config.service_settings import PlannerConfig
+from flexpart_ifs_utils.model import Model
+from flexpart_ifs_utils.progress import Progress
+
+if TYPE_CHECKING:
+    import numpy as np
+
+_logger = logging.getLogger(__name__)
+
+_PARTS = re.compile(r"^\s*PARTS\s*=\s*(\d+)", re.MULTILINE)
+
+# The planned number of particles is rounded down to a multiple of this
+_PARTICLE_STEP = 1000
+
+
+class RunStats(BaseModel):
+    site: str
+    model: Model
+    particles: int
+    simulated_hours: float
+    # Threads of all the MPI ranks
+    threads: int
+    wall_time: float
+
+
+class Plan(BaseModel):
+    particles: int
+    threads: int
+    predicted_wall_time: float
+
+
+class RunStatsStore:
+    """Statistics of completed runs, in a table of the SQLite database at path."""
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=30.)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS run_stats ("
+                "site TEXT NOT NULL, model TEXT NOT NULL, particles INTEGER NOT NULL, simulated_hours REAL NOT NULL, "
+                "threads INTEGER NOT NULL, wall_time REAL NOT NULL, recorded REAL NOT NULL)"
+            )
+
+    def add(self, stats: RunStats) -> None:
+        with self._connection:
+            self._connection.execute(
+                "INSERT INTO run_stats VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (stats.site, stats.model.value, stats.particles, stats.simulated_hours, stats.threads,
+                 stats.wall_time, time.time()),
+            )
+
+    def runs(self, model: Model, limit: int | None = None) -> list[RunStats]:
+        """The latest runs of model, at most limit, the latest first."""
+        rows = self._connection.execute(
+            "SELECT site, model, particles, simulated_hours, threads, wall_time FROM run_stats "
+            "WHERE model = ? ORDER BY recorded DESC, rowid DESC LIMIT ?",
+            (model.value, -1 if limit is None else limit),
+        ).fetchall()
+        return [
+            RunStats(site=site, model=Model(model_), particles=particles, simulated_hours=hours, threads=threads,
+                     wall_time=wall_time)
+            for site, model_, particles, hours, threads, wall_time in rows
+        ]
+
+
+def record_run(job_dir: Path, progress: Progress, config: PlannerConfig) -> RunStats | None:
+    """Record the statistics of the completed run of job_dir, from its namelists and progress."""
+    if not progress.completed or progress.returncode or progress.num_threads is None:
+        _logger.info("The run of %s did not complete, its statistics are not recorded", job_dir)
+        return None
+
+    stats = RunStats(
+        site=job_dir.name,
+        model=_job_model(job_dir),
+        particles=released_particles(job_dir / "input" / "RELEASES"),
+        simulated_hours=progress.total_seconds / 3600,
+        threads=progress.num_threads * (progress.num_ranks or 1),
+        wall_time=progress.wall_time,
+    )
+    RunStatsStore(Path(config.stats_path)).add(stats)
+    _logger.info("Recorded the run statistics of %s: %s", job_dir, stats)
+    return stats
+
+
+def plan_run(model: Model, simulated_hours: float, config: PlannerConfig, ranks: int = 1) -> Plan | None:
+    """
+    The particles and threads per rank of a run of model with ranks MPI ranks simulating simulated_hours to
+    complete within the deadline, or None if there are too few runs recorded to fit the cost model, or the fit
+    is unusable.
+    """
+    runs = RunStatsStore(Path(config.stats_path)).runs(model, config.max_runs)
+    if len(runs) < config.min_runs:
+        _logger.info("%d runs of %s recorded, %d needed to plan the particles", len(runs), model.value,
+                     config.min_runs)
+        return None
+
+    coefficients = fit_cost_model(runs)
+    plans = []
+    for threads in config.thread_counts:
+        fixed = coefficients[0] + coefficients[1] * simulated_hours
+        per_particle = simulated_hours * (coefficients[2] / (threads * ranks) + coefficients[3])
+        if per_particle <= 0:
+            _logger.warning("The cost model %s fitted to %d runs is unusable", coefficients.tolist(), len(runs))
+            return None
+        particles = (config.deadline - fixed) / per_particle
+        particles = int(min(max(particles, config.min_particles), config.max_particles))
+        particles -= particles % _PARTICLE_STEP
+        plans.append(Plan(particles=particles, threads=threads, predicted_wall_time=fixed + per_particle * particles))
+
+    plan = max(plans, key=lambda p: (p.particles, -p.threads))
+    _logger.info("Planned %d particles with %d threads for %.1f simulated hours, predicted wall time %.0f s",
+                 plan.particles, plan.threads, simulated_hours, plan.predicted_wall_time)
+    return plan
+
+
+def fit_cost_model(runs: list[RunStats]) -> "np.ndarray":
+    """The coefficients c0 to c3 of the cost model, fitted by least squares to the wall time of runs."""
+    # NumPy is only needed by the planner, not at the startup of every command.
+    import numpy as np
+
+    particles = np.array([run.particles for run in runs], dtype=np.float64)
+    hours = np.array([run.simulated_hours for run in runs])
+    threads = np.array([run.threads for run in runs], dtype=np.float64)
+    wall_time = np.array([run.wall_time for run in runs])
+
+    design = np.column_stack([np.ones(len(runs)), hours, particles * hours / threads, particles * hours])
+    coefficients, *_ = np.linalg.lstsq(design, wall_time, rcond=None)
+    return coefficients
+
+
+def released_particles(releases: Path) -> int:
+    """The total number of particles released by the RELEASES namelist."""
+    return sum(int(parts) for parts in _PARTS.findall(releases.read_text(encoding="utf-8")))
+
+
+def _job_model(job_dir: Path) -> Model:
+    # Only the jobs of IFS-Global runs read the nested domain.
+    return Model.IFS_HRES if (job_dir / "input" / "AVAILABLE_NESTED").exists() else Model.IFS_HRES_EUROPE
@@ -0,0 +1,144 @@
+"""
+The module post-processes the NetCDF output of Flexpart before it is uploaded to S3.
+Each output file is rewritten with the configured compression codec, with chunking that serves
+both time-series reads at a grid point and map reads of a single output time, and optionally
+with the gridded fields quantized to a number of significant digits.
+"""
+
+import glob
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import netCDF4
+import numpy as np
+
+from flexpart_ifs_utils.config.service_settings import CompressionConfig
+from flexpart_ifs_utils.timing import count, timed
+
+_logger = logging.getLogger(__name__)
+
+_SPATIAL_DIMS = ("latitude", "longitude")
+
+
+@timed("compress_output")
+def postprocess_output(
+    jobs_dir: Path,
+    compression: CompressionConfig,
+    max_workers: int,
+) -> list[Path]:
+    """Compress the NetCDF output of all release sites in jobs_dir, one file per worker process."""
+    path_list = sorted(Path(f) for f in glob.iglob(f"{jobs_dir}/*/output/*.nc"))
+
+    if not path_list:
+        _logger.warning("No NetCDF output found to post-process in %s", jobs_dir)
+        return []
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(compress_netcdf, path, compression) for path in path_list]
+        for future in futures:
+            future.result()
+
+    count(nbytes=sum(path.stat().st_size for path in path_list), objects=len(path_list))
+
+    return path_list
+
+
+def compress_netcdf(path: Path, compression: CompressionConfig) -> None:
+    """Rewrite the NetCDF file at path in place with the given compression and chunking."""
+    tmp_path = path.with_name(path.name + ".tmp")
+    size_before = path.stat().st_size
+
+    # A partial file left in the output directory would be uploaded with the output.
+    try:
+        with netCDF4.Dataset(path, "r") as src, netCDF4.Dataset(tmp_path, "w", format="NETCDF4") as dst:
+            src.set_auto_maskandscale(False)
+            dst.setncatts({name: src.getncattr(name) for name in src.ncattrs()})
+
+            for name, dim in src.dimensions.items():
+                dst.createDimension(name, None if dim.isunlimited() else len(dim))
+
+            for var in src.variables.values():
+                _copy_variable(src, dst, var, compression)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    os.replace(tmp_path, path)
+
+    _logger.info(
+        "Compressed %s from %d to %d bytes",
+        path,
+        size_before,
+        path.stat().st_size,
+    )
+
+
+def _copy_variable(
+    src: netCDF4.Dataset,
+    dst: netCDF4.Dataset,
+    var: netCDF4.Variable,
+    compression: CompressionConfig,
+) -> None:
+    attrs = {name: var.getncattr(name) for name in var.ncattrs() if name != "_FillValue"}
+    fill_value = var.getncattr("_FillValue") if "_FillValue" in var.ncattrs() else None
+
+    is_field = _is_gridded_field(var)
+    significant_digits = compression.significant_digits if is_field else None
+
+    out = dst.createVariable(
+        var.name,
+        var.dtype,
+        var.dimensions,
+        compression=compression.compression,
+        complevel=compression.complevel,
+        shuffle=True,
+        chunksizes=_chunksizes(src, var, compression) if var.dimensions else None,
+        fill_value=fill_value,
+        significant_digits=significant_digits,
+    )
+    out.setncatts(attrs)
+    out.set_auto_maskandscale(False)
+
+    if not is_field:
+        out[...] = var[...]
+        return
+
+    # Copy the gridded fields one block of output times at a time to bound memory use.
+    time_axis = var.dimensions.index("time")
+    n_times = src.dimensions["time"].size
+    for start in range(0, n_times, compression.time_chunk):
+        index = [slice(None)] * var.ndim
+        index[time_axis] = slice(start, min(start + compression.time_chunk, n_times))
+        out[tuple(index)] = var[tuple(index)]
+
+
+def _is_gridded_field(var: netCDF4.Variable) -> bool:
+    """Concentration and deposition fields are the floating point variables on the time/lat/lon grid."""
+    return bool(
+        "time" in var.dimensions
+        and all(dim in var.dimensions for dim in _SPATIAL_DIMS)
+        and np.issubdtype(var.dtype, np.floating)
+    )
+
+
+def _chunksizes(src: netCDF4.Dataset, var: netCDF4.Variable, compression: CompressionConfig) -> list[int]:
+    """
+    Chunk the gridded fields in blocks of several output times over square horizontal tiles,
+    and one element along every other dimension. A map at one time then touches only a few tiles,
+    and a time series at one point only a few time blocks. All other variables are a single chunk.
+    """
+    sizes = [max(src.dimensions[dim].size, 1) for dim in var.dimensions]
+    if not _is_gridded_field(var):
+        return sizes
+
+    chunks: list[int] = []
+    for dim, size in zip(var.dimensions, sizes):
+        if dim == "time":
+            chunks.append(min(compression.time_chunk, size))
+        elif dim in _SPATIAL_DIMS:
+            chunks.append(min(compression.spatial_chunk, size))
+        else:
+            chunks.append(1)
+    return chunks
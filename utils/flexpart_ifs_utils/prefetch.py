@@ -0,0 +1,178 @@
+"""
+The module prefetches the input files of the latest forecast cycle into a local cache as they arrive in
+the input bucket, so that the runs triggered once the cycle is complete find them already local.
+
+The prefetcher polls the manifest of the cycle, or lists the objects under the prefix of the cycle if it
+has no manifest, and downloads the files not yet cached in valid-time order, the order the runs read them.
+Without a cycle given, the latest cycle is the latest of the cycle prefixes of the bucket.
+Downloads are throttled to the configured bandwidth, and files of older cycles are removed from the cache
+to keep it below the configured disk usage. The files are cached under their key, as files of the same
+name are published by every cycle, and written aside and moved once verified so that a partial download
+is never used.
+
+generate hard links the cached files of its keys into the data directory of the job, which leaves them
+usable by the job if the prefetcher removes them from the cache, and downloads the missing ones only.
+"""
+
+import logging
+import os
+import shutil
+import signal
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+from flexpart_ifs_utils.config.service_settings import Bucket, PrefetchConfig
+from flexpart_ifs_utils.grib_utils import check_grib_framing
+from flexpart_ifs_utils.manifest import (cycle_prefix, latest_cycle,
+                                         read_manifest)
+from flexpart_ifs_utils.s3_utils import (_create_s3_client, _download_verified,
+                                         _input_bucket, list_objs_in_bucket)
+from flexpart_ifs_utils.timing import count, phase
+
+_logger = logging.getLogger(__name__)
+
+
+class _Throttle:
+    """Sleeps after each download as long as needed to keep the average rate below max_bandwidth bytes per second."""
+
+    def __init__(self, max_bandwidth: int | None) -> None:
+        self.max_bandwidth = max_bandwidth
+        self._start = time.monotonic()
+        self._bytes = 0
+
+    def downloaded(self, nbytes: int) -> None:
+        if self.max_bandwidth is None:
+            return
+        self._bytes += nbytes
+        if (delay := self._bytes / self.max_bandwidth - (time.monotonic() - self._start)) > 0:
+            time.sleep(delay)
+
+
+class _CacheUsage:
+    """
+    The bytes used by the cache and the files it may remove, oldest first. The cache is walked once per poll,
+    and the usage updated as files are downloaded or removed.
+    """
+
+    def __init__(self, cache_dir: Path, keep: set[str], max_disk_usage: int | None) -> None:
+        self.max_disk_usage = max_disk_usage
+        self.usage = 0
+        evictable = []
+        if max_disk_usage is not None:
+            for path in cache_dir.rglob("*"):
+                if not path.is_file() or path.name.startswith("."):
+                    continue
+                stat = path.stat()
+                self.usage += stat.st_size
+                if path.relative_to(cache_dir).as_posix() not in keep:
+                    evictable.append((stat.st_mtime, path, stat.st_size))
+        self._evictable = deque(sorted(evictable))
+
+    def downloaded(self, nbytes: int) -> None:
+        self.usage += nbytes
+
+    def evict(self) -> bool:
+        """
+        Remove the oldest files until the cache uses less than max_disk_usage bytes, before a download whose
+        size is not known. Returns whether the cache is still full.
+        """
+        if self.max_disk_usage is None:
+            return False
+        while self.usage >= self.max_disk_usage and self._evictable:
+            _, path, size = self._evictable.popleft()
+            _logger.info("Removing %s from the cache", path)
+            path.unlink(missing_ok=True)
+            self.usage -= size
+        return self.usage >= self.max_disk_usage
+
+
+def prefetch(config: PrefetchConfig, cycle: datetime | None = None, once: bool = False,
+             bucket: Bucket | None = None) -> None:
+    """
+    Download the files of cycle into the cache, or of the latest cycle in the bucket if cycle is None,
+    following the newer cycles as they appear. Polls the bucket until SIGTERM or SIGINT is received,
+    or once only if once is set.
+    """
+    bucket = _input_bucket(bucket)
+
+    stopping = threading.Event()
+    handlers = {signum: signal.signal(signum, lambda *_: stopping.set()) for signum in (signal.SIGTERM, signal.SIGINT)}
+    try:
+        while not stopping.is_set():
+            with phase("prefetch"):
+                prefetch_cycle(config, cycle, bucket, stopping)
+            if once:
+                break
+            stopping.wait(config.poll_interval)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+
+def prefetch_cycle(config: PrefetchConfig, cycle: datetime | None = None, bucket: Bucket | None = None,
+                   stopping: threading.Event | None = None) -> list[str]:
+    """Download the files of cycle, or of the latest cycle, not in the cache yet, and return their keys."""
+    bucket = _input_bucket(bucket)
+    cache_dir = Path(config.cache_dir)
+    if cycle is None:
+        cycle = latest_cycle(bucket)
+    if cycle is not None:
+        # Only the objects of the cycle are listed if it has no manifest, not those of every cycle retained.
+        catalogue = read_manifest(cycle, bucket) or list_objs_in_bucket(datetime.min, datetime.max, bucket,
+                                                                        prefix=cycle_prefix(cycle))
+    else:
+        # Without cycle prefixes, the cycles are known from the metadata of the objects only.
+        catalogue = list_objs_in_bucket(datetime.min, datetime.max, bucket)
+        cycle = catalogue.latest_cycle()
+    if cycle is None:
+        _logger.info("No input files in bucket %s yet", bucket.name)
+        return []
+
+    keys = catalogue.cycle_keys(cycle)
+    missing = [key for key in keys if not (cache_dir / key).exists()]
+    _logger.info("%d of the %d files of cycle %s are not cached", len(missing), len(keys), cycle)
+
+    client = _create_s3_client(bucket)
+    # The rate is limited over the downloads of a poll, not accumulated while waiting for new files.
+    throttle = _Throttle(config.max_bandwidth)
+    cache_usage = _CacheUsage(cache_dir, set(keys), config.max_disk_usage)
+    downloaded: list[str] = []
+    for key in missing:
+        if stopping is not None and stopping.is_set():
+            break
+        if cache_usage.evict():
+            _logger.warning("The cache %s is full with files of cycle %s, %d files not prefetched", cache_dir,
+                            cycle, len(missing) - len(downloaded))
+            break
+
+        path = cache_dir / key
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _logger.info("Prefetching %s to %s", key, path)
+        _download_verified(client, bucket, key, path)
+        check_grib_framing(path)
+        size = path.stat().st_size
+        count(nbytes=size, objects=1)
+        downloaded.append(key)
+        cache_usage.downloaded(size)
+        throttle.downloaded(size)
+    return downloaded
+
+
+def link_cached(keys: list[str], data_dir: Path, cache_dir: Path) -> list[str]:
+    """Hard link the cached files of keys into data_dir, copying them across file systems, and return the others."""
+    missing = []
+    for key in keys:
+        cached, path = cache_dir / key, data_dir / Path(key).name
+        if not cached.exists():
+            missing.append(key)
+            continue
+        path.unlink(missing_ok=True)
+        try:
+            os.link(cached, path)
+        except OSError:
+            shutil.copyfile(cached, path)
+    _logger.info("%d of %d input files found in the cache %s", len(keys) - len(missing), len(keys), cache_dir)
+    return missing
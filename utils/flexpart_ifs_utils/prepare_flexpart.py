@@ -9,19 +9,35 @@ import logging
 import os
 import re
 import shutil
+import tempfile
 from datetime import datetime, timedelta
 from pathlib import Path
 
 import yaml
 from jinja2 import Environment, FileSystemLoader
+from pydantic import BaseModel
 
 from flexpart_ifs_utils.config.service_settings import OpenMPConfig
 from flexpart_ifs_utils.grib_utils import _get_valid_datetime
+from flexpart_ifs_utils.manifest import read_manifest
 from flexpart_ifs_utils.model import MODEL_PREFIX, Model
-from flexpart_ifs_utils.s3_utils import list_objs_in_bucket, _select_keys_in_window
+from flexpart_ifs_utils.s3_utils import list_objs_in_bucket
+from flexpart_ifs_utils.timing import phase, timed
 
 _logger = logging.getLogger(__name__)
 
+_OUTGRID_KEYS = ("OUTLON0", "OUTLAT0", "NUMXGRID", "NUMYGRID", "DXOUT", "DYOUT")
+
+
+class OutputGrid(BaseModel):
+    """The output grid of the OUTGRID namelist."""
+    outlon0: float
+    outlat0: float
+    numxgrid: int
+    numygrid: int
+    dxout: float
+    dyout: float
+
 
 def _init_job_dirs(jobs_dir: Path, name: str) -> tuple[Path, Path, Path, Path]:
     job_dir = jobs_dir / name
@@ -46,6 +62,49 @@ def _populate_input_dir(flexpart_dir: Path, input_dir: Path, model: Model) -> No
         raise ValueError(f"Unsupported model: {model}")
 
 
+def _configure_input_dir(configuration: dict, flexpart_dir: Path, input_dir: Path, model: Model,
+                         outgrid: OutputGrid | None = None) -> list[Path]:
+    """Write the namelists of the job to input_dir, and return the paths of COMMAND, RELEASES and OUTGRID."""
+    _populate_input_dir(flexpart_dir, input_dir, model)
+    if outgrid is not None:
+        # The input fields were cropped, the output grid must lie within them.
+        _write_outgrid(input_dir / "OUTGRID", outgrid)
+
+    with phase("configure_namelists"):
+        namelists: list[Path] = [input_dir / "COMMAND", *sorted(input_dir.glob("RELEASES*"))]
+        for nl in namelists:
+            _configure_namelist(configuration, nl)
+    return [*namelists, input_dir / "OUTGRID"]
+
+
+def render_namelists(configuration: dict, flexpart_dir: Path, model: Model) -> dict[str, str]:
+    """The COMMAND, RELEASES and OUTGRID namelists of the job of configuration, by name, as written to a job."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        paths = _configure_input_dir(configuration, flexpart_dir, Path(tmp_dir) / "input", model)
+        return {path.name: path.read_text(encoding="utf-8") for path in paths}
+
+
+def read_outgrid(path: Path) -> OutputGrid:
+    """Read the output grid of an OUTGRID namelist."""
+    filedata = path.read_text(encoding="utf-8")
+    values: dict[str, str] = {}
+    for key in _OUTGRID_KEYS:
+        match = re.search(key + r"\s*=\s*(-?[\d.]+)", filedata)
+        if match is None:
+            raise RuntimeError(f"{key} is missing from {path}")
+        values[key.lower()] = match.group(1)
+    return OutputGrid.model_validate(values)
+
+
+def _write_outgrid(path: Path, grid: OutputGrid) -> None:
+    """Replace the output grid of the OUTGRID namelist at path, keeping its heights and comments."""
+    filedata = path.read_text(encoding="utf-8")
+    for key in _OUTGRID_KEYS:
+        value = getattr(grid, key.lower())
+        filedata = re.sub(rf"({key}\s*=\s*)-?[\d.]+", rf"\g<1>{value}", filedata)
+    path.write_text(filedata, encoding="utf-8")
+
+
 def _path_list(data_dir: Path, model: Model) -> list[Path]:
     """Return a sorted list of data files for the given domain."""
     return sorted(data_dir.glob(MODEL_PREFIX[model]))
@@ -77,6 +136,7 @@ def _write_pathnames(
         "".join(lines),
     )
 
+@timed("prepare_job_directory")
 def prepare_job_directory(
     configuration: dict,
     jobs_dir: Path,
@@ -84,30 +144,28 @@ def prepare_job_directory(
     data_dir: Path,
     openmp_config: OpenMPConfig,
     model: Model,
+    outgrid: OutputGrid | None = None,
 ) -> Path:
     job_dir, input_dir, output_dir, job_data_dir = _init_job_dirs(
         jobs_dir, configuration["name"]
     )
 
-    _populate_input_dir(flexpart_dir, input_dir, model)
-
-    namelists: list[Path] = [input_dir / "COMMAND", *input_dir.glob("RELEASES*")]
-    for nl in namelists:
-        _configure_namelist(configuration, nl)
+    _configure_input_dir(configuration, flexpart_dir, input_dir, model, outgrid)
 
-    available_path = input_dir / "AVAILABLE"
-    _generate_available(available_path, _path_list(data_dir, model=model))
-    available_path_nested = None
-    if model == Model.IFS_HRES:
-        available_path_nested = input_dir / "AVAILABLE_NESTED"
-        _generate_available(available_path_nested, _path_list(data_dir, model=Model.IFS_HRES_EUROPE))
+    with phase("generate_available"):
+        available_path = input_dir / "AVAILABLE"
+        _generate_available(available_path, _path_list(data_dir, model=model))
+        available_path_nested = None
+        if model == Model.IFS_HRES:
+            available_path_nested = input_dir / "AVAILABLE_NESTED"
+            _generate_available(available_path_nested, _path_list(data_dir, model=Model.IFS_HRES_EUROPE))
 
     os.symlink(data_dir, job_data_dir)
     _write_pathnames(job_dir, input_dir, output_dir, job_data_dir, available_path, available_path_nested)
 
     _write_job_script(
         job_dir / "job",
-        flexpart_dir / "bin" / "FLEXPART",
+        flexpart_executable(flexpart_dir, openmp_config),
         openmp_config,
     )
     return job_dir
@@ -143,23 +201,50 @@ def _filter_config(yaml_file: Path, release_sites: list[str]) -> None:
         yaml.dump(filtered_sections, file)
 
 
+def flexpart_executable(flexpart_dir: Path, openmp_config: OpenMPConfig) -> Path:
+    """The FLEXPART binary of the jobs, the parallel FLEXPART_MPI if MPI is configured."""
+    return flexpart_dir / "bin" / ("FLEXPART" if openmp_config.mpi is None else "FLEXPART_MPI")
+
+
 def _write_job_script(
     file_path: Path | str,
     flexpart_exe: Path | str,
     openmp_config: OpenMPConfig,
 ) -> None:
     """Writes the final bash script that will execute Flexpart"""
+    lines = [
+        "#!/bin/bash\n",
+        f"export OMP_NUM_THREADS={openmp_config.num_threads}\n\n",
+        f"export OMP_STACKSIZE={openmp_config.stack_size}\n\n",
+        "ulimit -s unlimited\n\n",
+        f"export FLEXPART_EXE={flexpart_exe}\n",
+    ]
+    if openmp_config.mpi is None:
+        lines.append("$FLEXPART_EXE -vvv\n")
+    else:
+        lines.append(f"export FLEXPART_MPI_RANKS={openmp_config.mpi.ranks}\n")
+        lines.append(f"{_mpi_launcher(openmp_config)} $FLEXPART_EXE -vvv\n")
+
     with open(file_path, "w", encoding="utf-8") as f:
-        f.writelines(
-            [
-                "#!/bin/bash\n",
-                f"export OMP_NUM_THREADS={openmp_config.num_threads}\n\n",
-                f"export OMP_STACKSIZE={openmp_config.stack_size}\n\n",
-                "ulimit -s unlimited\n\n",
-                f"export FLEXPART_EXE={flexpart_exe}\n",
-                "$FLEXPART_EXE -vvv\n",
-            ]
-        )
+        f.writelines(lines)
+
+
+def _mpi_launcher(openmp_config: OpenMPConfig) -> str:
+    """The command launching the MPI ranks, each with the OpenMP threads of openmp_config."""
+    mpi = openmp_config.mpi
+    assert mpi is not None
+    if mpi.launcher == "mpirun":
+        # The environment of the script, with the OpenMP settings, is passed to the ranks on a single node.
+        args = ["mpirun", "-n", "$FLEXPART_MPI_RANKS"]
+        if mpi.binding is not None:
+            args += ["--bind-to", mpi.binding]
+    elif mpi.launcher == "srun":
+        args = ["srun", "--ntasks=$FLEXPART_MPI_RANKS", f"--cpus-per-task={openmp_config.num_threads}"]
+        if mpi.binding is not None:
+            args.append(f"--cpu-bind={mpi.binding}")
+    else:
+        raise RuntimeError(f"Unsupported MPI launcher {mpi.launcher}, expected mpirun or srun")
+    return " ".join(args)
 
 
 def _generate_available(path: Path, data_paths: list[Path]) -> None:
@@ -217,6 +302,7 @@ def _get_start_end(config: dict) -> tuple[datetime, datetime]:
     return start_dt, end_dt
 
 
+@timed("select_files")
 def select_files(
     config: dict,
     forecast_datetime: str,
@@ -233,7 +319,8 @@ def select_files(
 
     start_dt, end_dt = _get_start_end(config)
 
-    forecast_ref = datetime.strptime(forecast_datetime, "%Y%m%d%H%M")
+    # The forecast datetime is YYYYMMDDHH, or YYYYMMDDHHMM with the minutes of the cycle, always 00.
+    forecast_ref = datetime.strptime(forecast_datetime[:10], "%Y%m%d%H")
 
     if start_dt > forecast_ref:
         if model == Model.IFS_HRES:
@@ -243,12 +330,20 @@ def select_files(
         else:
             raise ValueError(f"Unsupported model: {model}")
 
-    objs = list_objs_in_bucket(
-        start_time=start_dt,
-        end_time=end_dt,
-    )
+    # The manifest of the cycle lists its files in one object, the bucket is listed only if it is missing
+    # or does not cover the simulation, e.g. when the simulation starts before the cycle.
+    catalogue = read_manifest(forecast_ref)
+    if catalogue is None or not catalogue.covers(start_dt, end_dt, step_unit):
+        if catalogue is not None:
+            _logger.info("The manifest of %s does not cover %s to %s, listing the bucket", forecast_ref, start_dt,
+                         end_dt)
+        catalogue = list_objs_in_bucket(
+            start_time=start_dt,
+            end_time=end_dt,
+        )
 
-    filtered_objs = _select_keys_in_window(objs, start_dt, end_dt, step_unit)
+    # Of the cycles in the bucket, the files of the latest one up to the forecast are used.
+    filtered_objs = catalogue.select(start_dt, end_dt, step_unit, latest_cycle=forecast_ref)
 
     if not filtered_objs:
         raise RuntimeError(
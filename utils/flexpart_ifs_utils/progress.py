@@ -0,0 +1,182 @@
+"""
+The module runs the job script of a release site and follows the progress of Flexpart on its
+verbose standard output. The output is passed through unchanged, and every progress line of
+Flexpart (the simulated time and the number of active particles, printed after each output step)
+updates the progress of the run: the wall time of each output step, the throughput in simulated
+hours per wall second and the estimated time remaining. The progress is logged as a structured
+event and written to the progress.json file of the job directory on every update.
+"""
+
+import logging
+import os
+import re
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from pydantic import BaseModel
+
+_logger = logging.getLogger(__name__)
+
+PROGRESS_FILE = "progress.json"
+
+# Formats 45 and 46 of timemanager.f90, format 45 in upper case in timemanager_mpi.f90
+_SECONDS_SIMULATED = re.compile(r"^\s*(-?\d+) Seconds simulated:\s+(\d+) Particles:", re.IGNORECASE)
+_HOURS_SIMULATED = re.compile(r"^\s*Simulated\s+-?[\d.]+ hours \(\s*(-?\d+) s\),\s+(\d+) particles", re.IGNORECASE)
+_COMPLETED = "CONGRATULATIONS: YOU HAVE SUCCESSFULLY COMPLETED A FLEXPART MODEL RUN!"
+_NUM_THREADS = re.compile(r"^export OMP_NUM_THREADS=(\d+)", re.MULTILINE)
+_MPI_RANKS = re.compile(r"^export FLEXPART_MPI_RANKS=(\d+)", re.MULTILINE)
+
+
+class OutputStep(BaseModel):
+    simulated_seconds: int
+    particles: int
+    # Wall time since the start of the run and since the previous output step
+    wall_time: float
+    step_wall_time: float
+
+
+class Progress(BaseModel):
+    total_seconds: int
+    # OpenMP threads of each rank, and MPI ranks of FLEXPART_MPI
+    num_threads: int | None = None
+    num_ranks: int | None = None
+    simulated_seconds: int = 0
+    particles: int = 0
+    wall_time: float = 0.
+    simulated_hours_per_wall_second: float | None = None
+    eta_seconds: float | None = None
+    completed: bool = False
+    returncode: int | None = None
+    steps: list[OutputStep] = []
+
+
+def parse_progress_line(line: str) -> tuple[int, int] | None:
+    """Return the simulated seconds and the number of particles of a Flexpart progress line."""
+    match = _SECONDS_SIMULATED.match(line) or _HOURS_SIMULATED.match(line)
+    if match is None:
+        return None
+    return abs(int(match.group(1))), int(match.group(2))
+
+
+def run_job(job_dir: Path, run_dir: Path | None = None) -> Progress:
+    """
+    Run the job script of job_dir in run_dir, the job directory by default, echoing its output and recording
+    the progress of Flexpart. Flexpart reads the pathnames file of run_dir.
+    """
+    progress = Progress(
+        total_seconds=_simulation_length(job_dir / "input" / "COMMAND"),
+        num_threads=_num_threads(job_dir / "job"),
+        num_ranks=_num_ranks(job_dir / "job"),
+    )
+
+    start = time.monotonic()
+    # Wall time of the first progress line, printed when time stepping starts after reading the input
+    stepping_start: float | None = None
+
+    with subprocess.Popen(
+        ["bash", str(job_dir / "job")],
+        cwd=run_dir or job_dir,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+    ) as process:
+        assert process.stdout is not None
+        for line in process.stdout:
+            sys.stdout.write(line)
+            sys.stdout.flush()
+
+            if _COMPLETED in line:
+                progress.completed = True
+                continue
+
+            parsed = parse_progress_line(line)
+            if parsed is None:
+                continue
+
+            now = time.monotonic()
+            if stepping_start is None:
+                stepping_start = now
+            _update(progress, *parsed, now - start, now - stepping_start)
+            _publish(progress, job_dir)
+
+    progress.returncode = process.returncode
+    progress.wall_time = time.monotonic() - start
+    _publish(progress, job_dir)
+
+    if process.returncode != 0:
+        _logger.error("Flexpart job in %s failed with return code %d", job_dir, process.returncode)
+
+    return progress
+
+
+def _update(
+    progress: Progress,
+    simulated_seconds: int,
+    particles: int,
+    wall_time: float,
+    stepping_time: float,
+) -> None:
+    previous_wall_time = progress.steps[-1].wall_time if progress.steps else 0.
+    progress.steps.append(OutputStep(
+        simulated_seconds=simulated_seconds,
+        particles=particles,
+        wall_time=wall_time,
+        step_wall_time=wall_time - previous_wall_time,
+    ))
+    progress.simulated_seconds = simulated_seconds
+    progress.particles = particles
+    progress.wall_time = wall_time
+
+    if simulated_seconds > 0 and stepping_time > 0:
+        rate = simulated_seconds / stepping_time
+        progress.simulated_hours_per_wall_second = rate / 3600
+        progress.eta_seconds = max(progress.total_seconds - simulated_seconds, 0) / rate
+
+
+def _publish(progress: Progress, job_dir: Path) -> None:
+    _logger.info(
+        "Simulated %d of %d s with %d particles, %s simulated hours per wall second, ETA %s s",
+        progress.simulated_seconds,
+        progress.total_seconds,
+        progress.particles,
+        _format(progress.simulated_hours_per_wall_second),
+        _format(progress.eta_seconds),
+        extra={"progress": progress.model_dump(exclude={"steps"})},
+    )
+    path = job_dir / PROGRESS_FILE
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(progress.model_dump_json(indent=2), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+def _simulation_length(command: Path) -> int:
+    """Length of the simulation in seconds, from the start and end date and time of the COMMAND namelist."""
+    text = command.read_text(encoding="utf-8")
+    values = {}
+    for key in ("IBDATE", "IBTIME", "IEDATE", "IETIME"):
+        match = re.search(rf"^\s*{key}=\s*(\d+)", text, re.MULTILINE)
+        if match is None:
+            raise RuntimeError(f"{key} not found in {command}")
+        values[key] = match.group(1)
+
+    start = datetime.strptime(values["IBDATE"] + values["IBTIME"].zfill(6), "%Y%m%d%H%M%S")
+    end = datetime.strptime(values["IEDATE"] + values["IETIME"].zfill(6), "%Y%m%d%H%M%S")
+    return int(abs((end - start).total_seconds()))
+
+
+def _num_threads(job_script: Path) -> int | None:
+    match = _NUM_THREADS.search(job_script.read_text(encoding="utf-8"))
+    return int(match.group(1)) if match else None
+
+
+def _num_ranks(job_script: Path) -> int | None:
+    match = _MPI_RANKS.search(job_script.read_text(encoding="utf-8"))
+    return int(match.group(1)) if match else None
+
+
+def _format(value: float | None) -> str:
+    return "n/a" if value is None else f"{value:.3f}"
@@ -0,0 +1,164 @@
+"""
+The module extracts time series of the NetCDF output of Flexpart at receptors, points of interest such
+as cities or monitoring stations, read from a file in the format of the RECEPTORS namelist of Flexpart
+or from a CSV file with name, longitude and latitude columns.
+
+The fields are interpolated bilinearly from the four cells around each receptor. The indices and weights
+of these cells are computed once per receptor set and output grid, so the interpolation of a block of
+output times is one gather of the four cells of all receptors and a weighted sum, whatever the number of
+receptors. The fields are read a few output times at a time, and summed over the age classes.
+
+The series of grid_conc_<datetime>.nc are written to receptors_<datetime>.csv in the same directory, one
+row per receptor and output time, with a column per concentration field and height and per deposition
+field. Receptors outside the output grid have empty values.
+"""
+
+import csv
+import logging
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import netCDF4
+import numpy as np
+from pydantic import BaseModel
+
+from flexpart_ifs_utils.config.service_settings import ReceptorsConfig
+from flexpart_ifs_utils.netcdf_output import (CONCENTRATION, DEPOSITION,
+                                              grid_conc_files, time_blocks)
+from flexpart_ifs_utils.timing import timed
+
+_logger = logging.getLogger(__name__)
+
+_RECEPTOR = re.compile(
+    r"RECEPTOR\s*=\s*[\"']([^\"']*)[\"']\s*,\s*LON\s*=\s*([-+.\dEe]+)\s*,\s*LAT\s*=\s*([-+.\dEe]+)",
+    re.IGNORECASE,
+)
+
+
+class Receptor(BaseModel):
+    name: str
+    longitude: float
+    latitude: float
+
+
+class ReceptorWeights:
+    """The flat indices of the four cells around each receptor in a (latitude, longitude) field and their weights."""
+
+    def __init__(self, indices: np.ndarray, weights: np.ndarray) -> None:
+        self.indices = indices
+        self.weights = weights
+
+    def apply(self, block: np.ndarray) -> np.ndarray:
+        """The values at the receptors of the fields of block, its last two dimensions replaced by the receptors."""
+        flat = block.reshape(*block.shape[:-2], -1)
+        return (flat[..., self.indices] * self.weights).sum(axis=-1)
+
+
+@timed("extract_receptors")
+def extract_receptors(jobs_dir: Path, config: ReceptorsConfig, max_workers: int) -> list[Path]:
+    """Extract the series at the receptors for the configured release sites found in jobs_dir, a file per process."""
+    receptors = read_receptors(Path(config.path))
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(extract_receptors_from_file, path, receptors, config.time_chunk)
+                   for path in grid_conc_files(jobs_dir, config.sites)]
+        return [future.result() for future in futures]
+
+
+def read_receptors(path: Path) -> list[Receptor]:
+    """The receptors of a CSV file with name, longitude and latitude columns, or of a RECEPTORS namelist."""
+    if path.suffix == ".csv":
+        with open(path, newline="", encoding="utf-8") as f:
+            return [Receptor(name=row["name"], longitude=float(row["longitude"]), latitude=float(row["latitude"]))
+                    for row in csv.DictReader(f)]
+    return [Receptor(name=name.strip(), longitude=float(lon), latitude=float(lat))
+            for name, lon, lat in _RECEPTOR.findall(path.read_text(encoding="utf-8"))]
+
+
+def bilinear_weights(receptors: list[Receptor], longitude: np.ndarray, latitude: np.ndarray) -> ReceptorWeights:
+    """The weights of the bilinear interpolation at the receptors on the regular grid of longitude and latitude."""
+    n_lon, n_lat = len(longitude), len(latitude)
+    x = _grid_positions(np.array([r.longitude for r in receptors]), longitude)
+    y = _grid_positions(np.array([r.latitude for r in receptors]), latitude)
+    inside = (x >= 0) & (x <= n_lon - 1) & (y >= 0) & (y <= n_lat - 1)
+
+    # Receptors on the last row or column are interpolated in the cell before it, and receptors on grids of a
+    # single row or column in the row or column, with zero weights of the cells after it.
+    i = np.clip(np.floor(x), 0, max(n_lon - 2, 0)).astype(np.int64)
+    j = np.clip(np.floor(y), 0, max(n_lat - 2, 0)).astype(np.int64)
+    i1, j1 = np.minimum(i + 1, n_lon - 1), np.minimum(j + 1, n_lat - 1)
+    dx, dy = x - i, y - j
+    indices = np.stack([j * n_lon + i, j * n_lon + i1, j1 * n_lon + i, j1 * n_lon + i1], axis=1)
+    weights = np.stack([(1 - dx) * (1 - dy), dx * (1 - dy), (1 - dx) * dy, dx * dy], axis=1)
+
+    if not inside.all():
+        _logger.warning("%d receptors are outside the output grid: %s", np.count_nonzero(~inside),
+                        ", ".join(r.name for r, is_inside in zip(receptors, inside) if not is_inside))
+        indices[~inside] = 0
+        weights[~inside] = np.nan
+    return ReceptorWeights(indices, weights)
+
+
+def _grid_positions(coordinates: np.ndarray, axis: np.ndarray) -> np.ndarray:
+    """
+    Fractional indices of coordinates on the regular axis, rounded to the precision of the single precision
+    coordinates of the output so that receptors on grid nodes take the values of the nodes. On an axis of a
+    single node, the coordinates on the node are at index 0 and all others outside, at index -1.
+    """
+    offset = coordinates - float(axis[0])
+    if len(axis) == 1:
+        return np.where(np.round(offset, 4) == 0, 0., -1.)
+    return np.round(offset / (float(axis[-1] - axis[0]) / (len(axis) - 1)), 4)
+
+
+def extract_receptors_from_file(path: Path, receptors: list[Receptor], time_chunk: int) -> Path:
+    out_path = path.with_name(path.name.replace("grid_conc_", "receptors_", 1)).with_suffix(".csv")
+    _logger.info("Extracting the series at %d receptors from %s into %s", len(receptors), path, out_path)
+
+    with netCDF4.Dataset(path, "r") as src:
+        src.set_auto_maskandscale(False)
+        weights = bilinear_weights(receptors, src["longitude"][:], src["latitude"][:])
+        times = np.array(netCDF4.num2date(src["time"][:], src["time"].units, only_use_cftime_datetimes=False,
+                                          only_use_python_datetimes=True), ndmin=1)
+        heights = src["height"][:]
+
+        columns: dict[str, np.ndarray] = {}
+        for name, var in src.variables.items():
+            if CONCENTRATION.match(name) or DEPOSITION.match(name):
+                columns.update(_series(name, var, weights, heights, time_chunk))
+
+    with open(out_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["receptor", "longitude", "latitude", "time", *columns])
+        values = np.stack(list(columns.values()), axis=-1) if columns else np.zeros((len(times), len(receptors), 0))
+        for r, receptor in enumerate(receptors):
+            for t, time in enumerate(times):
+                writer.writerow([receptor.name, receptor.longitude, receptor.latitude, f"{time:%Y-%m-%dT%H:%M:%SZ}",
+                                 *("" if np.isnan(v) else f"{v:.6g}" for v in values[t, r])])
+    return out_path
+
+
+def _series(
+    name: str,
+    var: netCDF4.Variable,
+    weights: ReceptorWeights,
+    heights: np.ndarray,
+    time_chunk: int,
+) -> dict[str, np.ndarray]:
+    """The series of var at the receptors, with dimensions (time, receptor), by column name."""
+    # The dimensions of the output are (nageclass, pointspec, time[, height], latitude, longitude).
+    time_axis = var.dimensions.index("time")
+    series = np.concatenate(
+        [weights.apply(block).sum(axis=0) for _, block in time_blocks(var, time_axis, time_chunk)],
+        axis=time_axis - 1,
+    )
+    columns = {}
+    for p, point_series in enumerate(series):
+        suffix = f"_p{p + 1}" if len(series) > 1 else ""
+        if "height" in var.dimensions:
+            for h, height in enumerate(heights):
+                columns[f"{name}_{height:g}m{suffix}"] = point_series[:, h]
+        else:
+            columns[f"{name}{suffix}"] = point_series
+    return columns
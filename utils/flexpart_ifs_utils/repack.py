@@ -0,0 +1,94 @@
+"""
+The module repacks the downloaded GRIB input to a configured packing type. The packing of the
+input trades size for decoding time: CCSDS compressed fields are several times smaller to transfer
+and to cache than simply packed ones, but they are slower to decode when Flexpart reads them.
+Repacking the input after the download lets a deployment whose bottleneck is the CPU rather than
+the network store compressed fields in the bucket and still give Flexpart fields that decode fast,
+or the reverse.
+
+Files are repacked in place, one file per worker process. The values are decoded and encoded again
+with the same number of bits per value, unless configured otherwise. Messages already in the packing
+type are copied unchanged, as are messages of GRIB editions not supporting it, e.g. grid_ccsds is only
+defined for GRIB2: eccodes then keeps the packing of the message and a warning is logged.
+"""
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from eccodes import (codes_get_long, codes_get_string, codes_get_values,
+                     codes_grib_new_from_file, codes_release, codes_set_long,
+                     codes_set_string, codes_set_values, codes_write)
+
+from flexpart_ifs_utils.config.service_settings import RepackConfig
+from flexpart_ifs_utils.timing import count, timed
+
+_logger = logging.getLogger(__name__)
+
+
+@timed("repack_input")
+def repack_input(paths: list[Path], config: RepackConfig) -> None:
+    """Repack the GRIB files in paths in place to the configured packing type, one file per worker process."""
+    if not paths:
+        return
+
+    size_before = sum(path.stat().st_size for path in paths)
+    with ProcessPoolExecutor(max_workers=config.max_workers) as executor:
+        futures = [
+            executor.submit(repack_grib_file, path, config.packing_type, config.bits_per_value) for path in paths
+        ]
+        for future in futures:
+            future.result()
+
+    count(nbytes=size_before, objects=len(paths))
+    _logger.info(
+        "Repacked %d files to %s from %d to %d bytes",
+        len(paths),
+        config.packing_type,
+        size_before,
+        sum(path.stat().st_size for path in paths),
+    )
+
+
+def repack_grib_file(path: Path, packing_type: str, bits_per_value: int | None = None) -> int:
+    """Rewrite the GRIB file at path with its messages in packing_type, and return the number repacked."""
+    tmp_path = path.with_name(f".{path.name}.part")
+    n_repacked = 0
+    n_unsupported = 0
+    try:
+        with open(path, "rb") as fin, open(tmp_path, "wb") as fout:
+            while (gid := codes_grib_new_from_file(fin)) is not None:
+                try:
+                    if codes_get_string(gid, "packingType") != packing_type:
+                        if _repack_message(gid, packing_type, bits_per_value):
+                            n_repacked += 1
+                        else:
+                            n_unsupported += 1
+                    codes_write(gid, fout)
+                finally:
+                    codes_release(gid)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    os.replace(tmp_path, path)
+
+    if n_unsupported:
+        _logger.warning("%d messages of %s do not support %s and keep their packing", n_unsupported, path,
+                        packing_type)
+    return n_repacked
+
+
+def _repack_message(gid: int, packing_type: str, bits_per_value: int | None) -> bool:
+    """Repack the message, and return whether its edition supports packing_type."""
+    values = codes_get_values(gid)
+    codes_set_string(gid, "packingType", packing_type)
+    if codes_get_string(gid, "packingType") != packing_type:
+        return False
+
+    if bits_per_value is not None and codes_get_long(gid, "bitsPerValue") != bits_per_value:
+        codes_set_long(gid, "bitsPerValue", bits_per_value)
+    # The values are encoded again after the change of packing, as some packings only take it into account then.
+    codes_set_values(gid, values)
+    return True
@@ -0,0 +1,240 @@
+"""
+The module is an asyncio transfer engine for S3, on aiobotocore. It lists buckets, looks up
+object metadata, downloads objects, verified against their checksum, and uploads files with multipart
+uploads. The metadata lookups of a bucket listing are thousands of small, latency bound requests,
+which one event loop keeps in flight far more cheaply than a pool of threads.
+
+The number of requests in flight is bounded by the configured concurrency. Work items are taken
+from their iterator only when a worker is free, and a file is read or written one part at a time,
+so that memory use stays bounded however many objects are transferred.
+
+The synchronous functions at the end of the module run the coroutines in an event loop. They are
+used by s3_utils when the asyncio engine is configured, so the callers do not change.
+"""
+
+import asyncio
+import contextlib
+import logging
+import os
+import tempfile
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Iterable, TypeVar
+
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+
+from flexpart_ifs_utils.checksum import StreamingChecksum
+from flexpart_ifs_utils.config.service_settings import Bucket, TransferConfig
+from flexpart_ifs_utils.timing import count
+
+_logger = logging.getLogger(__name__)
+
+_T = TypeVar("_T")
+_R = TypeVar("_R")
+
+# Size of the reads from a response body stream
+_READ_SIZE = 1024 * 1024
+
+
+class AsyncS3Client:
+    """An aiobotocore S3 client for one bucket, with at most transfer.max_concurrency requests in flight."""
+
+    def __init__(self, bucket: Bucket, transfer: TransferConfig) -> None:
+        self.bucket = bucket
+        self.transfer = transfer
+        self._exit_stack = contextlib.AsyncExitStack()
+        self._client: Any = None
+        self._requests = asyncio.Semaphore(transfer.max_concurrency)
+
+    async def __aenter__(self) -> "AsyncS3Client":
+        config = AioConfig(
+            region_name=self.bucket.region,
+            retries={"max_attempts": self.bucket.retries, "mode": "standard"},
+            max_pool_connections=self.transfer.max_concurrency,
+        )
+        self._client = await self._exit_stack.enter_async_context(
+            get_session().create_client("s3", config=config)
+        )
+        # Count every request sent, including retries, as for the boto3 clients.
+        self._client.meta.events.register("before-send.s3", _count_request)
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self._exit_stack.aclose()
+
+    async def list_objects(self, prefix: str = "") -> list[dict[str, Any]]:
+        objects: list[dict[str, Any]] = []
+        paginator = self._client.get_paginator("list_objects_v2")
+        async for page in paginator.paginate(Bucket=self.bucket.name, Prefix=prefix):
+            objects.extend(page.get("Contents", []))
+        return objects
+
+    async def head_object(self, key: str) -> dict[str, Any]:
+        async with self._requests:
+            return await self._client.head_object(Bucket=self.bucket.name, Key=key)
+
+    async def metadata(self, keys: Iterable[str]) -> dict[str, dict[str, str]]:
+        """The user metadata of each key."""
+
+        async def head(key: str) -> tuple[str, dict[str, str]]:
+            return key, (await self.head_object(key))["Metadata"]
+
+        return dict(await map_bounded(head, keys, self.transfer.max_concurrency))
+
+    async def download(self, key: str, path: Path) -> int:
+        """
+        Download key to path and return its size. The body is streamed through a checksum when the object
+        has one to be verified against, otherwise it is downloaded in concurrent ranged GETs of part_size bytes.
+        The object is written to a temporary file, moved to path once verified.
+        """
+        checksum = StreamingChecksum(key, await self.head_object(key))
+        size = checksum.expected_size or 0
+
+        os.makedirs(path.parent, exist_ok=True)
+        # Unique per download, as keys of different cycles may share the name of the file.
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".part")
+        tmp_path = Path(tmp_name)
+        try:
+            os.ftruncate(fd, size)
+
+            async def get(start: int = 0, end: int | None = None) -> None:
+                byte_range = {} if end is None else {"Range": f"bytes={start}-{end}"}
+                async with self._requests:
+                    response = await self._client.get_object(Bucket=self.bucket.name, Key=key, **byte_range)
+                    async with response["Body"] as body:
+                        offset = start
+                        while chunk := await body.read(_READ_SIZE):
+                            os.pwrite(fd, chunk, offset)
+                            checksum.update(chunk)
+                            offset += len(chunk)
+
+            if checksum.expected is not None:
+                # The checksum needs the body in order, in a single stream.
+                await get()
+            elif size:
+                await map_bounded(
+                    lambda start: get(start, min(start + self.transfer.part_size, size) - 1),
+                    range(0, size, self.transfer.part_size),
+                    self.transfer.max_concurrency,
+                )
+            checksum.verify()
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        finally:
+            os.close(fd)
+
+        os.replace(tmp_path, path)
+        count(nbytes=size, objects=1)
+        return size
+
+    async def upload(self, path: Path, key: str, metadata: dict[str, str] | None = None) -> None:
+        """Upload path to key, as a multipart upload of part_size parts if the file is larger than one part."""
+        size = path.stat().st_size
+        extra_args = {"Metadata": metadata} if metadata else {}
+
+        if size <= self.transfer.part_size:
+            async with self._requests:
+                await self._client.put_object(
+                    Bucket=self.bucket.name, Key=key, Body=path.read_bytes(), **extra_args
+                )
+            count(nbytes=size, objects=1)
+            return
+
+        upload_id = (await self._client.create_multipart_upload(
+            Bucket=self.bucket.name, Key=key, **extra_args
+        ))["UploadId"]
+
+        async def upload_part(number: int) -> dict[str, Any]:
+            with open(path, "rb") as f:
+                f.seek((number - 1) * self.transfer.part_size)
+                data = f.read(self.transfer.part_size)
+            async with self._requests:
+                response = await self._client.upload_part(
+                    Bucket=self.bucket.name, Key=key, UploadId=upload_id, PartNumber=number, Body=data
+                )
+            return {"PartNumber": number, "ETag": response["ETag"]}
+
+        try:
+            n_parts = -(-size // self.transfer.part_size)
+            parts = await map_bounded(upload_part, range(1, n_parts + 1), self.transfer.max_concurrency)
+            await self._client.complete_multipart_upload(
+                Bucket=self.bucket.name, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+            )
+        except BaseException:
+            _logger.error("Multipart upload of %s to %s failed, aborting it.", path, key)
+            await self._client.abort_multipart_upload(Bucket=self.bucket.name, Key=key, UploadId=upload_id)
+            raise
+
+        count(nbytes=size, objects=1)
+
+
+async def map_bounded(
+    func: Callable[[_T], Awaitable[_R]],
+    items: Iterable[_T],
+    limit: int,
+) -> list[_R]:
+    """
+    Await func on every item with at most limit calls in flight, and return the results in the order of items.
+    The items are taken from the iterable only when a worker is free, which applies backpressure to producers.
+    """
+    iterator = iter(enumerate(items))
+    results: dict[int, _R] = {}
+
+    async def worker() -> None:
+        for index, item in iterator:
+            results[index] = await func(item)
+
+    await asyncio.gather(*(worker() for _ in range(limit)))
+    return [results[index] for index in range(len(results))]
+
+
+def list_objects_metadata(bucket: Bucket, transfer: TransferConfig, prefix: str = "") -> dict[str, dict[str, str]]:
+    """The user metadata of every object in the bucket whose key starts with prefix."""
+
+    async def run() -> dict[str, dict[str, str]]:
+        async with AsyncS3Client(bucket, transfer) as client:
+            objects = await client.list_objects(prefix)
+            return await client.metadata(obj["Key"] for obj in objects)
+
+    return asyncio.run(run())
+
+
+def download_keys(keys: list[str], dst_dir: Path, bucket: Bucket, transfer: TransferConfig) -> None:
+    """Download the keys to dst_dir, named after the last component of the key."""
+
+    async def run() -> None:
+        async with AsyncS3Client(bucket, transfer) as client:
+
+            async def download(key: str) -> None:
+                _logger.info("Downloading %s to %s", key, dst_dir / Path(key).name)
+                await client.download(key, dst_dir / Path(key).name)
+
+            await map_bounded(download, keys, transfer.max_concurrency)
+
+    asyncio.run(run())
+
+
+def upload_files(
+    files: list[tuple[Path, str]],
+    bucket: Bucket,
+    transfer: TransferConfig,
+    metadata: dict[str, str] | None = None,
+) -> None:
+    """Upload each (path, key) of files, with the same metadata attached to every object."""
+
+    async def run() -> None:
+        async with AsyncS3Client(bucket, transfer) as client:
+
+            async def upload(file: tuple[Path, str]) -> None:
+                path, key = file
+                _logger.info("Uploading file: %s to bucket: %s with key: %s", path, bucket.name, key)
+                await client.upload(path, key, metadata)
+
+            await map_bounded(upload, files, transfer.max_concurrency)
+
+    asyncio.run(run())
+
+
+def _count_request(**_: Any) -> None:
+    count(requests=1)
@@ -2,46 +2,59 @@ import glob
 import json
 import logging
 import os
+import tempfile
 from datetime import datetime
 from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterable, Iterator
 
-import boto3
-from botocore.client import BaseClient
-from botocore.config import Config
 from botocore.exceptions import ClientError
 
-from flexpart_ifs_utils import CONFIG
-from flexpart_ifs_utils.config.service_settings import Bucket
-from flexpart_ifs_utils.grib_utils import (GribMetadata, RunMetadata,
-                                           _is_grib_file,
+import flexpart_ifs_utils
+from flexpart_ifs_utils.checksum import StreamingChecksum
+from flexpart_ifs_utils.config.service_settings import Bucket, TransferConfig
+from flexpart_ifs_utils.grib_utils import (RunMetadata, _is_grib_file,
+                                           check_grib_framing,
                                            extract_metadata_from_grib_file,
-                                           _get_valid_datetime)
+                                           extract_metadata_from_grib_object)
+from flexpart_ifs_utils.timing import count, timed
+
+if TYPE_CHECKING:
+    from botocore.client import BaseClient
+
+    from flexpart_ifs_utils.catalogue import GribCatalogue
 
 _logger = logging.getLogger(__name__)
 
+# Size of the reads from a response body stream
+_CHUNK_SIZE = 1024 * 1024
+
+# Clients by region and retries, kept by the serve daemon so that their connection pools stay warm across runs.
+# None creates a client per call, as the commands of the CLI run once.
+_clients: dict[tuple[str, int | None], "BaseClient"] | None = None
+
 
+@timed("upload")
 def upload_output(
     directory: Path,
     site: str,
     forecast_datetime: str,
-    bucket: Bucket = CONFIG.main.aws.s3.output,
+    bucket: Bucket | None = None,
     parent: str | None = None,
-) -> None:
+) -> list[str]:
     """
-    Uploads the contents of the Flexpart output directory to an S3 bucket.
+    Uploads the contents of the Flexpart output directory to an S3 bucket, and returns the keys uploaded.
 
     Uploads files from the specified directory to the provided S3 bucket,
     with metadata of forecast datetime and site attached. If a parent directory is specified, only files
     within that parent directory are uploaded.
     """
+    bucket = _output_bucket(bucket)
 
     if not directory.is_dir():
         _logger.error("Directory is empty, cannot upload: %s", directory)
         raise RuntimeError("Directory provided to upload does not exist.")
 
     try:
-        client = _create_s3_client(bucket)
-
         path_list = [
             Path(f)
             for f in glob.iglob(f"{directory}/**", recursive=True)
@@ -51,8 +64,19 @@ def upload_output(
         if parent:
             path_list = [p for p in path_list if p.parent.name == parent]
 
-        for path in path_list:
-            key = f"{forecast_datetime[:8]}_{forecast_datetime[8:10]}/{site}/{path.name}"
+        metadata = _output_metadata(forecast_datetime, site)
+        prefix = _output_prefix(forecast_datetime, site)
+
+        files = [(path, f"{prefix}/{path.name}") for path in path_list]
+
+        if transfer := _async_transfer():
+            from flexpart_ifs_utils import s3_async
+            s3_async.upload_files(files, bucket, transfer, metadata)
+            return [key for _, key in files]
+
+        client = _create_s3_client(bucket)
+
+        for path, key in files:
             _logger.info(
                 "Uploading file: %s to bucket: %s with key: %s",
                 path,
@@ -65,99 +89,240 @@ def upload_output(
                         data,
                         bucket.name,
                         key,
-                        ExtraArgs={"Metadata": {"date": forecast_datetime[:8], "time": forecast_datetime[8:], "site": site}},
+                        ExtraArgs={"Metadata": metadata},
                     )
+                count(nbytes=path.stat().st_size, objects=1)
             except ClientError as exc:
                 _logger.error("Upload failed for %s: %s", path, exc)
                 raise
+        return [key for _, key in files]
     except Exception as err:
         _logger.error("Error uploading directory to S3.")
         raise err
 
 
-def _select_keys_in_window(
-    objs: dict[str, GribMetadata],
-    start_dt: datetime,
-    end_dt: datetime,
-    step_unit: str,
+@timed("upload_store")
+def upload_store(
+    store_path: Path,
+    site: str,
+    forecast_datetime: str,
+    bucket: Bucket | None = None,
 ) -> list[str]:
-    subset: list[str] = []
-    for key, metadata in objs.items():
-        file_validtime = _get_valid_datetime(Path(key), metadata, step_unit)
-        if start_dt <= file_validtime <= end_dt:
-            subset.append(key)
-    return subset
+    """
+    Uploads a Zarr store directory to an S3 bucket, under the same prefix as the output files, and returns
+    the keys uploaded. The relative paths of the store are kept, so the store can be opened from the bucket.
+    """
+    bucket = _output_bucket(bucket)
+
+    prefix = f"{_output_prefix(forecast_datetime, site)}/{store_path.name}"
+    path_list = sorted(p for p in store_path.rglob("*") if p.is_file())
+    metadata = _output_metadata(forecast_datetime, site)
+
+    _logger.info(
+        "Uploading store: %s with %d objects to bucket: %s with prefix: %s",
+        store_path,
+        len(path_list),
+        bucket.name,
+        prefix,
+    )
+    files = [(path, f"{prefix}/{path.relative_to(store_path).as_posix()}") for path in path_list]
+
+    if transfer := _async_transfer():
+        from flexpart_ifs_utils import s3_async
+        s3_async.upload_files(files, bucket, transfer, metadata)
+        return [key for _, key in files]
+
+    client = _create_s3_client(bucket)
+    for path, key in files:
+        try:
+            client.upload_file(
+                str(path),
+                bucket.name,
+                key,
+                ExtraArgs={"Metadata": metadata},
+            )
+            count(nbytes=path.stat().st_size, objects=1)
+        except ClientError as exc:
+            _logger.error("Upload failed for %s: %s", path, exc)
+            raise
+    return [key for _, key in files]
+
 
+def _output_prefix(forecast_datetime: str, site: str) -> str:
+    return f"{forecast_datetime[:8]}_{forecast_datetime[8:10]}/{site}"
 
+
+def _output_metadata(forecast_datetime: str, site: str) -> dict[str, str]:
+    return {"date": forecast_datetime[:8], "time": forecast_datetime[8:], "site": site}
+
+
+@timed("list_objects")
 def list_objs_in_bucket(
     start_time: datetime,
     end_time: datetime,
-    bucket: Bucket = CONFIG.main.aws.s3.nwp_model_data,
-) -> dict[str, GribMetadata]:
+    bucket: Bucket | None = None,
+    prefix: str = "",
+) -> "GribCatalogue":
     """
-    List objects in a S3 bucket with a filter on metadata.
+    List objects in a S3 bucket with a filter on metadata, only the objects whose key starts with prefix if given.
     """
+    # NumPy is only needed once the bucket is listed, not at the startup of every command.
+    from flexpart_ifs_utils.catalogue import GribCatalogue
+
+    bucket = _input_bucket(bucket)
     _logger.info(
         "Fetching objects from S3 with valid time between: start_date=%s, end_date=%s",
         start_time,
         end_time,
     )
 
+    if transfer := _async_transfer():
+        from flexpart_ifs_utils import s3_async
+        objects = s3_async.list_objects_metadata(bucket, transfer, prefix)
+        count(objects=len(objects))
+        return GribCatalogue.from_metadata(
+            _with_data_metadata(bucket, ((key, metadata, None) for key, metadata in objects.items()))
+        )
+
     client = _create_s3_client(bucket)
 
-    try:
+    def head_objects() -> Iterator[tuple[str, dict[str, str], int | None]]:
         paginator = client.get_paginator("list_objects_v2")
-        page_iterator = paginator.paginate(Bucket=bucket.name)
-
-        items: dict[str, GribMetadata] = {}
-        for page in page_iterator:
+        for page in paginator.paginate(Bucket=bucket.name, Prefix=prefix):
             for obj in page.get("Contents", []):
                 head = client.head_object(Bucket=bucket.name, Key=obj["Key"])
-                metadata = json.loads(head.get("Metadata")["data"])
-                required_keys = ("time", "date", "step")
-                missing = [k for k in required_keys if k not in metadata]
-                if missing:
-                    raise KeyError(
-                        f"S3 object '{obj['Key']}' is missing required metadata keys: {missing}"
-                    )
-                items[obj["Key"]] = GribMetadata(
-                    time=metadata["time"],
-                    date=metadata["date"],
-                    step=float(metadata["step"]),
-                )
+                count(objects=1)
+                yield obj["Key"], head.get("Metadata") or {}, head.get("ContentLength")
+
+    try:
+        return GribCatalogue.from_metadata(_with_data_metadata(bucket, head_objects(), client))
     except ClientError as exc:
         _logger.error("Error listing objects in bucket: %s", exc)
         raise exc
 
-    return items
 
+def _with_data_metadata(
+    bucket: Bucket,
+    objects: Iterable[tuple[str, dict[str, str], int | None]],
+    client: "BaseClient | None" = None,
+) -> Iterator[tuple[str, dict[str, str]]]:
+    """
+    The (key, user metadata) of the (key, user metadata, size) of objects, with the 'data' entry of the metadata.
+    Objects uploaded by other producers lack it: it is then decoded from the headers of the first GRIB message
+    of the object, read with a ranged GET, and objects which are not GRIB files are skipped.
+    """
+    step_factor = 60. if flexpart_ifs_utils.CONFIG.main.input.step_unit.lower() == "minutes" else 1.
+    for key, user_metadata, size in objects:
+        if "data" in user_metadata:
+            yield key, user_metadata
+            continue
+
+        client = client or _create_s3_client(bucket)
+        try:
+            metadata = extract_metadata_from_grib_object(client, bucket.name, key, size)
+        except RuntimeError as exc:
+            _logger.warning("Skipping %s, it has no 'data' metadata and is not a GRIB file: %s", key, exc)
+            continue
+
+        _logger.debug("Metadata of %s read from its GRIB headers: %s", key, metadata)
+        data = {"date": metadata.date, "time": metadata.time, "step": metadata.step * step_factor}
+        yield key, {**user_metadata, "data": json.dumps(data)}
 
+
+@timed("download")
 def download_keys_from_bucket(
     keys: list[str],
     dst_dir: Path,
-    bucket: Bucket = CONFIG.main.aws.s3.nwp_model_data,
+    bucket: Bucket | None = None,
 ) -> None:
     """Download objects from an S3 bucket to dst_dir."""
+    bucket = _input_bucket(bucket)
     _logger.info("Downloading input data from S3 bucket.")
-    client = _create_s3_client(bucket)
-
     _logger.info("Objects to download: %s", keys)
 
+    if transfer := _async_transfer():
+        from flexpart_ifs_utils import s3_async
+        s3_async.download_keys(keys, dst_dir, bucket, transfer)
+    else:
+        client = _create_s3_client(bucket)
+
+        for key in keys:
+            path = dst_dir / Path(key).name
+            os.makedirs(path.parent, exist_ok=True)
+            _logger.info("Downloading %s to %s", key, path)
+            _download_verified(client, bucket, key, path)
+            count(nbytes=path.stat().st_size, objects=1)
+
+    # The content was verified while downloading, the framing check reads only the message headers.
     for key in keys:
-        path = dst_dir / Path(key).name
-        os.makedirs(path.parent, exist_ok=True)
-        _logger.info("Downloading %s to %s", key, path)
-        client.download_file(bucket.name, key, str(path))
+        check_grib_framing(dst_dir / Path(key).name)
 
 
-def _create_s3_client(bucket: Bucket) -> BaseClient:
+def _download_verified(client: "BaseClient", bucket: Bucket, key: str, path: Path) -> None:
+    """
+    Stream the object to a temporary file next to path while computing its checksum,
+    and move it to path once the checksum is verified.
+    """
+    response = client.get_object(Bucket=bucket.name, Key=key)
+    checksum = StreamingChecksum(key, response)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".part")
+    tmp_path = Path(tmp_name)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in response["Body"].iter_chunks(_CHUNK_SIZE):
+                f.write(chunk)
+                checksum.update(chunk)
+        checksum.verify()
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    os.replace(tmp_path, path)
+
+
+def keep_clients() -> None:
+    """Reuse the clients created from now on for the buckets of the same region, instead of one per call."""
+    global _clients  # pylint: disable=global-statement
+    if _clients is None:
+        _clients = {}
+
+
+def _create_s3_client(bucket: Bucket) -> "BaseClient":
+    if _clients is not None and (bucket.region, bucket.retries) in _clients:
+        return _clients[(bucket.region, bucket.retries)]
+
+    # boto3 takes a large part of the startup time of the CLI, import it only when a client is needed.
+    import boto3
+    from botocore.config import Config
 
     retries_config = {"max_attempts": bucket.retries, "mode": "standard"}
 
-    return boto3.Session().client(
+    client = boto3.Session().client(
         "s3",
         config=Config(
             region_name=bucket.region,
             retries=retries_config,
         ),
     )
+    # Count every request sent, including retries and the parts of multipart transfers.
+    client.meta.events.register("before-send.s3", _count_request)
+    if _clients is not None:
+        _clients[(bucket.region, bucket.retries)] = client
+    return client
+
+
+def _count_request(**_: Any) -> None:
+    count(requests=1)
+
+
+def _output_bucket(bucket: Bucket | None) -> Bucket:
+    return bucket or flexpart_ifs_utils.CONFIG.main.aws.s3.output
+
+
+def _input_bucket(bucket: Bucket | None) -> Bucket:
+    return bucket or flexpart_ifs_utils.CONFIG.main.aws.s3.nwp_model_data
+
+
+def _async_transfer() -> TransferConfig | None:
+    """The transfer settings if the asyncio engine is configured, None to use the blocking boto3 client."""
+    transfer = flexpart_ifs_utils.CONFIG.main.aws.transfer
+    return transfer if transfer.engine == "asyncio" else None
@@ -0,0 +1,88 @@
+"""
+The module runs Flexpart in a directory on a local scratch file system, such as NVMe or tmpfs, instead of
+the job directory, which is on a network volume in some deployments. Flexpart reads every input file
+listed in AVAILABLE during the run and writes its output at every output step, so the latency of the
+network volume adds to the run time.
+
+The run directory holds a pathnames file pointing Flexpart to the namelists of the job, to the input
+files, hard linked to the run directory, or copied if it is on another file system, and to an output
+directory in the run directory. Once the run ends, successfully or not, the output is moved to the job
+directory, where postprocess and upload read it, and the run directory is removed.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+from flexpart_ifs_utils.config.service_settings import ScratchConfig
+from flexpart_ifs_utils.prepare_flexpart import _write_pathnames
+from flexpart_ifs_utils.timing import count, phase
+
+_logger = logging.getLogger(__name__)
+
+# Header lines of the AVAILABLE files written by prepare_flexpart._generate_available
+_AVAILABLE_HEADER_LINES = 3
+
+
+@contextmanager
+def scratch_run_dir(job_dir: Path, config: ScratchConfig) -> Iterator[Path]:
+    """
+    Create a run directory for the job of job_dir under the scratch path and yield it, then move the output
+    of the run to the job directory and remove the run directory.
+    """
+    scratch_dir = Path(config.path)
+    scratch_dir.mkdir(parents=True, exist_ok=True)
+    # A new directory per run, as the same site may be run for several cycles at once
+    run_dir = Path(tempfile.mkdtemp(prefix=f"{job_dir.name}-", dir=scratch_dir))
+    _logger.info("Running the job of %s in %s", job_dir, run_dir)
+    try:
+        input_dir = job_dir / "input"
+        available_paths = [input_dir / "AVAILABLE"]
+        if (input_dir / "AVAILABLE_NESTED").exists():
+            available_paths.append(input_dir / "AVAILABLE_NESTED")
+
+        data_dir = job_dir / "data"
+        if config.stage_input:
+            with phase("stage_input"):
+                data_dir = stage_input(data_dir, run_dir / "data", available_paths)
+        output_dir = run_dir / "output"
+        output_dir.mkdir()
+        _write_pathnames(run_dir, input_dir, output_dir, data_dir, *available_paths)
+
+        yield run_dir
+    finally:
+        with phase("collect_output"):
+            _move_output(run_dir / "output", job_dir / "output")
+        shutil.rmtree(run_dir, ignore_errors=True)
+
+
+def stage_input(data_dir: Path, staged_dir: Path, available_paths: list[Path]) -> Path:
+    """Link or copy the input files of data_dir listed in the AVAILABLE files to staged_dir, and return it."""
+    staged_dir.mkdir(parents=True, exist_ok=True)
+    for name in sorted({name for path in available_paths for name in _available_files(path)}):
+        source, staged = (data_dir / name).resolve(), staged_dir / name
+        try:
+            os.link(source, staged)
+        except OSError:
+            shutil.copyfile(source, staged)
+            count(nbytes=staged.stat().st_size, objects=1)
+    _logger.info("Staged the input files of %s in %s", data_dir, staged_dir)
+    return staged_dir
+
+
+def _available_files(available_path: Path) -> list[str]:
+    lines = available_path.read_text(encoding="utf-8").splitlines()[_AVAILABLE_HEADER_LINES:]
+    return [line.split()[2] for line in lines if line.strip()]
+
+
+def _move_output(run_output_dir: Path, output_dir: Path) -> None:
+    if not run_output_dir.is_dir():
+        return
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for path in sorted(run_output_dir.iterdir()):
+        _logger.info("Moving %s to %s", path.name, output_dir)
+        shutil.move(path, output_dir / path.name)
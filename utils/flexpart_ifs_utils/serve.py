@@ -0,0 +1,293 @@
+"""
+The module runs Flexpart as a long-lived daemon consuming run requests from a queue. A run request
+holds the release sites, forecast datetime and model of a run, and the EMISSION_* and SIMULATION_*
+variables otherwise read from the environment of the container of the run.
+
+Starting a container per run imports the package, reads the settings, creates S3 clients and reads
+the manifest of the cycle for every run. The daemon executes the runs in worker processes kept across
+runs, which keep their S3 clients, and so their connection pools, and the manifests read. At most
+max_concurrent_runs requests are executed at once, each generating, running, postprocessing and
+uploading the job of each of its release sites with the stages of the CLI. The input files of a request
+are downloaded once, into a data directory shared by its release sites.
+
+If a worker process dies, e.g. killed out of memory, the requests executing in the workers fail, the
+requests claimed but not started are returned to the queue, and the workers are restarted.
+
+The queue is pluggable: a directory of JSON files, moved between subdirectories as their state
+changes, or a table of an SQLite database. Both can be shared by several daemons, a request is
+claimed by one of them only.
+"""
+
+import json
+import logging
+import os
+import signal
+import sqlite3
+import threading
+import time
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor,
+                                wait)
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Protocol
+
+from pydantic import BaseModel
+
+from flexpart_ifs_utils import load_config
+from flexpart_ifs_utils.config.service_settings import ServeConfig
+from flexpart_ifs_utils.model import Model
+from flexpart_ifs_utils.stages import generate, postprocess, run, upload
+from flexpart_ifs_utils.timing import clear_records, phase, write_timings
+
+_logger = logging.getLogger(__name__)
+
+
+class RunRequest(BaseModel):
+    id: str
+    sites: list[str]
+    # Forecast datetime, in format YYYYMMDDHH
+    forecast_datetime: str
+    model: Model
+    # The EMISSION_* and SIMULATION_* variables of the run
+    environment: dict[str, str | None]
+
+
+class RunQueue(Protocol):
+    def put(self, request: RunRequest) -> None:
+        """Add request to the queue."""
+
+    def claim(self) -> RunRequest | None:
+        """Take the oldest request of the queue, or None if it is empty."""
+
+    def complete(self, request: RunRequest, error: str | None = None) -> None:
+        """Record a claimed request as done, or as failed with error."""
+
+    def release(self, request: RunRequest) -> None:
+        """Return a claimed request to the queue, to be claimed again."""
+
+
+class DirectoryQueue:
+    """
+    Queue of the JSON files of the requests in path/incoming, named by the time they were put so that
+    they sort in order. A request is claimed by moving its file to path/claimed, and completed by moving
+    it to path/done or path/failed, or released by moving it back to path/incoming.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        for state in ("incoming", "claimed", "done", "failed"):
+            (path / state).mkdir(parents=True, exist_ok=True)
+        self._claimed: dict[str, Path] = {}
+
+    def put(self, request: RunRequest) -> None:
+        name = f"{time.time_ns():020}_{request.id}.json"
+        # Written aside and moved, so that a request is never claimed half written.
+        tmp_path = self.path / "incoming" / f".{name}.part"
+        tmp_path.write_text(request.model_dump_json(), encoding="utf-8")
+        os.replace(tmp_path, self.path / "incoming" / name)
+
+    def claim(self) -> RunRequest | None:
+        for path in sorted((self.path / "incoming").glob("[!.]*.json")):
+            claimed = self.path / "claimed" / path.name
+            try:
+                # The rename succeeds for one daemon only.
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            request = RunRequest.model_validate_json(claimed.read_text(encoding="utf-8"))
+            self._claimed[request.id] = claimed
+            return request
+        return None
+
+    def complete(self, request: RunRequest, error: str | None = None) -> None:
+        claimed = self._claimed.pop(request.id)
+        if error is None:
+            os.replace(claimed, self.path / "done" / claimed.name)
+            return
+        failed = self.path / "failed" / claimed.name
+        failed.write_text(json.dumps({**json.loads(request.model_dump_json()), "error": error}), encoding="utf-8")
+        claimed.unlink()
+
+    def release(self, request: RunRequest) -> None:
+        claimed = self._claimed.pop(request.id)
+        # The name is kept, so that the request keeps its place in the queue.
+        os.replace(claimed, self.path / "incoming" / claimed.name)
+
+
+class SqliteQueue:
+    """Queue of the requests in a table of the SQLite database at path, with their state."""
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Transactions are begun explicitly, so that a request is claimed under the write lock of the database.
+        self._connection = sqlite3.connect(path, timeout=30., isolation_level=None)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS run_requests ("
+            "id TEXT PRIMARY KEY, request TEXT NOT NULL, state TEXT NOT NULL, error TEXT, "
+            "enqueued REAL NOT NULL, updated REAL NOT NULL)"
+        )
+
+    def put(self, request: RunRequest) -> None:
+        now = time.time()
+        self._connection.execute(
+            "INSERT INTO run_requests (id, request, state, enqueued, updated) VALUES (?, ?, 'queued', ?, ?)",
+            (request.id, request.model_dump_json(), now, now),
+        )
+
+    def claim(self) -> RunRequest | None:
+        self._connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._connection.execute(
+                "SELECT id, request FROM run_requests WHERE state = 'queued' ORDER BY enqueued, rowid LIMIT 1"
+            ).fetchone()
+            if row is not None:
+                self._connection.execute(
+                    "UPDATE run_requests SET state = 'claimed', updated = ? WHERE id = ?", (time.time(), row[0])
+                )
+            self._connection.execute("COMMIT")
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+        return None if row is None else RunRequest.model_validate_json(row[1])
+
+    def complete(self, request: RunRequest, error: str | None = None) -> None:
+        self._connection.execute(
+            "UPDATE run_requests SET state = ?, error = ?, updated = ? WHERE id = ?",
+            ("done" if error is None else "failed", error, time.time(), request.id),
+        )
+
+    def release(self, request: RunRequest) -> None:
+        self._connection.execute(
+            "UPDATE run_requests SET state = 'queued', updated = ? WHERE id = ?", (time.time(), request.id)
+        )
+
+    def state(self, request_id: str) -> tuple[str, str | None] | None:
+        """The state of a request and its error, or None if it is not in the queue."""
+        return self._connection.execute(
+            "SELECT state, error FROM run_requests WHERE id = ?", (request_id,)
+        ).fetchone()
+
+
+_QUEUES: dict[str, type[DirectoryQueue] | type[SqliteQueue]] = {
+    "directory": DirectoryQueue,
+    "sqlite": SqliteQueue,
+}
+
+
+def open_queue(config: ServeConfig) -> RunQueue:
+    """The queue of the configured type at the configured path."""
+    if config.queue_type not in _QUEUES:
+        raise RuntimeError(f"Unknown queue type {config.queue_type}, expected one of {list(_QUEUES)}")
+    return _QUEUES[config.queue_type](Path(config.queue_path))
+
+
+def serve_requests(queue: RunQueue, config: ServeConfig, jobs_root: Path, flexpart_dir: Path,
+                   drain: bool = False) -> None:
+    """
+    Execute the requests of queue, at most max_concurrent_runs at once, in jobs_root/<request id>.
+    Polls the queue until SIGTERM or SIGINT is received, or if drain is set until it is empty,
+    and returns once the requests claimed are completed.
+    """
+    stopping = threading.Event()
+    handlers = {signum: signal.signal(signum, lambda *_: stopping.set()) for signum in (signal.SIGTERM, signal.SIGINT)}
+
+    pending: dict[Future[int], RunRequest] = {}
+    executor = _start_workers(config)
+    try:
+        while True:
+            while not stopping.is_set() and len(pending) < config.max_concurrent_runs:
+                if (request := queue.claim()) is None:
+                    break
+                try:
+                    future = executor.submit(execute_request, request, jobs_root, flexpart_dir)
+                except BrokenProcessPool:
+                    # The futures of the requests executing in the dead workers fail with the error of the pool.
+                    _logger.error("A worker process died, returning run request %s to the queue and restarting "
+                                  "the workers", request.id)
+                    queue.release(request)
+                    executor.shutdown()
+                    executor = _start_workers(config)
+                    continue
+                _logger.info("Claimed run request %s of sites %s", request.id, request.sites)
+                pending[future] = request
+
+            if not pending:
+                if drain or stopping.is_set():
+                    break
+                stopping.wait(config.poll_interval)
+                continue
+
+            done, _ = wait(pending, timeout=config.poll_interval, return_when=FIRST_COMPLETED)
+            for future in done:
+                _complete(queue, pending.pop(future), future)
+    finally:
+        executor.shutdown()
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+    _logger.info("Stopped serving run requests")
+
+
+def execute_request(request: RunRequest, jobs_root: Path, flexpart_dir: Path) -> int:
+    """
+    Generate, run, postprocess and upload the job of each release site of request, each in its own jobs
+    directory as with the commands of the CLI. The jobs directories share the data directory of the request,
+    so the input files are downloaded for the first site only. Returns the exit code of the first failed run,
+    0 if none failed.
+    """
+    request_dir = jobs_root / request.id
+    data_dir = request_dir / "data"
+    data_dir.mkdir(parents=True, exist_ok=True)
+
+    returncode = 0
+    for site in request.sites:
+        jobs_dir = request_dir / site
+        jobs_dir.mkdir(exist_ok=True)
+        if not (jobs_dir / "data").exists():
+            os.symlink(data_dir, jobs_dir / "data")
+        # The records of the phases of earlier runs of the worker were written to their job directories.
+        clear_records()
+        with phase("generate_command"):
+            job_dir = generate(request.forecast_datetime, site, jobs_dir, flexpart_dir, request.model,
+                               environment=request.environment)
+        write_timings(job_dir)
+        clear_records()
+
+        if site_returncode := run(job_dir):
+            _logger.error("Run of request %s for site %s failed with exit code %d", request.id, site, site_returncode)
+            returncode = returncode or site_returncode
+            continue
+        clear_records()
+
+        postprocess(jobs_dir)
+        clear_records()
+        upload(jobs_dir, site, request.forecast_datetime)
+
+    clear_records()
+    return returncode
+
+
+def _start_workers(config: ServeConfig) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(max_workers=config.max_concurrent_runs, initializer=_init_worker)
+
+
+def _init_worker() -> None:
+    # Imported and configured once per worker, the clients and manifests are kept across the runs of the worker.
+    load_config()
+
+    from flexpart_ifs_utils import manifest, s3_utils
+
+    s3_utils.keep_clients()
+    manifest.keep_manifests()
+
+
+def _complete(queue: RunQueue, request: RunRequest, future: "Future[Any]") -> None:
+    error: str | None = None
+    if (exc := future.exception()) is not None:
+        _logger.error("Run request %s failed: %s", request.id, exc, exc_info=exc)
+        error = f"{type(exc).__name__}: {exc}"
+    elif returncode := future.result():
+        error = f"Flexpart exited with code {returncode}"
+    else:
+        _logger.info("Run request %s completed", request.id)
+    queue.complete(request, error)
@@ -0,0 +1,326 @@
+"""
+The module holds the stages of a run of Flexpart: generating the job directory of a release site, running
+its job, post-processing and uploading its output. They are executed by the commands of the CLI, one stage
+per command, and by the daemon serving run requests, all stages of each release site of a request.
+"""
+
+import logging
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from flexpart_ifs_utils.model import EnvironmentParameters, Model
+from flexpart_ifs_utils.timing import phase, write_timings
+
+if TYPE_CHECKING:
+    from flexpart_ifs_utils.config.service_settings import OpenMPConfig
+    from flexpart_ifs_utils.prepare_flexpart import OutputGrid
+
+_logger = logging.getLogger(__name__)
+
+
+def validate_env(data: dict[str, str | None]) -> None:
+    violations: list[str] = []
+    for parameter in EnvironmentParameters:
+        if parameter.name not in data:
+            violations.append(parameter.name)
+        elif data[parameter.name] is None:
+            violations.append(parameter.name)
+
+    if violations:
+        raise RuntimeError(
+            "Environment is missing variables needed to prepare runtime configuration: "
+            f"{violations}"
+        )
+
+
+def parse_env() -> dict[str, str | None]:
+    return {"EMISSION_START_YYYY": os.getenv("EMISSION_START_YYYY"),
+            "EMISSION_START_MM": os.getenv("EMISSION_START_MM"),
+            "EMISSION_START_DD": os.getenv("EMISSION_START_DD"),
+            "EMISSION_START_ZZ": os.getenv("EMISSION_START_ZZ"),
+            "EMISSION_END_YYYY": os.getenv("EMISSION_END_YYYY"),
+            "EMISSION_END_MM": os.getenv("EMISSION_END_MM"),
+            "EMISSION_END_DD": os.getenv("EMISSION_END_DD"),
+            "EMISSION_END_ZZ": os.getenv("EMISSION_END_ZZ"),
+            "SIMULATION_END_YYYY": os.getenv("SIMULATION_END_YYYY"),
+            "SIMULATION_END_MM": os.getenv("SIMULATION_END_MM"),
+            "SIMULATION_END_DD": os.getenv("SIMULATION_END_DD"),
+            "SIMULATION_END_ZZ": os.getenv("SIMULATION_END_ZZ")}
+
+
+def upload(directory: Path, site: str, forecast_datetime: str) -> None:
+    from flexpart_ifs_utils import CONFIG
+    from flexpart_ifs_utils.s3_utils import upload_output, upload_store
+
+    with phase('upload_command'):
+        uploaded = upload_output(directory, site, forecast_datetime, parent='output')
+        if CONFIG.main.output.zarr is not None:
+            from flexpart_ifs_utils.cloud_output import convert_output_to_zarr
+
+            stores = convert_output_to_zarr(directory, CONFIG.main.output.zarr, CONFIG.main.output.max_workers)
+            for store in stores:
+                uploaded += upload_store(store, site, forecast_datetime)
+        if CONFIG.main.output.particles is not None:
+            from flexpart_ifs_utils.particle_output import convert_particle_dumps
+
+            stores = convert_particle_dumps(directory, CONFIG.main.output.particles, CONFIG.main.output.max_workers)
+            for store in stores:
+                uploaded += upload_store(store, site, forecast_datetime)
+
+        if CONFIG.main.output.memoize:
+            from flexpart_ifs_utils.memo import publish_run
+
+            publish_run(directory / site, site, forecast_datetime, uploaded)
+
+    for job_dir in _job_dirs(directory):
+        write_timings(job_dir)
+
+
+def run(job_dir: Path) -> int:
+    from flexpart_ifs_utils import CONFIG
+    from flexpart_ifs_utils.memo import MEMO_FILE
+    from flexpart_ifs_utils.progress import run_job
+
+    if (job_dir / MEMO_FILE).exists():
+        _logger.info('The output of an identical run is reused, skipping Flexpart in %s.', job_dir)
+        return 0
+
+    with phase('run_flexpart'):
+        if CONFIG.main.scratch is None:
+            progress = run_job(job_dir)
+        else:
+            from flexpart_ifs_utils.scratch import scratch_run_dir
+
+            with scratch_run_dir(job_dir, CONFIG.main.scratch) as run_dir:
+                progress = run_job(job_dir, run_dir)
+
+    if CONFIG.main.planner is not None:
+        from flexpart_ifs_utils.planner import record_run
+
+        record_run(job_dir, progress, CONFIG.main.planner)
+
+    write_timings(job_dir)
+
+    if progress.returncode == 0 and not progress.completed:
+        _logger.error('Flexpart in %s exited without completing the run.', job_dir)
+        return 1
+    return progress.returncode or 0
+
+
+def postprocess(jobs_dir: Path) -> None:
+    from flexpart_ifs_utils import CONFIG
+    from flexpart_ifs_utils.derived_products import derive_products
+    from flexpart_ifs_utils.postprocess import postprocess_output
+
+    with phase('postprocess_command'):
+        if CONFIG.main.output.derived_products is not None:
+            derive_products(jobs_dir, CONFIG.main.output.derived_products, CONFIG.main.output.max_workers)
+        if CONFIG.main.output.receptors is not None:
+            from flexpart_ifs_utils.receptors import extract_receptors
+
+            extract_receptors(jobs_dir, CONFIG.main.output.receptors, CONFIG.main.output.max_workers)
+        if CONFIG.main.output.compression is None:
+            _logger.info('No output compression configured, skipping compression.')
+        else:
+            postprocess_output(jobs_dir, CONFIG.main.output.compression, CONFIG.main.output.max_workers)
+
+    for job_dir in _job_dirs(jobs_dir):
+        write_timings(job_dir)
+
+
+def generate(
+    forecast_datetime: str,
+    release_site: str,
+    jobs_dir: Path,
+    flexpart_dir: Path,
+    model: Model,
+    *,
+    environment: dict[str, str | None] | None = None,
+) -> Path:
+    """
+    Prepare the job directory of release_site in jobs_dir. The emission and simulation windows are read
+    from environment, by default from the EMISSION_* and SIMULATION_* environment variables.
+    """
+    from flexpart_ifs_utils.prepare_flexpart import prepare_job_directory
+
+    if not os.path.exists( jobs_dir ):
+        os.makedirs( jobs_dir )
+
+    _logger.info('FLEXPART directory: %s', flexpart_dir)
+    _logger.info('Jobs directory: %s', jobs_dir)
+
+    config = _site_config(release_site, jobs_dir, environment)
+    # Planned before the run key is computed, as the number of particles is written to the RELEASES namelist
+    openmp_config = _plan(config, model)
+
+    keys = _input_keys(config, forecast_datetime, jobs_dir / 'data', model)
+    run_key, skipped_dir = _find_identical_run(keys, config, jobs_dir / release_site, flexpart_dir, model)
+    if skipped_dir is not None:
+        return skipped_dir
+
+    _stage_input(keys, jobs_dir / 'data', model)
+    data_dir, outgrid = _subset(config, jobs_dir, flexpart_dir, model)
+
+    job_dir = prepare_job_directory(
+        config,
+        jobs_dir,
+        flexpart_dir,
+        data_dir,
+        openmp_config,
+        model=model,
+        outgrid=outgrid)
+
+    _record_run_key(job_dir, run_key)
+    return job_dir
+
+
+def _site_config(release_site: str, jobs_dir: Path, environment: dict[str, str | None] | None) -> dict:
+    """The runtime configuration of release_site, rendered into jobs_dir."""
+    import yaml
+
+    from flexpart_ifs_utils.prepare_flexpart import render_template
+
+    workdir: Path = Path(os.path.abspath(__file__)).parent
+    config_template_path = workdir / 'runtime_configuration.j2'
+    config_path = jobs_dir / (config_template_path.stem + '.yaml')
+
+    if environment is None:
+        environment = parse_env()
+
+    validate_env(environment)
+
+    render_template(config_template_path, config_path, [release_site], environment)
+
+    with open(config_path, 'r', encoding="utf-8") as f:
+        configs = yaml.safe_load(f)
+
+    configs = [config for config in configs if config['name'] == release_site]
+    if not configs:
+        raise RuntimeError(f'Release site {release_site} does not match any known to Flexpart.')
+    if len(configs) > 1:
+        raise RuntimeError(f'Release site {release_site} matches multiple configs.')
+    return configs[0]
+
+
+def _plan(config: dict, model: Model) -> "OpenMPConfig":
+    """The OpenMP settings of the run, with the threads of the planner, which sets the particles of config."""
+    from flexpart_ifs_utils import CONFIG
+
+    openmp_config = CONFIG.main.openmp_config
+    if CONFIG.main.planner is None:
+        return openmp_config
+
+    from flexpart_ifs_utils.planner import plan_run
+    from flexpart_ifs_utils.prepare_flexpart import _get_start_end
+
+    start, end = _get_start_end(config['command'])
+    ranks = openmp_config.mpi.ranks if openmp_config.mpi is not None else 1
+    plan = plan_run(model, abs((end - start).total_seconds()) / 3600, CONFIG.main.planner, ranks)
+    if plan is None:
+        return openmp_config
+    # Written to the RELEASES namelists with the other values of the runtime configuration
+    config['releases']['PARTS'] = plan.particles
+    return openmp_config.model_copy(update={'num_threads': plan.threads})
+
+
+def _input_keys(config: dict, forecast_datetime: str, data_dir: Path, model: Model) -> list[str]:
+    """
+    The keys of the input files of the run, none if data_dir holds them already, e.g. downloaded for another
+    release site of a run request, unless they are needed for the run key.
+    """
+    from flexpart_ifs_utils import CONFIG
+    from flexpart_ifs_utils.prepare_flexpart import _path_list, select_files
+
+    if not os.path.exists( data_dir ):
+        os.makedirs( data_dir )
+
+    if _path_list(data_dir, model) and not CONFIG.main.output.memoize:
+        return []
+    return select_files(config['command'],
+                        forecast_datetime=forecast_datetime,
+                        step_unit=CONFIG.main.input.step_unit,
+                        model=model)
+
+
+def _find_identical_run(keys: list[str], config: dict, job_dir: Path, flexpart_dir: Path,
+                        model: Model) -> tuple[str | None, Path | None]:
+    """
+    The run key of the job if memoization is configured, and job_dir holding the record of an identical run
+    already uploaded, if there is one.
+    """
+    from flexpart_ifs_utils import CONFIG
+
+    if not CONFIG.main.output.memoize:
+        return None, None
+
+    from flexpart_ifs_utils.memo import compute_run_key, find_run, skip_job
+
+    run_key = compute_run_key(keys, config, flexpart_dir, model)
+    if (record := find_run(run_key)) is not None:
+        return run_key, skip_job(job_dir, run_key, record)
+    return run_key, None
+
+
+def _record_run_key(job_dir: Path, run_key: str | None) -> None:
+    """Write the run key into job_dir, under which upload publishes the output of the run."""
+    if run_key is not None:
+        from flexpart_ifs_utils.memo import write_run_key
+
+        write_run_key(job_dir, run_key)
+
+
+def _stage_input(keys: list[str], data_dir: Path, model: Model) -> None:
+    """
+    Link the files of keys from the prefetch cache into data_dir, download the others and repack them, unless
+    data_dir holds the input files already.
+    """
+    from flexpart_ifs_utils import CONFIG
+    from flexpart_ifs_utils.prepare_flexpart import _path_list
+    from flexpart_ifs_utils.s3_utils import download_keys_from_bucket
+
+    if _path_list(data_dir, model):
+        return
+
+    missing = keys
+    if CONFIG.main.input.prefetch is not None:
+        from flexpart_ifs_utils.prefetch import link_cached
+
+        missing = link_cached(keys, data_dir, Path(CONFIG.main.input.prefetch.cache_dir))
+
+    if missing:
+        download_keys_from_bucket(missing, data_dir, CONFIG.main.aws.s3.nwp_model_data)
+
+    if CONFIG.main.input.repack is not None:
+        from flexpart_ifs_utils.repack import repack_input
+
+        repack_input([data_dir / Path(key).name for key in keys], CONFIG.main.input.repack)
+
+
+def _subset(config: dict, jobs_dir: Path, flexpart_dir: Path, model: Model) -> tuple[Path, "OutputGrid | None"]:
+    """
+    The input directory of the job and its output grid: for IFS-Global runs with subset configured, the input
+    cropped to the region of the release site of config, else the data directory shared by all release sites.
+    """
+    from flexpart_ifs_utils import CONFIG
+
+    data_dir = jobs_dir / 'data'
+    if model != Model.IFS_HRES or CONFIG.main.input.subset is None:
+        return data_dir, None
+
+    from flexpart_ifs_utils.prepare_flexpart import read_outgrid
+    from flexpart_ifs_utils.subset import subset_release
+
+    # The cropped fields depend on the release site, the downloaded data is shared by all sites.
+    subset_dir = jobs_dir / 'subset' / config['name']
+    outgrid = subset_release(config,
+                             data_dir,
+                             subset_dir,
+                             read_outgrid(flexpart_dir / 'share' / 'options.meteoswiss' / 'OUTGRID.g'),
+                             CONFIG.main.input.subset)
+    return subset_dir, outgrid
+
+
+def _job_dirs(jobs_dir: Path) -> list[Path]:
+    """The job directories of the release sites in jobs_dir are the ones containing a job script."""
+    return sorted(path.parent for path in jobs_dir.glob('*/job'))
@@ -0,0 +1,219 @@
+"""
+The module crops the global input fields of IFS-Global runs to the region of the release site.
+Flexpart reads every field of the mother domain at each step, although within the simulation
+window the plume from a release site stays within a sector of the globe: cropping the fields
+reduces the time Flexpart spends reading them and the memory it holds them in.
+
+The output grid is reduced to the region around the release site given by the configured extents,
+and the input fields are cropped to the output grid and the nested domain, plus a margin. The
+cropped fields are rewritten as GRIB messages of the same edition and packing, one file per step
+in a process pool. The files of the nested domain are linked next to them unchanged.
+
+Particles leaving the cropped domain are no longer followed by Flexpart, so the extents must cover
+the region the plume can reach within the simulation window.
+"""
+
+import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from eccodes import (codes_get_double, codes_get_long, codes_get_string,
+                     codes_get_values, codes_grib_new_from_file, codes_release,
+                     codes_set_double, codes_set_long, codes_set_values,
+                     codes_write)
+from pydantic import BaseModel
+
+from flexpart_ifs_utils.config.service_settings import SubsetConfig
+from flexpart_ifs_utils.model import Model
+from flexpart_ifs_utils.prepare_flexpart import OutputGrid, _path_list
+from flexpart_ifs_utils.timing import count, timed
+
+_logger = logging.getLogger(__name__)
+
+# Tolerance in grid lengths when snapping coordinates to a grid
+_EPS = 1e-6
+
+
+class Domain(BaseModel):
+    """A latitude-longitude box in degrees, with west < east possibly outside of [-180, 180]."""
+    west: float
+    south: float
+    east: float
+    north: float
+
+
+@timed("subset_input")
+def subset_release(
+    configuration: dict,
+    data_dir: Path,
+    subset_dir: Path,
+    outgrid: OutputGrid,
+    config: SubsetConfig,
+) -> OutputGrid:
+    """
+    Crop the global fields in data_dir to the region of the release site of configuration, writing them
+    to subset_dir with links to the fields of the nested domain. Return the output grid of the region.
+    """
+    nested = _path_list(data_dir, Model.IFS_HRES_EUROPE)
+    nest = grid_domain(nested[0]) if nested else None
+
+    releases = configuration["releases"]
+    grid, domain = subset_domains(outgrid, releases["LON1"], releases["LAT1"], nest, config)
+    _logger.info("Cropping the input fields to %s for the output grid %s", domain, grid)
+
+    paths = _path_list(data_dir, Model.IFS_HRES)
+    os.makedirs(subset_dir, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=config.max_workers) as executor:
+        futures = [executor.submit(crop_grib_file, path, subset_dir / path.name, domain) for path in paths]
+        for future in futures:
+            future.result()
+
+    for path in nested:
+        link = subset_dir / path.name
+        if not link.exists():
+            os.symlink(path.resolve(), link)
+
+    size_before = sum(path.stat().st_size for path in paths)
+    size_after = sum((subset_dir / path.name).stat().st_size for path in paths)
+    count(nbytes=size_before, objects=len(paths))
+    _logger.info("Cropped %d files from %d to %d bytes", len(paths), size_before, size_after)
+
+    return grid
+
+
+def subset_domains(
+    outgrid: OutputGrid,
+    release_lon: float,
+    release_lat: float,
+    nest: Domain | None,
+    config: SubsetConfig,
+) -> tuple[OutputGrid, Domain]:
+    """
+    The output grid reduced to the extents around the release location, snapped to the cells of outgrid,
+    and the domain the input fields are cropped to: the output grid and the nest, plus the margin.
+    """
+    west = max(outgrid.outlon0, release_lon - config.lon_extent)
+    east = min(outgrid.outlon0 + outgrid.numxgrid * outgrid.dxout, release_lon + config.lon_extent)
+    south = max(outgrid.outlat0, release_lat - config.lat_extent)
+    north = min(outgrid.outlat0 + outgrid.numygrid * outgrid.dyout, release_lat + config.lat_extent)
+
+    i0 = math.floor((west - outgrid.outlon0) / outgrid.dxout + _EPS)
+    i1 = math.ceil((east - outgrid.outlon0) / outgrid.dxout - _EPS)
+    j0 = math.floor((south - outgrid.outlat0) / outgrid.dyout + _EPS)
+    j1 = math.ceil((north - outgrid.outlat0) / outgrid.dyout - _EPS)
+    grid = OutputGrid(
+        outlon0=round(outgrid.outlon0 + i0 * outgrid.dxout, 6),
+        outlat0=round(outgrid.outlat0 + j0 * outgrid.dyout, 6),
+        numxgrid=i1 - i0,
+        numygrid=j1 - j0,
+        dxout=outgrid.dxout,
+        dyout=outgrid.dyout,
+    )
+
+    domain = Domain(
+        west=grid.outlon0,
+        south=grid.outlat0,
+        east=grid.outlon0 + grid.numxgrid * grid.dxout,
+        north=grid.outlat0 + grid.numygrid * grid.dyout,
+    )
+    if nest is not None:
+        domain = Domain(
+            west=min(domain.west, nest.west),
+            south=min(domain.south, nest.south),
+            east=max(domain.east, nest.east),
+            north=max(domain.north, nest.north),
+        )
+
+    return grid, Domain(
+        west=domain.west - config.margin,
+        south=max(domain.south - config.margin, -90.),
+        east=domain.east + config.margin,
+        north=min(domain.north + config.margin, 90.),
+    )
+
+
+def grid_domain(path: Path) -> Domain:
+    """The domain of the regular latitude-longitude grid of the first message of a GRIB file."""
+    with open(path, "rb") as f:
+        gid = codes_grib_new_from_file(f)
+    if gid is None:
+        raise RuntimeError(f"No GRIB message in {path}")
+    try:
+        lat_first = codes_get_double(gid, "latitudeOfFirstGridPointInDegrees")
+        lat_last = codes_get_double(gid, "latitudeOfLastGridPointInDegrees")
+        west = _normalize_longitude(codes_get_double(gid, "longitudeOfFirstGridPointInDegrees"))
+        east = west + (codes_get_long(gid, "Ni") - 1) * codes_get_double(gid, "iDirectionIncrementInDegrees")
+    finally:
+        codes_release(gid)
+    return Domain(west=west, south=min(lat_first, lat_last), east=east, north=max(lat_first, lat_last))
+
+
+def crop_grib_file(src: Path, dst: Path, domain: Domain) -> int:
+    """Write the messages of src cropped to the grid points covering domain to dst, and return their number."""
+    tmp_path = dst.with_name(f".{dst.name}.part")
+    n_messages = 0
+    try:
+        with open(src, "rb") as fin, open(tmp_path, "wb") as fout:
+            while (gid := codes_grib_new_from_file(fin)) is not None:
+                try:
+                    _crop_message(gid, domain, src)
+                    codes_write(gid, fout)
+                finally:
+                    codes_release(gid)
+                n_messages += 1
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+
+    os.replace(tmp_path, dst)
+    return n_messages
+
+
+def _crop_message(gid: int, domain: Domain, path: Path) -> None:
+    grid_type = codes_get_string(gid, "gridType")
+    if grid_type != "regular_ll" or codes_get_long(gid, "iScansNegatively"):
+        raise RuntimeError(f"Cannot crop the {grid_type} fields of {path}, only regular_ll scanning eastwards.")
+
+    ni, nj = codes_get_long(gid, "Ni"), codes_get_long(gid, "Nj")
+    dx = codes_get_double(gid, "iDirectionIncrementInDegrees")
+    dy = codes_get_double(gid, "jDirectionIncrementInDegrees")
+    lon_first = codes_get_double(gid, "longitudeOfFirstGridPointInDegrees")
+    lat_first = codes_get_double(gid, "latitudeOfFirstGridPointInDegrees")
+    lat_step = dy if codes_get_long(gid, "jScansPositively") else -dy
+
+    # Rows covering [south, north], in the scanning direction of the grid
+    rows = sorted(((domain.north - lat_first) / lat_step, (domain.south - lat_first) / lat_step))
+    j0 = max(math.floor(rows[0] + _EPS), 0)
+    j1 = min(math.ceil(rows[1] - _EPS), nj - 1)
+
+    # Columns covering [west, east], wrapping around the globe for global grids
+    west_offset = _normalize_longitude(domain.west - lon_first) / dx
+    i0 = math.floor(west_offset + _EPS)
+    i1 = math.ceil(west_offset + (domain.east - domain.west) / dx - _EPS)
+    if abs(ni * dx - 360.) < _EPS * 360.:
+        if i1 - i0 + 1 >= ni:
+            i0, i1 = 0, ni - 1
+        columns = [i % ni for i in range(i0, i1 + 1)]
+    else:
+        i0, i1 = max(i0, 0), min(i1, ni - 1)
+        columns = list(range(i0, i1 + 1))
+
+    if j1 < j0 or not columns:
+        raise RuntimeError(f"The fields of {path} do not overlap {domain}.")
+
+    values = codes_get_values(gid).reshape(nj, ni)[j0:j1 + 1][:, columns]
+
+    codes_set_long(gid, "Ni", len(columns))
+    codes_set_long(gid, "Nj", j1 - j0 + 1)
+    codes_set_double(gid, "latitudeOfFirstGridPointInDegrees", lat_first + j0 * lat_step)
+    codes_set_double(gid, "latitudeOfLastGridPointInDegrees", lat_first + j1 * lat_step)
+    codes_set_double(gid, "longitudeOfFirstGridPointInDegrees", (lon_first + i0 * dx) % 360.)
+    codes_set_double(gid, "longitudeOfLastGridPointInDegrees", (lon_first + i1 * dx) % 360.)
+    codes_set_values(gid, values.ravel())
+
+
+def _normalize_longitude(lon: float) -> float:
+    """The longitude in [-180, 180)."""
+    return (lon + 180.) % 360. - 180.
@@ -0,0 +1,109 @@
+"""
+The module records the wall time and resources used by each phase of a job (listing, downloading,
+preparing the job directory, running Flexpart, uploading, ...).
+
+A phase is entered with the `phase` context manager or the `timed` decorator. Work done inside
+a phase is attributed to it with `count`, e.g. the bytes and objects transferred, and every S3
+request sent by a client from `s3_utils` is counted automatically. When a phase ends, its record
+is logged and kept, so that the records of a command can be written to the timings.json file of
+the job directories with `write_timings`.
+
+The peak resident set sizes of a record are those of the process and of its waited-for children since
+they started, as reported by getrusage when the phase ends, not the peaks within the phase: a phase
+that uses less memory than an earlier one reports the peak of the earlier phase.
+"""
+
+import functools
+import json
+import logging
+import resource
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator, TypeVar
+
+from pydantic import BaseModel
+
+_logger = logging.getLogger(__name__)
+
+TIMINGS_FILE = "timings.json"
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+
+class PhaseTiming(BaseModel):
+    name: str
+    wall_time: float = 0.
+    bytes: int = 0
+    objects: int = 0
+    requests: int = 0
+    process_peak_rss_kb: int = 0
+    children_peak_rss_kb: int = 0
+
+
+_active: list[PhaseTiming] = []
+_records: list[PhaseTiming] = []
+
+
+@contextmanager
+def phase(name: str) -> Iterator[PhaseTiming]:
+    """Time the enclosed block as the phase `name`."""
+    timing = PhaseTiming(name=name)
+    _active.append(timing)
+    start = time.perf_counter()
+    try:
+        yield timing
+    finally:
+        timing.wall_time = time.perf_counter() - start
+        timing.process_peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        timing.children_peak_rss_kb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        _active.remove(timing)
+        _records.append(timing)
+        _logger.info(
+            "Phase %s took %.3f s (%d bytes, %d objects, %d requests)",
+            timing.name,
+            timing.wall_time,
+            timing.bytes,
+            timing.objects,
+            timing.requests,
+            extra={"timing": timing.model_dump()},
+        )
+
+
+def timed(name: str) -> Callable[[_F], _F]:
+    """Decorator timing every call of the decorated function as the phase `name`."""
+
+    def decorator(func: _F) -> _F:
+        @functools.wraps(func)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with phase(name):
+                return func(*args, **kwargs)
+
+        return wrapper  # type: ignore[return-value]
+
+    return decorator
+
+
+def count(nbytes: int = 0, objects: int = 0, requests: int = 0) -> None:
+    """Attribute transferred bytes, objects and requests to all active phases."""
+    for timing in _active:
+        timing.bytes += nbytes
+        timing.objects += objects
+        timing.requests += requests
+
+
+def records() -> list[PhaseTiming]:
+    return list(_records)
+
+
+def clear_records() -> None:
+    """Forget the records of the finished phases, once written, before the next run of a long-lived process."""
+    _records.clear()
+
+
+def write_timings(job_dir: Path) -> None:
+    """Append the records of the finished phases to the timings file of the job directory."""
+    path = job_dir / TIMINGS_FILE
+    timings = json.loads(path.read_text(encoding="utf-8")) if path.exists() else []
+    timings.extend(timing.model_dump() for timing in _records)
+    path.write_text(json.dumps(timings, indent=2), encoding="utf-8")
@@ -6,6 +6,8 @@ from typing import Generator
 from unittest.mock import MagicMock, patch
 
 import boto3
+import netCDF4
+import numpy as np
 import pytest
 from botocore.config import Config
 from dotenv import load_dotenv
@@ -65,9 +67,50 @@ def references() -> Path:
 @pytest.fixture(scope="function")
 def mock_config() -> Generator:
     with patch("flexpart_ifs_utils.CONFIG") as mock_config:
-        mock_config.main.openmp_config = MagicMock(num_threads=5, stack_size="1000M")
+        mock_config.main.openmp_config = MagicMock(num_threads=5, stack_size="1000M", mpi=None)
         yield mock_config
 
+@pytest.fixture(scope="function")
+def grid_conc_factory() -> Generator:
+    """Factory writing a small NetCDF file with the layout of the Flexpart grid_conc output."""
+
+    def _make(path: Path, n_times: int = 5, n_lat: int = 30, n_lon: int = 40, seed: int = 0) -> Path:
+        rng = np.random.default_rng(seed)
+        heights = [500., 2000., 10000.]
+        with netCDF4.Dataset(path, "w", format="NETCDF4") as ds:
+            ds.title = "FLEXPART MODEL OUTPUT"
+            for dim, size in (("time", None), ("longitude", n_lon), ("latitude", n_lat),
+                              ("height", len(heights)), ("numspec", 1), ("pointspec", 1),
+                              ("nageclass", 1), ("nchar", 45), ("numpoint", 1)):
+                ds.createDimension(dim, size)
+
+            time = ds.createVariable("time", "i4", ("time",))
+            time.units = "seconds since 2024-12-10 00:00"
+            time[:] = np.arange(1, n_times + 1) * 10800
+            ds.createVariable("longitude", "f4", ("longitude",))[:] = -10. + 0.1 * np.arange(n_lon)
+            ds.createVariable("latitude", "f4", ("latitude",))[:] = 35. + 0.1 * np.arange(n_lat)
+            ds.createVariable("height", "f4", ("height",))[:] = heights
+            ds.createVariable("RELCOM", "S1", ("numpoint", "nchar"))[0, :6] = list(b"Beznau")
+            ds.createVariable("ORO", "i4", ("latitude", "longitude"))[:] = rng.integers(0, 3000, (n_lat, n_lon))
+
+            conc = ds.createVariable("spec001_mr", "f4",
+                                     ("nageclass", "pointspec", "time", "height", "latitude", "longitude"),
+                                     zlib=True, complevel=9, chunksizes=(1, 1, 1, len(heights), n_lat, n_lon))
+            conc.units = "ng m-3"
+            values = rng.random((1, 1, n_times, len(heights), n_lat, n_lon), dtype=np.float32) * 1e3
+            values[values < 600] = 0.
+            conc[:] = values
+
+            for name in ("WD_spec001", "DD_spec001"):
+                dep = ds.createVariable(name, "f4", ("nageclass", "pointspec", "time", "latitude", "longitude"))
+                dep.units = "1e-12 kg m-2"
+                values = rng.random((1, 1, n_times, n_lat, n_lon), dtype=np.float32)
+                values[values < 0.7] = 0.
+                dep[:] = values
+        return path
+
+    yield _make
+
 WORKDIR: Path = Path(os.path.realpath(__file__)).parent
 
 def pytest_configure(config):
@@ -0,0 +1,304 @@
+"""
+Benchmarks of the input staging and output upload against a local moto S3 server, and of the CLI startup.
+The packing benchmarks measure the download and decoding of the same fields in each GRIB packing type,
+to choose the packing of the input, see input.repack in settings.yaml.
+
+The benchmarks are deselected by default, run them with:
+
+    poetry run pytest test/test_benchmark.py -m benchmark --benchmark-autosave --benchmark-compare
+
+The results are saved in .benchmarks/ and compared against the previous run.
+The larger buckets are marked as slow, deselect them with -m "benchmark and not slow".
+"""
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest import mock
+
+import boto3
+import numpy as np
+import pytest
+import requests
+import yaml
+from eccodes import (codes_get_message, codes_get_values,
+                     codes_grib_new_from_file, codes_grib_new_from_samples,
+                     codes_release, codes_set, codes_set_string,
+                     codes_set_values)
+from moto.server import ThreadedMotoServer
+
+from flexpart_ifs_utils import CONFIG
+from flexpart_ifs_utils.catalogue import GribCatalogue
+from flexpart_ifs_utils.model import Model
+from flexpart_ifs_utils.prepare_flexpart import (_generate_available,
+                                                 prepare_job_directory,
+                                                 select_files)
+from flexpart_ifs_utils.s3_utils import (download_keys_from_bucket,
+                                         list_objs_in_bucket, upload_output)
+
+pytestmark = pytest.mark.benchmark(group="staging", min_rounds=1)
+
+_S3_SERVER_HOST = "127.0.0.1"
+_S3_SERVER_PORT = 5556
+_ENDPOINT = f"http://{_S3_SERVER_HOST}:{_S3_SERVER_PORT}"
+
+# Hourly steps of the Europe domain, 3-hourly steps of the global domain, for every 6-hourly cycle
+_STEPS = {"EUROPE": range(0, 91), "GLOBAL": range(0, 91, 3)}
+_PREFIX = {"EUROPE": "dispf", "GLOBAL": "dispc"}
+_LAST_CYCLE = datetime(2024, 12, 10, 0)
+_MESSAGES_PER_FILE = 20
+
+# Global fields on a 0.5 degree grid of the packing benchmarks
+_PACKING_GRID = {"Ni": 720, "Nj": 361, "iDirectionIncrementInDegrees": 0.5, "jDirectionIncrementInDegrees": 0.5,
+                 "latitudeOfLastGridPointInDegrees": -90., "longitudeOfLastGridPointInDegrees": 359.5}
+_PACKING_STEPS = range(0, 24, 3)
+
+_RUNTIME_CONF = {"IBDATE": "20241210", "IBTIME": 0, "IEDATE": "20241211", "IETIME": 0}
+
+
+@pytest.fixture(scope="module")
+def s3_server():
+    server = ThreadedMotoServer(ip_address=_S3_SERVER_HOST, port=_S3_SERVER_PORT)
+    with mock.patch.dict(os.environ, {
+        "AWS_ENDPOINT_URL": _ENDPOINT,
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": "us-east-1",
+    }):
+        server.start()
+        try:
+            yield boto3.Session().client("s3")
+        finally:
+            server.stop()
+
+
+@pytest.fixture(scope="module", params=[
+    1_000,
+    pytest.param(10_000, marks=pytest.mark.slow),
+    pytest.param(50_000, marks=pytest.mark.slow),
+])
+def input_bucket(request, s3_server):
+    """Input bucket filled with n_objects synthetic GRIB files of consecutive IFS cycles."""
+    requests.post(f"{_ENDPOINT}/moto-api/reset", timeout=60)
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    s3_server.create_bucket(Bucket=bucket.name)
+    s3_server.create_bucket(Bucket=CONFIG.main.aws.s3.output.name)
+
+    n_objects: int = request.param
+    bodies: dict[tuple[datetime, int], bytes] = {}
+    for i, (key, cycle, step, domain) in enumerate(_synthetic_keys()):
+        if i == n_objects:
+            break
+        if (cycle, step) not in bodies:
+            bodies[cycle, step] = _synthetic_grib(cycle, step)
+        s3_server.put_object(
+            Bucket=bucket.name,
+            Key=key,
+            Body=bodies[cycle, step],
+            Metadata={"data": json.dumps({
+                "date": cycle.strftime("%Y%m%d"),
+                "time": cycle.strftime("%H%M"),
+                "step": str(step),
+                "model": "IFS",
+                "domain": domain,
+            })},
+        )
+    return n_objects
+
+
+@pytest.fixture(params=["boto3", "asyncio"])
+def engine(request):
+    """The S3 transfer engine used by s3_utils."""
+    with mock.patch.object(CONFIG.main.aws.transfer, "engine", request.param):
+        yield request.param
+
+
+@pytest.fixture(scope="module")
+def window_keys(input_bucket) -> list[str]:
+    return select_files(_RUNTIME_CONF, forecast_datetime="202412100000", step_unit="hours", model=Model.IFS_HRES)
+
+
+def test_list_objs_in_bucket(benchmark, input_bucket, engine):
+    start = datetime(2024, 12, 10)
+
+    objs = benchmark(list_objs_in_bucket, start, start + timedelta(days=1))
+
+    assert len(objs) == input_bucket
+
+
+def test_select_files(benchmark, input_bucket):
+    keys = benchmark(select_files, _RUNTIME_CONF, forecast_datetime="202412100000", step_unit="hours",
+                     model=Model.IFS_HRES)
+
+    assert keys
+
+
+@pytest.mark.parametrize("n_objects", [10_000, 100_000, 500_000])
+def test_select_from_catalogue(benchmark, n_objects):
+    """Selection of a window from the catalogue of a bucket retaining many cycles, without S3 requests."""
+    objects = []
+    for key, cycle, step, domain in _synthetic_keys():
+        if len(objects) == n_objects:
+            break
+        metadata = {"date": cycle.strftime("%Y%m%d"), "time": cycle.strftime("%H%M"), "step": str(step),
+                    "domain": domain}
+        objects.append((key, {"data": json.dumps(metadata)}))
+    catalogue = GribCatalogue.from_metadata(objects)
+    start = datetime.strptime(_RUNTIME_CONF["IBDATE"], "%Y%m%d")
+
+    keys = benchmark(catalogue.select, start, start + timedelta(days=1), "hours", latest_cycle=_LAST_CYCLE)
+
+    assert len(keys) == 9 + 25
+
+
+def test_download_keys_from_bucket(benchmark, window_keys, tmp_path_factory, engine):
+
+    def setup():
+        return (window_keys, tmp_path_factory.mktemp("download")), {}
+
+    benchmark.pedantic(download_keys_from_bucket, setup=setup, rounds=3)
+
+
+def test_generate_available(benchmark, window_keys, tmp_path):
+    data_dir = tmp_path / "data"
+    download_keys_from_bucket(window_keys, data_dir)
+    data_paths = sorted(data_dir.iterdir())
+
+    benchmark(_generate_available, tmp_path / "AVAILABLE", data_paths)
+
+    assert len((tmp_path / "AVAILABLE").read_text().splitlines()) == len(data_paths) + 3
+
+
+def test_prepare_job_directory(benchmark, window_keys, tmp_path_factory, references):
+    data_dir = tmp_path_factory.mktemp("data")
+    download_keys_from_bucket(window_keys, data_dir)
+    with open(references / "runtime_configuration.yaml", "r", encoding="utf-8") as f:
+        configuration = yaml.safe_load(f)[0]
+
+    def setup():
+        return (configuration, tmp_path_factory.mktemp("jobs"), Path(os.environ["FLEXPART_PREFIX"]), data_dir,
+                CONFIG.main.openmp_config), {"model": Model.IFS_HRES}
+
+    benchmark.pedantic(prepare_job_directory, setup=setup, rounds=3)
+
+
+def test_upload_output(benchmark, input_bucket, tmp_path):
+    output_dir = tmp_path / "BEZ" / "output"
+    output_dir.mkdir(parents=True)
+    rng = np.random.default_rng(0)
+    for i in range(20):
+        (output_dir / f"grid_conc_{i:02}.nc").write_bytes(rng.bytes(1_000_000))
+
+    benchmark(upload_output, tmp_path, "BEZ", "2024121000", parent="output")
+
+
+@pytest.fixture(params=["grid_simple", "grid_ccsds"])
+def packed_keys(request, s3_server) -> list[str]:
+    """Keys of global fields of one cycle, packed with the packing type."""
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    s3_server.create_bucket(Bucket=bucket.name)
+    keys = []
+    for step in _PACKING_STEPS:
+        key = f"packing/{request.param}/dispc{_LAST_CYCLE + timedelta(hours=step):%y%m%d%H}"
+        s3_server.put_object(Bucket=bucket.name, Key=key, Body=_packed_grib(step, request.param))
+        keys.append(key)
+    return keys
+
+
+@pytest.mark.benchmark(group="packing")
+def test_download_and_decode(benchmark, packed_keys, tmp_path_factory):
+
+    def setup():
+        return (packed_keys, tmp_path_factory.mktemp("download")), {}
+
+    data_dir = benchmark.pedantic(_download_and_decode, setup=setup, rounds=3)
+
+    benchmark.extra_info["nbytes"] = sum(path.stat().st_size for path in data_dir.iterdir())
+
+
+@pytest.mark.benchmark(group="startup")
+def test_cli_startup(benchmark, tmp_path):
+    """Startup of the run command, invoked once per release site, on a job that completes immediately."""
+    (tmp_path / "input").mkdir()
+    (tmp_path / "input" / "COMMAND").write_text(
+        "&COMMAND\n IBDATE= 20241210,\n IBTIME= 000000,\n IEDATE= 20241210,\n IETIME= 030000,\n /\n",
+        encoding="utf-8")
+    (tmp_path / "job").write_text(
+        "#!/bin/bash\necho 'CONGRATULATIONS: YOU HAVE SUCCESSFULLY COMPLETED A FLEXPART MODEL RUN!'\n",
+        encoding="utf-8")
+    command = [sys.executable, "-X", "importtime", "-m", "flexpart_ifs_utils", "run", "--job_dir", str(tmp_path)]
+
+    process = benchmark(subprocess.run, command, capture_output=True, text=True, check=True)
+
+    benchmark.extra_info["import_time_us"] = _import_time_us(process.stderr)
+
+
+def _import_time_us(stderr: str) -> int:
+    """Cumulative time of the top level imports, from the output of python -X importtime."""
+    total = 0
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            total += int(cumulative)
+    return total
+
+
+def _download_and_decode(keys: list[str], data_dir: Path) -> Path:
+    """Download the keys and decode every field, as Flexpart reads them."""
+    download_keys_from_bucket(keys, data_dir)
+    for path in sorted(data_dir.iterdir()):
+        with open(path, "rb") as f:
+            while (gid := codes_grib_new_from_file(f)) is not None:
+                codes_get_values(gid)
+                codes_release(gid)
+    return data_dir
+
+
+def _synthetic_keys():
+    """Keys of the newest cycle first, so that a partially filled bucket still covers the benchmark window."""
+    cycle = _LAST_CYCLE
+    while True:
+        for domain, steps in _STEPS.items():
+            for step in steps:
+                valid_time = cycle + timedelta(hours=step)
+                name = f"{_PREFIX[domain]}{valid_time:%y%m%d%H}"
+                yield f"{cycle:%Y%m%d_%H}/{domain}/{name}", cycle, step, domain
+        cycle -= timedelta(hours=6)
+
+
+def _synthetic_grib(cycle: datetime, step: int) -> bytes:
+    rng = np.random.default_rng(step)
+    messages = []
+    for _ in range(_MESSAGES_PER_FILE):
+        gid = codes_grib_new_from_samples("regular_ll_sfc_grib1")
+        codes_set(gid, "dataDate", int(cycle.strftime("%Y%m%d")))
+        codes_set(gid, "dataTime", int(cycle.strftime("%H%M")))
+        codes_set(gid, "stepUnits", "h")
+        codes_set(gid, "step", step)
+        codes_set_values(gid, rng.random(16 * 31) * 300.)
+        messages.append(codes_get_message(gid))
+        codes_release(gid)
+    return b"".join(messages)
+
+
+def _packed_grib(step: int, packing_type: str) -> bytes:
+    """Smooth fields with noise, which compress about as well as the fields of the model."""
+    rng = np.random.default_rng(step)
+    lats, lons = np.meshgrid(np.linspace(90., -90., 361), np.linspace(0., 359.5, 720), indexing="ij")
+    messages = []
+    for level in range(_MESSAGES_PER_FILE):
+        gid = codes_grib_new_from_samples("regular_ll_pl_grib2")
+        for key, value in _PACKING_GRID.items():
+            codes_set(gid, key, value)
+        codes_set(gid, "level", 1000 - 40 * level)
+        codes_set(gid, "bitsPerValue", 16)
+        codes_set_string(gid, "packingType", packing_type)
+        values = 250. + 30. * np.cos(np.radians(lats)) + 5. * np.sin(np.radians(3 * lons + step + level))
+        codes_set_values(gid, (values + rng.normal(0., 0.1, values.shape)).ravel())
+        messages.append(codes_get_message(gid))
+        codes_release(gid)
+    return b"".join(messages)
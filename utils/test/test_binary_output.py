@@ -0,0 +1,149 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from flexpart_ifs_utils.binary_output import (BinaryGridOutput, decode_sparse,
+                                              read_header, read_orography)
+
+_NX, _NY, _HEIGHTS = 7, 5, [100., 500., 1000.]
+_NAGECLASS, _NUMPOINTSPEC = 2, 3
+
+
+def _record(f, *arrays) -> None:
+    data = b"".join(np.asarray(a).tobytes() for a in arrays)
+    marker = np.int32(len(data)).tobytes()
+    f.write(marker + data + marker)
+
+
+def _i4(*values) -> np.ndarray:
+    return np.array(values, dtype="<i4")
+
+
+def _f4(*values) -> np.ndarray:
+    return np.array(values, dtype="<f4")
+
+
+def _chars(text: str, length: int) -> bytes:
+    return text.ljust(length).encode()
+
+
+def _write_sparse(f, field: np.ndarray, offset: int = 0) -> None:
+    """The records of the sparse dump of field, as concoutput.f90 writes them, looping over the cells."""
+    starts, values = [], []
+    sign, zero = -1., True
+    for index, value in enumerate(field.ravel()):
+        if value > 0:
+            if zero:
+                starts.append(index + offset)
+                zero = False
+                sign = -sign
+            values.append(sign * value)
+        else:
+            zero = True
+    _record(f, _i4(len(starts)))
+    _record(f, _i4(*starts))
+    _record(f, _i4(len(values)))
+    _record(f, _f4(*values))
+
+
+def _write_header(path) -> None:
+    with open(path, "wb") as f:
+        _record(f, _i4(20241210, 0), _chars("FLEXPART 10.4.9", 256))
+        _record(f, _i4(3600, 3600, 900))
+        _record(f, _f4(5., 45.), _i4(_NX, _NY), _f4(.5, .25))
+        _record(f, _i4(len(_HEIGHTS)), _f4(*_HEIGHTS))
+        _record(f, _i4(20241210, 0))
+        _record(f, _i4(3, _NUMPOINTSPEC))
+        _record(f, _i4(1), _chars("WD_CS-137", 10))
+        _record(f, _i4(1), _chars("DD_CS-137", 10))
+        _record(f, _i4(len(_HEIGHTS)), _chars("CS-137", 10))
+        _record(f, _i4(1))
+        _record(f, _i4(0, 10800, 1))
+        _record(f, _f4(8., 47., 8.1, 47.1, 0., 50.))
+        _record(f, _i4(50000, 1))
+        _record(f, _chars("BEZ", 45))
+        for _ in range(3):
+            _record(f, _f4(1.5))
+        _record(f, _i4(9, 1, 1, 1, 1))
+        _record(f, _i4(_NAGECLASS, 86400, 172800))
+        for ix in range(_NX):
+            _record(f, _f4(*(ix * 100. + np.arange(_NY))))
+
+
+def _sparse_field(rng, shape) -> np.ndarray:
+    field = rng.random(shape, dtype=np.float32)
+    field[rng.random(shape) < .6] = 0.
+    return field
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    """Binary output of two output times, and the dense fields written to it, by time."""
+    rng = np.random.default_rng(0)
+    _write_header(tmp_path / "header")
+    written = {}
+    for itime, timestamp in ((3600, "20241210010000"), (7200, "20241210020000")):
+        conc = _sparse_field(rng, (_NAGECLASS, _NUMPOINTSPEC, len(_HEIGHTS), _NY, _NX))
+        wet = _sparse_field(rng, (_NAGECLASS, _NUMPOINTSPEC, _NY, _NX))
+        dry = np.zeros_like(wet)
+        with open(tmp_path / f"grid_conc_{timestamp}_001", "wb") as f:
+            _record(f, _i4(itime))
+            for kp in range(_NUMPOINTSPEC):
+                for nage in range(_NAGECLASS):
+                    _write_sparse(f, wet[nage, kp])
+                    _write_sparse(f, dry[nage, kp])
+                    # The heights are counted from 1 in the flat indices of the concentration.
+                    _write_sparse(f, conc[nage, kp], offset=_NX * _NY)
+        written[timestamp] = conc, wet, dry
+    (tmp_path / "grid_conc_20241210010000_002").write_bytes(b"")
+    return tmp_path, written
+
+
+def test_read_header(output_dir):
+    header = read_header(output_dir[0] / "header")
+
+    assert (header.date, header.time, header.version) == ("20241210", "000000", "FLEXPART 10.4.9")
+    assert (header.grid.numxgrid, header.grid.numygrid, header.outheight) == (_NX, _NY, _HEIGHTS)
+    assert header.species == ["CS-137"]
+    assert (header.numpointspec, header.nageclass, header.lage) == (_NUMPOINTSPEC, _NAGECLASS, [86400, 172800])
+    assert header.releases[0].name == "BEZ"
+    assert header.releases[0].particles == 50000
+    assert header.releases[0].mass == [1.5]
+    assert header.latitude == pytest.approx([45., 45.25, 45.5, 45.75, 46.])
+
+    orography = read_orography(output_dir[0] / "header", header)
+    assert orography.shape == (_NY, _NX)
+    assert orography[3, 2] == 203.
+
+
+def test_binary_grid_output(output_dir):
+    path, written = output_dir
+
+    output = BinaryGridOutput(path)
+
+    assert len(output) == 2
+    assert output.times == [datetime(2024, 12, 10, 1), datetime(2024, 12, 10, 2)]
+    for time, conc in output:
+        assert conc.shape == (_NAGECLASS, _NUMPOINTSPEC, len(_HEIGHTS), _NY, _NX)
+        np.testing.assert_array_equal(conc, written[f"{time:%Y%m%d%H%M%S}"][0])
+    wet, dry = output.deposition(1)
+    np.testing.assert_array_equal(wet, written["20241210020000"][1])
+    np.testing.assert_array_equal(dry, written["20241210020000"][2])
+
+    fields = output.fields(0)
+    assert fields.itime == 3600
+    sparse = fields.concentration[2][1]
+    assert np.count_nonzero(written["20241210010000"][0][1, 2]) == len(sparse.values)
+    np.testing.assert_array_equal(sparse.to_dense(), written["20241210010000"][0][1, 2])
+
+
+def test_decode_sparse():
+    # Runs of cells 2 to 3, 7 and 9 to 11, the sign of the values alternating between the runs
+    indices, values = decode_sparse(_i4(2, 7, 9), _f4(1., 2., -3., 4., 5., 6.))
+
+    assert indices.tolist() == [2, 3, 7, 9, 10, 11]
+    assert values.tolist() == [1., 2., 3., 4., 5., 6.]
+
+    with pytest.raises(RuntimeError):
+        decode_sparse(_i4(2), _f4(1., -2.))
@@ -0,0 +1,124 @@
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from flexpart_ifs_utils.catalogue import GribCatalogue
+
+
+def _catalogue(objects: list[tuple[str, str, int, str | None]]) -> GribCatalogue:
+    """A catalogue of (key, cycle as YYYYMMDDHHMM, step, domain) objects."""
+    records = []
+    for key, cycle, step, domain in objects:
+        metadata = {"date": cycle[:8], "time": cycle[8:], "step": str(step)}
+        if domain is not None:
+            metadata["domain"] = domain
+        records.append((key, {"data": json.dumps(metadata)}))
+    return GribCatalogue.from_metadata(records)
+
+
+def _keys(cycle: str, steps: range, domain: str | None = None) -> list[tuple[str, str, int, str | None]]:
+    prefix = "dispf" if domain in ("EUROPE", None) else "dispc"
+    start = datetime.strptime(cycle, "%Y%m%d%H%M")
+    return [(f"{cycle}/{domain}/{prefix}{start + timedelta(hours=step):%y%m%d%H}", cycle, step, domain)
+            for step in steps]
+
+
+def test_valid_times():
+    catalogue = _catalogue([("a", "202402281800", 7, None), ("b", "202412310600", 90, None)])
+
+    assert catalogue.valid_times("hours").tolist() == [datetime(2024, 2, 29, 1), datetime(2025, 1, 4)]
+    assert catalogue.valid_times("minutes").tolist() == [datetime(2024, 2, 28, 18, 7), datetime(2024, 12, 31, 7, 30)]
+
+
+def test_select_window():
+    catalogue = _catalogue(
+        _keys("202412100000", range(0, 91, 3), "GLOBAL") + _keys("202412100000", range(91), "EUROPE")
+    )
+
+    keys = catalogue.select(datetime(2024, 12, 10, 3), datetime(2024, 12, 10, 9), "hours")
+
+    assert keys == [
+        "202412100000/GLOBAL/dispc24121003", "202412100000/GLOBAL/dispc24121006", "202412100000/GLOBAL/dispc24121009",
+        *(f"202412100000/EUROPE/dispf241210{hour:02}" for hour in range(3, 10)),
+    ]
+
+
+def test_select_keeps_latest_cycle():
+    catalogue = _catalogue(
+        _keys("202412091800", range(0, 13), "EUROPE")
+        + _keys("202412100000", range(0, 7), "EUROPE")
+        + _keys("202412100600", range(0, 7), "EUROPE")
+    )
+    start, end = datetime(2024, 12, 9, 22), datetime(2024, 12, 10, 6)
+
+    keys = catalogue.select(start, end, "hours", latest_cycle=datetime(2024, 12, 10))
+
+    assert keys == [
+        "202412091800/EUROPE/dispf24120922", "202412091800/EUROPE/dispf24120923",
+        *(f"202412100000/EUROPE/dispf241210{hour:02}" for hour in range(0, 7)),
+    ]
+    assert catalogue.select(start, end, "hours")[-1] == "202412100600/EUROPE/dispf24121006"
+
+
+def test_select_domain_from_key():
+    """Without a domain in the metadata, files of both domains valid at the same time are kept."""
+    catalogue = _catalogue([("dispc24121003", "202412100000", 3, None), ("dispf24121003", "202412100000", 3, None)])
+
+    keys = catalogue.select(datetime(2024, 12, 10), datetime(2024, 12, 11), "hours")
+
+    assert sorted(keys) == ["dispc24121003", "dispf24121003"]
+
+
+def test_select_large_catalogue():
+    """Four weeks of 6-hourly cycles of both domains."""
+    objects = []
+    cycle = datetime(2024, 12, 10)
+    for _ in range(4 * 28):
+        objects += _keys(f"{cycle:%Y%m%d%H%M}", range(0, 91, 3), "GLOBAL") + _keys(f"{cycle:%Y%m%d%H%M}", range(91),
+                                                                                   "EUROPE")
+        cycle -= timedelta(hours=6)
+    catalogue = _catalogue(objects)
+
+    keys = catalogue.select(datetime(2024, 12, 10), datetime(2024, 12, 11), "hours",
+                            latest_cycle=datetime(2024, 12, 10))
+
+    assert len(catalogue) == len(objects)
+    assert len(keys) == 9 + 25
+    assert all(key.startswith("202412100000/") for key in keys)
+
+
+def test_missing_metadata():
+    with pytest.raises(KeyError, match="missing required metadata keys: \\['step'\\]"):
+        GribCatalogue.from_metadata([("a", {"data": json.dumps({"date": "20241210", "time": "0000"})})])
+
+
+def test_empty_catalogue():
+    catalogue = GribCatalogue.from_metadata([])
+
+    assert len(catalogue) == 0
+    assert catalogue.select(datetime(2024, 12, 10), datetime(2024, 12, 11), "hours") == []
+    assert catalogue.valid_times("hours").dtype == np.dtype("datetime64[m]")
+
+
+def test_covers():
+    catalogue = _catalogue(_keys("202412100000", range(3, 10), "EUROPE"))
+
+    assert catalogue.covers(datetime(2024, 12, 10, 3), datetime(2024, 12, 10, 9), "hours")
+    assert not catalogue.covers(datetime(2024, 12, 10, 2), datetime(2024, 12, 10, 9), "hours")
+    assert not catalogue.covers(datetime(2024, 12, 10, 3), datetime(2024, 12, 10, 10), "hours")
+    assert not GribCatalogue.from_metadata([]).covers(datetime(2024, 12, 10), datetime(2024, 12, 10), "hours")
+
+
+def test_cycle_keys():
+    catalogue = _catalogue(
+        list(reversed(_keys("202412100000", range(0, 7), "EUROPE"))) + _keys("202412100600", range(0, 4), "EUROPE")
+    )
+
+    assert catalogue.latest_cycle() == datetime(2024, 12, 10, 6)
+    assert catalogue.cycle_keys(datetime(2024, 12, 10)) == [
+        f"202412100000/EUROPE/dispf241210{hour:02}" for hour in range(0, 7)
+    ]
+    assert catalogue.cycle_keys(datetime(2024, 12, 9)) == []
+    assert GribCatalogue.from_metadata([]).latest_cycle() is None
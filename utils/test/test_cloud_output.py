@@ -0,0 +1,35 @@
+import netCDF4
+import numpy as np
+import zarr
+
+from flexpart_ifs_utils.cloud_output import convert_output_to_zarr, convert_to_zarr
+from flexpart_ifs_utils.config.service_settings import ZarrConfig
+
+
+def test_convert_to_zarr(tmp_path, grid_conc_factory):
+    path = grid_conc_factory(tmp_path / "grid_conc_20241210000000.nc")
+
+    store_path = convert_to_zarr(path, tmp_path / "grid_conc_20241210000000.zarr",
+                                 ZarrConfig(time_chunk=1, complevel=5))
+
+    root = zarr.open_consolidated(store_path, mode="r")
+    with netCDF4.Dataset(path) as ds:
+        for name in ("spec001_mr", "WD_spec001", "time", "latitude", "ORO"):
+            np.testing.assert_array_equal(root[name][...], ds[name][...])
+        assert root["spec001_mr"].attrs["units"] == "ng m-3"
+        assert root.attrs["title"] == "FLEXPART MODEL OUTPUT"
+
+    conc = root["spec001_mr"]
+    assert conc.attrs["_ARRAY_DIMENSIONS"] == ["nageclass", "pointspec", "time", "height", "latitude", "longitude"]
+    assert conc.chunks == (1, 1, 1, 1, 30, 40)
+    assert root["WD_spec001"].chunks == (1, 1, 1, 30, 40)
+
+
+def test_convert_output_to_zarr(tmp_path, grid_conc_factory):
+    (tmp_path / "BEZ" / "output").mkdir(parents=True)
+    grid_conc_factory(tmp_path / "BEZ" / "output" / "grid_conc_20241210000000.nc")
+
+    stores = convert_output_to_zarr(tmp_path, ZarrConfig(time_chunk=2, complevel=1), max_workers=1)
+
+    assert stores == [tmp_path / "BEZ" / "output" / "grid_conc_20241210000000.zarr"]
+    assert zarr.open_consolidated(stores[0], mode="r")["spec001_mr"].chunks[2] == 2
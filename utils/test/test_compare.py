@@ -0,0 +1,96 @@
+import json
+import shutil
+
+import netCDF4
+import numpy as np
+import pytest
+
+from flexpart_ifs_utils.__main__ import compare
+from flexpart_ifs_utils.compare import compare_files, compare_outputs
+from flexpart_ifs_utils.config.service_settings import CompareConfig
+
+_CONFIG = CompareConfig(max_rel_error=1e-3, max_mass_error=1e-4, min_correlation=0.9999, time_chunk=2)
+
+
+@pytest.fixture
+def outputs(tmp_path, grid_conc_factory):
+    """Reference and candidate output trees of two sites, identical."""
+    for site in ("BEZ", "LEI"):
+        (tmp_path / "reference" / site / "output").mkdir(parents=True)
+        grid_conc_factory(tmp_path / "reference" / site / "output" / "grid_conc_20241210000000.nc")
+    shutil.copytree(tmp_path / "reference", tmp_path / "candidate")
+    return tmp_path / "reference", tmp_path / "candidate"
+
+
+def _scale(path, name, factor, time_index=None) -> None:
+    with netCDF4.Dataset(path, "a") as ds:
+        index = (slice(None), slice(None), time_index if time_index is not None else slice(None))
+        ds[name][index] = ds[name][index] * factor
+
+
+def test_compare_identical_outputs(outputs):
+    comparisons = compare_outputs(*outputs, _CONFIG, max_workers=2)
+
+    assert [c.path for c in comparisons] == [f"{site}/output/grid_conc_20241210000000.nc" for site in ("BEZ", "LEI")]
+    assert not any(c.failed for c in comparisons)
+    conc = next(v for v in comparisons[0].variables if v.name == "spec001_mr")
+    assert (conc.max_abs_error, conc.mass_error, conc.correlation) == (0., 0., pytest.approx(1.))
+
+
+@pytest.mark.parametrize("factor, failures", [
+    (1 + 1e-6, []),
+    (1.01, ["relative error", "mass error"]),
+])
+def test_compare_scaled_field(outputs, factor, failures):
+    reference, candidate = outputs
+    path = "BEZ/output/grid_conc_20241210000000.nc"
+    _scale(candidate / path, "spec001_mr", factor)
+
+    comparison = compare_files(reference / path, candidate / path, path, _CONFIG)
+
+    conc = next(v for v in comparison.variables if v.name == "spec001_mr")
+    assert [" ".join(failure.split()[:2]) for failure in conc.failures] == failures
+    assert conc.mass_error == pytest.approx(factor - 1, rel=1e-3)
+
+
+def test_compare_decorrelated_field(outputs):
+    reference, candidate = outputs
+    path = "BEZ/output/grid_conc_20241210000000.nc"
+    with netCDF4.Dataset(candidate / path, "a") as ds:
+        # The same mass, at other cells
+        ds["WD_spec001"][:] = np.flip(ds["WD_spec001"][:], axis=-1)
+
+    conc = next(v for v in compare_files(reference / path, candidate / path, path, _CONFIG).variables
+                if v.name == "WD_spec001")
+
+    assert conc.mass_error == pytest.approx(0., abs=1e-6)
+    assert conc.correlation < 0.5
+    assert any(failure.startswith("correlation") for failure in conc.failures)
+
+
+def test_compare_structure(outputs):
+    reference, candidate = outputs
+    (candidate / "LEI" / "output" / "grid_conc_20241210000000.nc").unlink()
+    with netCDF4.Dataset(candidate / "BEZ" / "output" / "grid_conc_20241210000000.nc", "a") as ds:
+        ds.renameVariable("DD_spec001", "DD_spec002")
+        ds["RELCOM"][0, :3] = list(b"LEI")
+
+    comparisons = {c.path: c for c in compare_outputs(reference, candidate, _CONFIG, max_workers=1)}
+
+    assert comparisons["LEI/output/grid_conc_20241210000000.nc"].failures == ["missing in the candidate output"]
+    bez = comparisons["BEZ/output/grid_conc_20241210000000.nc"]
+    assert bez.failures == ["variable DD_spec002 missing in the reference output",
+                            "variable DD_spec001 missing in the candidate output"]
+    assert next(v for v in bez.variables if v.name == "RELCOM").failures == ["values differ"]
+
+
+def test_compare_command(outputs, tmp_path):
+    reference, candidate = outputs
+    assert compare(reference, candidate, None) == 0
+
+    _scale(candidate / "LEI" / "output" / "grid_conc_20241210000000.nc", "spec001_mr", 2., time_index=3)
+    assert compare(reference, candidate, tmp_path / "report.json") == 1
+
+    report = json.loads((tmp_path / "report.json").read_text())
+    failed = [(c["path"], v["name"]) for c in report for v in c["variables"] if v["failures"]]
+    assert failed == [("LEI/output/grid_conc_20241210000000.nc", "spec001_mr")]
@@ -0,0 +1,54 @@
+import netCDF4
+import numpy as np
+import pytest
+
+from flexpart_ifs_utils.config.service_settings import DerivedProductsConfig
+from flexpart_ifs_utils.derived_products import derive_products, derive_products_from_file
+
+
+@pytest.fixture
+def config() -> DerivedProductsConfig:
+    return DerivedProductsConfig(sites=["BEZ"], time_chunk=2, arrival_threshold=0.0, thresholds=[700., 900.])
+
+
+def test_derive_products_from_file(tmp_path, grid_conc_factory, config):
+    path = grid_conc_factory(tmp_path / "grid_conc_20241210000000.nc")
+    with netCDF4.Dataset(path) as ds:
+        conc = ds["spec001_mr"][:]
+        times = ds["time"][:]
+        wet = ds["WD_spec001"][:]
+        dry = ds["DD_spec001"][:]
+
+    out_path = derive_products_from_file(path, config)
+
+    assert out_path == tmp_path / "derived_20241210000000.nc"
+
+    # Output every 3 hours, starting 3 hours after the simulation start
+    durations = np.full(len(times), 10800.)
+    expected_integral = (conc * durations[:, None, None, None]).sum(axis=2)
+    expected_peak = conc.max(axis=2)
+    above = conc > 0.
+    expected_arrival = np.where(above.any(axis=2), times[above.argmax(axis=2)], np.nan)
+
+    with netCDF4.Dataset(out_path) as ds:
+        np.testing.assert_allclose(ds["spec001_mr_integrated"][:], expected_integral, rtol=1e-5)
+        np.testing.assert_array_equal(ds["spec001_mr_peak"][:], expected_peak)
+        np.testing.assert_array_equal(ds["spec001_mr_arrival_time"][:].filled(np.nan), expected_arrival)
+        np.testing.assert_array_equal(ds["spec001_mr_exceedance"][0], expected_peak > 700.)
+        np.testing.assert_array_equal(ds["spec001_mr_exceedance"][1], expected_peak > 900.)
+        np.testing.assert_allclose(ds["WD_spec001_total"][:], wet.sum(axis=2), rtol=1e-6)
+        np.testing.assert_allclose(ds["DD_spec001_total"][:], dry.sum(axis=2), rtol=1e-6)
+        np.testing.assert_allclose(ds["TD_spec001_total"][:], (wet + dry).sum(axis=2), rtol=1e-6)
+        assert ds["spec001_mr_integrated"].dimensions == ("nageclass", "pointspec", "height", "latitude", "longitude")
+        np.testing.assert_array_equal(ds["latitude"][:], 35. + 0.1 * np.arange(30, dtype=np.float32))
+
+
+def test_derive_products_configured_sites(tmp_path, grid_conc_factory, config):
+    for site in ("BEZ", "Kursk"):
+        (tmp_path / site / "output").mkdir(parents=True)
+        grid_conc_factory(tmp_path / site / "output" / "grid_conc_20241210000000.nc")
+
+    derived = derive_products(tmp_path, config, max_workers=2)
+
+    assert derived == [tmp_path / "BEZ" / "output" / "derived_20241210000000.nc"]
+    assert not (tmp_path / "Kursk" / "output" / "derived_20241210000000.nc").exists()
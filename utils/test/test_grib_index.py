@@ -0,0 +1,145 @@
+from pathlib import Path
+
+import pytest
+from eccodes import (codes_get_long, codes_get_message, codes_get_string,
+                     codes_grib_new_from_samples, codes_release, codes_set)
+
+from flexpart_ifs_utils import CONFIG
+from flexpart_ifs_utils.grib_index import (S3RangeReader, index_file,
+                                           index_object, read_object_header,
+                                           scan)
+from flexpart_ifs_utils.grib_utils import extract_metadata_from_grib_file
+
+_MESSAGES = [
+    ("regular_ll_sfc_grib1", {"dataDate": 20241210, "dataTime": 1200, "step": 7}),
+    ("regular_ll_pl_grib1", {"level": 850, "indicatorOfParameter": 130}),
+    ("regular_ll_sfc_grib2", {"dataTime": 600, "stepUnits": "m", "step": 90}),
+    ("regular_ll_pl_grib2", {"level": 500}),
+    ("GRIB2", {"productDefinitionTemplateNumber": 8, "paramId": 228, "startStep": 0, "endStep": 12}),
+]
+
+
+@pytest.fixture
+def grib_file(tmp_path) -> tuple[Path, list[dict]]:
+    """A GRIB file of messages of both editions, and the mars keys of each message decoded by eccodes."""
+    messages, expected = [], []
+    for sample, keys in _MESSAGES:
+        gid = codes_grib_new_from_samples(sample)
+        for key, value in keys.items():
+            codes_set(gid, key, value)
+        expected.append({
+            "date": codes_get_string(gid, "mars.date"),
+            "time": codes_get_string(gid, "mars.time"),
+            "step": codes_get_long(gid, "endStep"),
+            "edition": codes_get_long(gid, "edition"),
+        })
+        messages.append(codes_get_message(gid))
+        codes_release(gid)
+
+    path = tmp_path / "dispf24121000"
+    path.write_bytes(b"".join(messages))
+    return path, expected
+
+
+def test_index_file(grib_file):
+    path, expected = grib_file
+
+    index = index_file(path)
+
+    assert [m.model_dump(include={"date", "time", "step", "edition"}) for m in index] == expected
+    assert [m.step_hours for m in index] == [7., 0., 1.5, 0., 12.]
+    assert [m.parameter for m in index] == ["128.167", "128.130", "0.0.0", "0.0.0", "0.1.193"]
+    assert [(m.level_type, m.level) for m in index[:4]] == [(1, 0.), (100, 850.), (1, 0.), (100, 50000.)]
+
+    # Messages are contiguous and each byte range is one complete message
+    data = path.read_bytes()
+    assert index[0].offset == 0
+    assert sum(m.length for m in index) == len(data)
+    for message in index:
+        assert data[message.offset:message.offset + 4] == b"GRIB"
+        assert data[message.offset + message.length - 4:message.offset + message.length] == b"7777"
+
+
+@pytest.mark.parametrize("sample, keys, step_units", [
+    ("regular_ll_sfc_grib1", {"indicatorOfUnitOfTimeRange": 13, "P1": 6}, "15m"),
+    ("regular_ll_sfc_grib2", {"indicatorOfUnitOfTimeRange": 13, "forecastTime": 5400}, "s"),
+])
+def test_index_step_units(tmp_path, sample, keys, step_units):
+    """Unit 13 of the time range is 15 minutes in GRIB1 code table 4, and seconds in GRIB2 code table 4.4."""
+    gid = codes_grib_new_from_samples(sample)
+    for key, value in keys.items():
+        codes_set(gid, key, value)
+    path = tmp_path / "dispf24121000"
+    path.write_bytes(codes_get_message(gid))
+    codes_release(gid)
+
+    (message,) = index_file(path)
+
+    assert (message.step_units, message.step_hours) == (step_units, 1.5)
+
+
+@pytest.mark.parametrize("template", [8, 11])
+def test_index_time_range_unit(tmp_path, template):
+    """The length of the time range of statistically processed fields is converted to the unit of the step."""
+    gid = codes_grib_new_from_samples("regular_ll_sfc_grib2")
+    codes_set(gid, "productDefinitionTemplateNumber", template)
+    for key, value in {"indicatorOfUnitOfTimeRange": 1, "forecastTime": 6, "indicatorOfUnitForTimeRange": 0,
+                       "lengthOfTimeRange": 120}.items():
+        codes_set(gid, key, value)
+    path = tmp_path / "dispf24121000"
+    path.write_bytes(codes_get_message(gid))
+    codes_set(gid, "lengthOfTimeRange", 90)
+    misaligned = tmp_path / "dispf24121001"
+    misaligned.write_bytes(codes_get_message(gid))
+    codes_release(gid)
+
+    (message,) = index_file(path)
+
+    assert (message.step, message.step_units, message.step_hours) == (8, "h", 8.)
+    with pytest.raises(RuntimeError, match="not a whole number"):
+        index_file(misaligned)
+
+
+def test_extract_metadata_from_grib_file(grib_file):
+    path, expected = grib_file
+
+    metadata = extract_metadata_from_grib_file(path)
+
+    assert (metadata.date, metadata.time, metadata.step) == (expected[0]["date"], expected[0]["time"], 7.)
+
+
+def test_index_object(s3, grib_file):
+    path, _ = grib_file
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    s3.put_object(Bucket=bucket.name, Key=path.name, Body=path.read_bytes())
+
+    assert index_object(s3, bucket.name, path.name) == index_file(path)
+
+
+def test_scan_reads_only_headers(s3, grib_file):
+    """The first message is found with one ranged GET of a block, not a download of the object."""
+    path, _ = grib_file
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    s3.put_object(Bucket=bucket.name, Key=path.name, Body=path.read_bytes())
+    reader = S3RangeReader(s3, bucket.name, path.name, size=path.stat().st_size, block_size=64)
+    ranges = []
+    get_range = reader.get_range
+    reader.get_range = lambda offset, length: ranges.append((offset, length)) or get_range(offset, length)
+
+    message = next(scan(reader, path.name, max_messages=1))
+
+    assert message.date == "20241210"
+    assert all(length <= 64 for _, length in ranges)
+
+
+def test_read_object_header(s3, grib_file):
+    path, _ = grib_file
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    s3.put_object(Bucket=bucket.name, Key=path.name, Body=path.read_bytes())
+    ranges = []
+    s3.meta.events.register("provide-client-params.s3.GetObject", lambda params, **_: ranges.append(params["Range"]))
+
+    message = read_object_header(s3, bucket.name, path.name, size=path.stat().st_size)
+
+    assert message == index_file(path)[0]
+    assert ranges == [f"bytes=0-{min(path.stat().st_size, 1024) - 1}"]
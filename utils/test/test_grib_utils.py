@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+from eccodes import (codes_get_message, codes_grib_new_from_samples,
+                     codes_release, codes_set_values)
+
+from flexpart_ifs_utils.grib_utils import _is_grib_file, check_grib_framing
+
+
+def _message(sample: str) -> bytes:
+    gid = codes_grib_new_from_samples(sample)
+    codes_set_values(gid, np.random.default_rng(0).random(16 * 31))
+    message = codes_get_message(gid)
+    codes_release(gid)
+    return message
+
+
+def _large_grib1_message() -> bytes:
+    """A GRIB1 message with the large message length coding: 1 unit of 120 bytes, corrected by section 4."""
+    section1 = (28).to_bytes(3, "big") + bytes([0, 0, 0, 0, 0x80]) + bytes(20)  # section 2 present
+    section2 = (32).to_bytes(3, "big") + bytes(29)
+    section4 = (20).to_bytes(3, "big") + bytes(17)
+    length = 120 - 20 + 4
+    body = section1 + section2 + section4
+    header = b"GRIB" + (0x800000 | 1).to_bytes(3, "big") + bytes([1])
+    return header + body + bytes(length - len(header) - len(body) - 4) + b"7777"
+
+
+@pytest.mark.parametrize("samples", [
+    ["regular_ll_sfc_grib1"] * 3,
+    ["regular_ll_sfc_grib2"] * 2,
+    ["regular_ll_sfc_grib1", "regular_ll_sfc_grib2"],
+])
+def test_check_grib_framing(tmp_path, samples):
+    path = tmp_path / "dispf24121000"
+    path.write_bytes(b"".join(_message(sample) for sample in samples))
+
+    assert check_grib_framing(path) == len(samples)
+    assert _is_grib_file(path)
+
+
+def test_check_grib_framing_large_grib1(tmp_path):
+    path = tmp_path / "dispc24121000"
+    path.write_bytes(_large_grib1_message() + _message("regular_ll_sfc_grib1"))
+
+    assert check_grib_framing(path) == 2
+
+
+@pytest.mark.parametrize("corrupt, error", [
+    (lambda data: data[:-10], "truncated"),
+    (lambda data: data[:-4] + b"0000", "does not end with 7777"),
+    (lambda data: data + b"junk", "No GRIB message"),
+    (lambda data: b"\0" * 8 + data, "No GRIB message"),
+])
+def test_check_grib_framing_corrupt(tmp_path, corrupt, error):
+    path = tmp_path / "dispf24121000"
+    path.write_bytes(corrupt(_message("regular_ll_sfc_grib2") * 2))
+
+    with pytest.raises(RuntimeError, match=error):
+        check_grib_framing(path)
+    assert not _is_grib_file(path)
+
+
+def test_check_grib_framing_empty(tmp_path):
+    path = tmp_path / "dispf24121000"
+    path.write_bytes(b"")
+
+    with pytest.raises(RuntimeError, match="No GRIB message"):
+        check_grib_framing(path)
+    assert not _is_grib_file(path)
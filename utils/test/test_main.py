@@ -1,4 +1,7 @@
 
+import subprocess
+import sys
+
 import pytest
 
 from flexpart_ifs_utils.__main__ import parse_env, validate_env
@@ -28,3 +31,37 @@ def test_validate_env(mock_environment_incomplete):
         validate_env(environment)
 
     assert "Environment is missing variables needed to prepare runtime configuration: ['SIMULATION_END_ZZ']" in str(exc_info.value)
+
+
+# Modules taking most of the startup time of the CLI, imported only by the commands using them
+_HEAVY_MODULES = ("boto3", "botocore.client", "aiobotocore", "eccodes", "netCDF4", "zarr", "numpy")
+
+
+def _imported_modules(code: str) -> set[str]:
+    """The modules imported by running code, from the output of python -X importtime."""
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                             capture_output=True, text=True, check=True)
+    return {
+        line.split("|")[-1].strip()
+        for line in process.stderr.splitlines()
+        if line.startswith("import time:") and "|" in line
+    }
+
+
+@pytest.mark.parametrize("module", [
+    "flexpart_ifs_utils",
+    "flexpart_ifs_utils.__main__",
+    "flexpart_ifs_utils.progress",
+    "flexpart_ifs_utils.s3_utils",
+])
+def test_import_is_lazy(module):
+    imported = _imported_modules(f"import {module}")
+
+    assert not imported.intersection(_HEAVY_MODULES)
+
+
+def test_config_is_loaded_on_first_access():
+    settings = "flexpart_ifs_utils.config.service_settings"
+
+    assert settings not in _imported_modules("import flexpart_ifs_utils.__main__")
+    assert settings in _imported_modules("import flexpart_ifs_utils; flexpart_ifs_utils.CONFIG.main.app_name")
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import shutil
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+from flexpart_ifs_utils import CONFIG, manifest as manifest_module
+from flexpart_ifs_utils.grib_utils import (_get_valid_datetime,
+                                           extract_metadata_from_grib_file)
+from flexpart_ifs_utils.manifest import (build_manifest, latest_cycle,
+                                         manifest_key, read_manifest,
+                                         upload_manifest)
+from flexpart_ifs_utils.timing import phase
+
+
+@pytest.fixture
+def cycle_files(model_data: Path, tmp_path) -> tuple[datetime, list[Path]]:
+    """The GRIB test files of the cycle of the first one, renamed as files of the Europe domain."""
+    paths = sorted(model_data.iterdir())
+    metadata = extract_metadata_from_grib_file(paths[0])
+    cycle = datetime.strptime(metadata.date + metadata.time, "%Y%m%d%H%M")
+
+    directory = tmp_path / "cycle"
+    directory.mkdir()
+    files = []
+    for path in paths:
+        if path.name.startswith("."):
+            continue
+        if extract_metadata_from_grib_file(path).model_dump(include={"date", "time"}) != {
+                "date": metadata.date, "time": metadata.time}:
+            continue
+        valid_time = _get_valid_datetime(path)
+        files.append(Path(shutil.copy(path, directory / f"dispf{valid_time:%y%m%d%H}")))
+    return cycle, sorted(files)
+
+
+def test_build_manifest_from_directory(cycle_files, tmp_path):
+    cycle, files = cycle_files
+    (tmp_path / "cycle" / "README").write_text("Not a GRIB file")
+
+    manifest = build_manifest(cycle, f"{cycle:%Y%m%d_%H}/EUROPE/", tmp_path / "cycle")
+
+    assert manifest["cycle"] == cycle.isoformat()
+    assert [entry["key"] for entry in manifest["objects"]] == [f"{cycle:%Y%m%d_%H}/EUROPE/{f.name}" for f in files]
+    for entry, path in zip(manifest["objects"], files):
+        assert entry["domain"] == "EUROPE"
+        assert entry["size"] == path.stat().st_size
+        assert entry["checksum"] == f"sha256:{hashlib.sha256(path.read_bytes()).hexdigest()}"
+        assert datetime.fromisoformat(entry["valid_time"]) == _get_valid_datetime(path)
+
+
+def test_build_manifest_from_bucket(s3, cycle_files):
+    cycle, files = cycle_files
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    prefix = f"{cycle:%Y%m%d_%H}/"
+    for step, path in enumerate(files):
+        data = {"date": f"{cycle:%Y%m%d}", "time": f"{cycle:%H%M}", "step": str(step), "domain": "GLOBAL"}
+        s3.put_object(Bucket=bucket.name, Key=prefix + path.name, Body=path.read_bytes(),
+                      Metadata={"data": json.dumps(data)})
+    # Objects of another cycle, and the manifest itself, are left out.
+    s3.put_object(Bucket=bucket.name, Key=prefix + "old", Body=files[0].read_bytes(),
+                  Metadata={"data": json.dumps({"date": "19990101", "time": "0000", "step": "0"})})
+    s3.put_object(Bucket=bucket.name, Key=manifest_key(cycle), Body=b"{}")
+
+    manifest = build_manifest(cycle, prefix)
+
+    assert [entry["key"] for entry in manifest["objects"]] == [prefix + path.name for path in files]
+    assert [entry["step"] for entry in manifest["objects"]] == [float(step) for step in range(len(files))]
+    assert all(entry["domain"] == "GLOBAL" for entry in manifest["objects"])
+    assert manifest["objects"][0]["checksum"] == f"md5:{hashlib.md5(files[0].read_bytes()).hexdigest()}"
+
+
+def test_read_manifest(s3, cycle_files):
+    cycle, _ = cycle_files
+    manifest = build_manifest(cycle, f"{cycle:%Y%m%d_%H}/EUROPE/", cycle_files[1][0].parent)
+    assert upload_manifest(manifest) == manifest_key(cycle)
+
+    with phase("test_read_manifest") as timing:
+        catalogue = read_manifest(cycle)
+
+    assert timing.requests == 1
+    assert catalogue is not None
+    assert list(catalogue.keys) == [entry["key"] for entry in manifest["objects"]]
+    assert catalogue.valid_times("hours").tolist() == [
+        datetime.fromisoformat(entry["valid_time"]) for entry in manifest["objects"]
+    ]
+
+
+def test_keep_manifests(s3, cycle_files, monkeypatch):
+    cycle, files = cycle_files
+    upload_manifest(build_manifest(cycle, f"{cycle:%Y%m%d_%H}/EUROPE/", files[0].parent))
+    monkeypatch.setattr(manifest_module, "_catalogues", None)
+    manifest_module.keep_manifests()
+
+    with phase("test_keep_manifests") as timing:
+        catalogues = [read_manifest(cycle), read_manifest(cycle)]
+
+    assert timing.requests == 1
+    assert catalogues[0] is catalogues[1]
+
+
+def test_read_manifest_missing(s3):
+    assert read_manifest(datetime(2024, 12, 10) - timedelta(days=1)) is None
+
+
+def test_latest_cycle(s3):
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    for key in ("20241210_00/EUROPE/dispf24121000", "20241210_12/GLOBAL/dispc24121012", "README"):
+        s3.put_object(Bucket=bucket.name, Key=key, Body=b"")
+
+    assert latest_cycle() == datetime(2024, 12, 10, 12)
+
+
+def test_latest_cycle_empty(s3):
+    assert latest_cycle() is None
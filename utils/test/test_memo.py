@@ -0,0 +1,140 @@
+import os
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+import yaml
+
+from flexpart_ifs_utils import CONFIG
+from flexpart_ifs_utils.config.service_settings import PlannerConfig
+from flexpart_ifs_utils.memo import (MEMO_FILE, RUN_KEY_FILE, RunRecord,
+                                     compute_run_key, find_run, publish_run,
+                                     skip_job, write_run_key)
+from flexpart_ifs_utils.model import Model
+from flexpart_ifs_utils.planner import Plan
+from flexpart_ifs_utils.prepare_flexpart import render_namelists
+from flexpart_ifs_utils.s3_utils import upload_output
+from flexpart_ifs_utils.stages import generate, run
+
+_KEYS = ["20241210_00/EUROPE/dispf24121000", "20241210_00/EUROPE/dispf24121001"]
+_ENVIRONMENT = {
+    "EMISSION_START_YYYY": "2024", "EMISSION_START_MM": "12", "EMISSION_START_DD": "10", "EMISSION_START_ZZ": "00",
+    "EMISSION_END_YYYY": "2024", "EMISSION_END_MM": "12", "EMISSION_END_DD": "10", "EMISSION_END_ZZ": "06",
+    "SIMULATION_END_YYYY": "2024", "SIMULATION_END_MM": "12", "SIMULATION_END_DD": "11", "SIMULATION_END_ZZ": "00",
+}
+
+
+@pytest.fixture
+def configuration(references) -> dict:
+    with open(references / 'runtime_configuration.yaml', 'r', encoding="utf-8") as f:
+        return yaml.safe_load(f)[0]
+
+
+@pytest.fixture
+def flexpart_dir() -> Path:
+    return Path(os.environ['FLEXPART_PREFIX'])
+
+
+@pytest.fixture
+def uploaded_run(s3, tmp_path) -> tuple[Path, list[str]]:
+    """A job directory with a run key, whose output of BEZ for the cycle 2024121000 was uploaded."""
+    job_dir = tmp_path / "jobs" / "BEZ"
+    (job_dir / "output").mkdir(parents=True)
+    for name in ("grid_conc_20241210000000.nc", "header_grid.nc"):
+        (job_dir / "output" / name).write_bytes(name.encode())
+    write_run_key(job_dir, "a" * 64)
+    uploaded = upload_output(tmp_path / "jobs", "BEZ", "2024121000", parent="output")
+    return job_dir, uploaded
+
+
+def test_render_namelists(configuration, flexpart_dir, references):
+    namelists = render_namelists(configuration, flexpart_dir, Model.IFS_HRES_EUROPE)
+
+    assert {"COMMAND", "OUTGRID", "RELEASES"} <= set(namelists)
+    assert all(name.startswith("RELEASES") for name in set(namelists) - {"COMMAND", "OUTGRID"})
+    for name in ("COMMAND", "OUTGRID", "RELEASES"):
+        assert namelists[name] == (references / "BEZ" / "input" / name).read_text()
+
+
+def test_compute_run_key(s3, configuration, flexpart_dir):
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    for key in _KEYS:
+        s3.put_object(Bucket=bucket.name, Key=key, Body=key.encode())
+
+    run_key = compute_run_key(_KEYS, configuration, flexpart_dir, Model.IFS_HRES_EUROPE)
+
+    assert run_key == compute_run_key(list(reversed(_KEYS)), configuration, flexpart_dir, Model.IFS_HRES_EUROPE)
+    assert run_key != compute_run_key(_KEYS[:1], configuration, flexpart_dir, Model.IFS_HRES_EUROPE)
+    later_emission = {**configuration, "command": {**configuration["command"], "IBTIME": "060000"}}
+    assert run_key != compute_run_key(_KEYS, later_emission, flexpart_dir, Model.IFS_HRES_EUROPE)
+    # An input object published again with other content
+    s3.put_object(Bucket=bucket.name, Key=_KEYS[0], Body=b"republished")
+    assert run_key != compute_run_key(_KEYS, configuration, flexpart_dir, Model.IFS_HRES_EUROPE)
+
+
+def test_publish_and_find_run(s3, uploaded_run):
+    job_dir, uploaded = uploaded_run
+
+    publish_run(job_dir, "BEZ", "2024121000", uploaded)
+    record = find_run("a" * 64)
+
+    assert record is not None
+    assert record.prefix == "20241210_00/BEZ"
+    assert sorted(record.objects) == sorted(uploaded)
+    assert find_run("b" * 64) is None
+
+    # The output of another run of the site and cycle replaced the recorded one.
+    s3.put_object(Bucket=CONFIG.main.aws.s3.output.name, Key=uploaded[0], Body=b"other run")
+    assert find_run("a" * 64) is None
+
+
+def test_publish_run_copies_output(s3, uploaded_run, tmp_path):
+    job_dir, uploaded = uploaded_run
+    publish_run(job_dir, "BEZ", "2024121000", uploaded)
+    bucket = CONFIG.main.aws.s3.output.name
+
+    skipped_dir = skip_job(tmp_path / "rerun" / "BEZ", "a" * 64, find_run("a" * 64))
+    publish_run(skipped_dir, "BEZ", "2024121012", [])
+
+    for key in uploaded:
+        copied = s3.get_object(Bucket=bucket, Key=key.replace("20241210_00", "20241210_12"))
+        assert copied["Body"].read() == s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+        assert copied["Metadata"] == {"date": "20241210", "time": "12", "site": "BEZ"}
+    assert (skipped_dir / RUN_KEY_FILE).read_text() == "a" * 64
+
+
+def test_run_skips_memoized_job(tmp_path):
+    job_dir = skip_job(tmp_path / "BEZ", "a" * 64, RunRecord(run_key="a" * 64, prefix="20241210_00/BEZ", objects={}))
+
+    with patch("flexpart_ifs_utils.progress.run_job") as mock_run_job:
+        assert run(job_dir) == 0
+
+    mock_run_job.assert_not_called()
+    assert (job_dir / MEMO_FILE).exists()
+
+
+def test_generate_run_key_covers_planned_particles(s3, flexpart_dir, tmp_path, monkeypatch):
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    for key in _KEYS:
+        s3.put_object(Bucket=bucket.name, Key=key, Body=key.encode())
+    monkeypatch.setattr(CONFIG.main.output, "memoize", True)
+    monkeypatch.setattr(CONFIG.main, "planner", PlannerConfig(
+        stats_path=str(tmp_path / "stats.db"), deadline=3600., thread_counts=[4], min_particles=1000,
+        max_particles=100000, min_runs=3, max_runs=100))
+    record = RunRecord(run_key="a" * 64, prefix="20241210_00/BEZ", objects={})
+    plan = Plan(particles=12345, threads=4, predicted_wall_time=600.)
+
+    with patch("flexpart_ifs_utils.prepare_flexpart.select_files", return_value=_KEYS), \
+            patch("flexpart_ifs_utils.planner.plan_run", return_value=plan), \
+            patch("flexpart_ifs_utils.memo.find_run", return_value=record):
+        job_dir = generate("2024121000", "BEZ", tmp_path / "jobs", flexpart_dir, Model.IFS_HRES_EUROPE,
+                           environment=_ENVIRONMENT)
+
+    # The run key is computed from the RELEASES namelist with the planned number of particles.
+    with open(tmp_path / "jobs" / "runtime_configuration.yaml", encoding="utf-8") as f:
+        (configuration,) = yaml.safe_load(f)
+    assert configuration["releases"].get("PARTS") != plan.particles
+    run_key = (job_dir / RUN_KEY_FILE).read_text()
+    assert run_key != compute_run_key(_KEYS, configuration, flexpart_dir, Model.IFS_HRES_EUROPE)
+    configuration["releases"]["PARTS"] = plan.particles
+    assert run_key == compute_run_key(_KEYS, configuration, flexpart_dir, Model.IFS_HRES_EUROPE)
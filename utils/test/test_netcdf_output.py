@@ -0,0 +1,27 @@
+import netCDF4
+import numpy as np
+
+from flexpart_ifs_utils.netcdf_output import grid_conc_files, time_blocks
+
+
+def test_grid_conc_files(tmp_path):
+    for site in ("BEZ", "LEI"):
+        (tmp_path / site / "output").mkdir(parents=True)
+        (tmp_path / site / "output" / "grid_conc_20241210000000.nc").write_bytes(b"")
+        (tmp_path / site / "output" / "derived_20241210000000.nc").write_bytes(b"")
+
+    assert grid_conc_files(tmp_path, ["LEI", "GOE"]) == [tmp_path / "LEI" / "output" / "grid_conc_20241210000000.nc"]
+
+
+def test_time_blocks(tmp_path):
+    with netCDF4.Dataset(tmp_path / "blocks.nc", "w") as dataset:
+        dataset.createDimension("pointspec", 2)
+        dataset.createDimension("time", 5)
+        var = dataset.createVariable("field", "f8", ("pointspec", "time"))
+        var[:] = np.arange(10.).reshape(2, 5)
+
+        blocks = list(time_blocks(var, 1, 2))
+
+        assert [start for start, _ in blocks] == [0, 2, 4]
+        assert all(block.dtype == np.float32 for _, block in blocks)
+        assert np.array_equal(np.concatenate([block for _, block in blocks], axis=1), var[:])
@@ -0,0 +1,92 @@
+import numpy as np
+import pytest
+import zarr
+
+from flexpart_ifs_utils.config.service_settings import ParticleDumpConfig
+from flexpart_ifs_utils.particle_output import (convert_partposit,
+                                                convert_particle_dumps,
+                                                read_dump_time)
+
+_NSPEC = 2
+
+
+def _record(f, *values) -> None:
+    data = b"".join(np.asarray(value, dtype=dtype).tobytes() for value, dtype in values)
+    marker = np.int32(len(data)).tobytes()
+    f.write(marker + data + marker)
+
+
+def _write_partposit(path, itime: int, particles: np.ndarray) -> None:
+    """A particle dump as partoutput.f90 writes it, from rows of release point, longitude, latitude and height."""
+    with open(path, "wb") as f:
+        _record(f, (itime, "<i4"))
+        for point, lon, lat, height in particles:
+            _record(f, (point, "<i4"), ((lon, lat, height), "<f4"), (-3600, "<i4"), ([500.] * 7, "<f4"),
+                    ([1e-3] * _NSPEC, "<f4"))
+        _record(f, (-99999, "<i4"), ([-9999.9] * 3, "<f4"), (-99999, "<i4"), ([-9999.9] * (7 + _NSPEC), "<f4"))
+
+
+def _config(**kwargs) -> ParticleDumpConfig:
+    return ParticleDumpConfig(**{"chunk_size": 3, "complevel": 5, "bbox": None, "interval": None, **kwargs})
+
+
+@pytest.fixture
+def particles() -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return np.column_stack([np.arange(10) % 2 + 1, rng.uniform(0., 20., 10), rng.uniform(40., 50., 10),
+                            rng.uniform(0., 3000., 10)])
+
+
+def test_convert_partposit(tmp_path, particles):
+    _write_partposit(tmp_path / "partposit_20241210030000", 10800, particles)
+
+    store = convert_partposit(tmp_path / "partposit_20241210030000", tmp_path / "partposit.zarr", _config())
+
+    root = zarr.open_group(store, mode="r")
+    assert root.attrs["itime"] == 10800
+    assert root["release_point"][:].tolist() == particles[:, 0].astype(int).tolist()
+    np.testing.assert_allclose(root["longitude"][:], particles[:, 1], rtol=1e-6)
+    np.testing.assert_allclose(root["height"][:], particles[:, 3], rtol=1e-6)
+    assert root["release_time"][:].tolist() == [-3600] * 10
+    assert root["mass"].shape == (10, _NSPEC)
+    assert root["temperature"].chunks == (3,)
+
+
+def test_convert_partposit_filters(tmp_path, particles):
+    _write_partposit(tmp_path / "partposit_20241210030000", 10800, particles)
+    bbox = [5., 42., 15., 48.]
+
+    store = convert_partposit(tmp_path / "partposit_20241210030000", tmp_path / "partposit.zarr", _config(bbox=bbox))
+
+    inside = ((particles[:, 1] >= 5.) & (particles[:, 1] <= 15.) & (particles[:, 2] >= 42.) & (particles[:, 2] <= 48.))
+    np.testing.assert_allclose(zarr.open_group(store, mode="r")["latitude"][:], particles[inside, 2], rtol=1e-6)
+    assert convert_partposit(tmp_path / "partposit_20241210030000", tmp_path / "skipped.zarr",
+                             _config(interval=7200)) is None
+    assert not (tmp_path / "skipped.zarr").exists()
+
+
+def test_convert_particle_dumps(tmp_path, particles):
+    for site in ("BEZ", "LEI"):
+        (tmp_path / site / "output").mkdir(parents=True)
+        _write_partposit(tmp_path / site / "output" / "partposit_20241210030000", 10800, particles)
+        _write_partposit(tmp_path / site / "output" / "partposit_20241210040000", 14400, particles)
+        # The averaged positions of IPOUT=3 are not dumps of the particle records.
+        (tmp_path / site / "output" / "partposit_average_20241210030000").write_bytes(b"\0" * 64)
+
+    stores = convert_particle_dumps(tmp_path, _config(interval=10800), max_workers=2)
+
+    assert stores == [tmp_path / site / "output" / "partposit_20241210030000.zarr" for site in ("BEZ", "LEI")]
+    # Converting again replaces the stores, which are not taken for dumps.
+    assert convert_particle_dumps(tmp_path, _config(interval=10800), max_workers=2) == stores
+
+
+def test_invalid_dump(tmp_path, particles):
+    path = tmp_path / "partposit_20241210030000"
+    _write_partposit(path, 10800, particles)
+    assert read_dump_time(path) == 10800
+
+    data = bytearray(path.read_bytes())
+    data[12 + 5 * (8 + 4 * (12 + _NSPEC))] = 0
+    path.write_bytes(bytes(data))
+    with pytest.raises(RuntimeError, match="record markers"):
+        convert_partposit(path, tmp_path / "partposit.zarr", _config())
@@ -0,0 +1,97 @@
+import shutil
+
+import numpy as np
+import pytest
+
+from flexpart_ifs_utils.config.service_settings import PlannerConfig
+from flexpart_ifs_utils.model import Model
+from flexpart_ifs_utils.planner import (RunStats, RunStatsStore,
+                                        fit_cost_model, plan_run, record_run,
+                                        released_particles)
+from flexpart_ifs_utils.prepare_flexpart import _configure_namelist
+from flexpart_ifs_utils.progress import Progress
+
+# Wall time of 20 s, 2 s per simulated hour, 1e-4 s per particle-hour and thread, and 1e-6 s serial
+_COEFFICIENTS = [20., 2., 1e-4, 1e-6]
+
+
+def _wall_time(particles: int, hours: float, threads: int) -> float:
+    c0, c1, c2, c3 = _COEFFICIENTS
+    return c0 + c1 * hours + c2 * particles * hours / threads + c3 * particles * hours
+
+
+def _config(tmp_path, **kwargs) -> PlannerConfig:
+    settings = {"stats_path": str(tmp_path / "stats.sqlite"), "deadline": 200., "thread_counts": [8, 16],
+                "min_particles": 10000, "max_particles": 1000000, "min_runs": 4, "max_runs": 100}
+    return PlannerConfig(**(settings | kwargs))
+
+
+@pytest.fixture
+def history(tmp_path) -> PlannerConfig:
+    """Runs of IFS-Europe following the cost model, and a run of IFS-Global which is not used."""
+    config = _config(tmp_path)
+    store = RunStatsStore(tmp_path / "stats.sqlite")
+    for particles, hours, threads in [(100000, 24, 8), (200000, 24, 16), (200000, 48, 8), (50000, 12, 16),
+                                      (400000, 6, 8)]:
+        store.add(RunStats(site="BEZ", model=Model.IFS_HRES_EUROPE, particles=particles, simulated_hours=hours,
+                           threads=threads, wall_time=_wall_time(particles, hours, threads)))
+    store.add(RunStats(site="BEZ", model=Model.IFS_HRES, particles=1, simulated_hours=1, threads=1, wall_time=1e6))
+    return config
+
+
+def test_fit_cost_model(history, tmp_path):
+    runs = RunStatsStore(tmp_path / "stats.sqlite").runs(Model.IFS_HRES_EUROPE)
+
+    assert len(runs) == 5
+    assert np.allclose(fit_cost_model(runs), _COEFFICIENTS)
+
+
+def test_plan_run(history):
+    plan = plan_run(Model.IFS_HRES_EUROPE, 24, history)
+
+    assert plan is not None
+    assert plan.threads == 16
+    assert plan.predicted_wall_time <= history.deadline
+    # The next multiple of 1000 particles misses the deadline.
+    assert _wall_time(plan.particles + 1000, 24, 16) > history.deadline
+    assert plan.predicted_wall_time == pytest.approx(_wall_time(plan.particles, 24, 16))
+
+
+def test_plan_run_mpi(history):
+    plan = plan_run(Model.IFS_HRES_EUROPE, 24, history, ranks=2)
+
+    assert plan is not None
+    # The threads of each of the two ranks
+    assert plan.threads == 16
+    assert plan.predicted_wall_time == pytest.approx(_wall_time(plan.particles, 24, 32))
+    assert plan.particles > plan_run(Model.IFS_HRES_EUROPE, 24, history).particles
+
+
+def test_plan_run_bounds(history):
+    # Both thread counts reach the maximum, the fewest threads are planned.
+    plan = plan_run(Model.IFS_HRES_EUROPE, 1, history)
+    assert (plan.particles, plan.threads) == (history.max_particles, 8)
+    assert plan_run(Model.IFS_HRES_EUROPE, 1000, history).particles == history.min_particles
+
+
+def test_plan_run_without_history(history, tmp_path):
+    assert plan_run(Model.IFS_HRES, 24, history) is None
+    assert plan_run(Model.IFS_HRES_EUROPE, 24, _config(tmp_path, min_runs=6)) is None
+
+
+def test_record_run(tmp_path, references):
+    job_dir = tmp_path / "BEZ"
+    shutil.copytree(references / "BEZ", job_dir)
+    _configure_namelist({"releases": {"PARTS": 123000}}, job_dir / "input" / "RELEASES")
+    config = _config(tmp_path)
+    progress = Progress(total_seconds=5 * 3600, num_threads=16, wall_time=321., completed=True, returncode=0)
+
+    stats = record_run(job_dir, progress, config)
+
+    assert released_particles(job_dir / "input" / "RELEASES") == 123000
+    assert stats == RunStats(site="BEZ", model=Model.IFS_HRES_EUROPE, particles=123000, simulated_hours=5.,
+                             threads=16, wall_time=321.)
+    assert RunStatsStore(tmp_path / "stats.sqlite").runs(Model.IFS_HRES_EUROPE) == [stats]
+    assert record_run(job_dir, progress.model_copy(update={"completed": False}), config) is None
+    # The threads of all the ranks of FLEXPART_MPI
+    assert record_run(job_dir, progress.model_copy(update={"num_ranks": 2}), config).threads == 32
@@ -0,0 +1,78 @@
+import netCDF4
+import numpy as np
+import pytest
+
+from flexpart_ifs_utils import postprocess
+from flexpart_ifs_utils.config.service_settings import CompressionConfig
+from flexpart_ifs_utils.postprocess import compress_netcdf, postprocess_output
+
+
+@pytest.fixture
+def compression() -> CompressionConfig:
+    return CompressionConfig(compression="zlib", complevel=4, time_chunk=2, spatial_chunk=16,
+                             significant_digits=None)
+
+
+def test_compress_netcdf(tmp_path, grid_conc_factory, compression):
+    path = grid_conc_factory(tmp_path / "grid_conc_20241210000000.nc")
+    with netCDF4.Dataset(path) as ds:
+        expected = ds["spec001_mr"][:]
+        expected_time = ds["time"][:]
+
+    compress_netcdf(path, compression)
+
+    with netCDF4.Dataset(path) as ds:
+        conc = ds["spec001_mr"]
+        assert conc.chunking() == [1, 1, 2, 1, 16, 16]
+        assert conc.filters()["zlib"] and conc.filters()["complevel"] == 4
+        assert conc.units == "ng m-3"
+        assert ds["WD_spec001"].chunking() == [1, 1, 2, 16, 16]
+        assert ds.dimensions["time"].isunlimited()
+        assert ds.title == "FLEXPART MODEL OUTPUT"
+        np.testing.assert_array_equal(conc[:], expected)
+        np.testing.assert_array_equal(ds["time"][:], expected_time)
+
+    assert not path.with_name(path.name + ".tmp").exists()
+
+
+def test_compress_netcdf_failure(tmp_path, grid_conc_factory, compression, monkeypatch):
+    path = grid_conc_factory(tmp_path / "grid_conc_20241210000000.nc")
+    original = path.read_bytes()
+
+    def fail(*_):
+        raise RuntimeError("disk full")
+
+    monkeypatch.setattr(postprocess, "_copy_variable", fail)
+    with pytest.raises(RuntimeError, match="disk full"):
+        compress_netcdf(path, compression)
+
+    # The partial file is removed, so that it is not uploaded with the output.
+    assert sorted(tmp_path.iterdir()) == [path]
+    assert path.read_bytes() == original
+
+
+def test_compress_netcdf_quantization(tmp_path, grid_conc_factory, compression):
+    path = grid_conc_factory(tmp_path / "grid_conc_20241210000000.nc")
+    with netCDF4.Dataset(path) as ds:
+        expected = ds["spec001_mr"][:]
+        expected_oro = ds["ORO"][:]
+
+    compression.significant_digits = 3
+    compress_netcdf(path, compression)
+
+    with netCDF4.Dataset(path) as ds:
+        np.testing.assert_allclose(ds["spec001_mr"][:], expected, rtol=1e-3)
+        np.testing.assert_array_equal(ds["ORO"][:], expected_oro)
+
+
+def test_postprocess_output(tmp_path, grid_conc_factory, compression):
+    for site in ("BEZ", "LEI"):
+        (tmp_path / site / "output").mkdir(parents=True)
+        grid_conc_factory(tmp_path / site / "output" / "grid_conc_20241210000000.nc")
+
+    processed = postprocess_output(tmp_path, compression, max_workers=2)
+
+    assert {p.parent.parent.name for p in processed} == {"BEZ", "LEI"}
+    for path in processed:
+        with netCDF4.Dataset(path) as ds:
+            assert ds["spec001_mr"].chunking() == [1, 1, 2, 1, 16, 16]
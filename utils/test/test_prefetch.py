@@ -0,0 +1,141 @@
+import json
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+from flexpart_ifs_utils import CONFIG, prefetch as prefetch_module
+from flexpart_ifs_utils.config.service_settings import PrefetchConfig
+from flexpart_ifs_utils.manifest import build_manifest, upload_manifest
+from flexpart_ifs_utils.prefetch import (_Throttle, link_cached, prefetch,
+                                         prefetch_cycle)
+from flexpart_ifs_utils.timing import phase
+
+_CYCLE = datetime(2024, 12, 10, 12)
+
+
+@pytest.fixture
+def grib_files(model_data: Path) -> list[Path]:
+    return [path for path in sorted(model_data.iterdir()) if not path.name.startswith(".")][:4]
+
+
+def _config(tmp_path: Path, max_disk_usage: int | None = None) -> PrefetchConfig:
+    return PrefetchConfig(cache_dir=str(tmp_path / "cache"), poll_interval=0., max_bandwidth=None,
+                          max_disk_usage=max_disk_usage)
+
+
+def _put_cycle(s3, cycle: datetime, paths: list[Path], steps: range | None = None) -> list[str]:
+    """Put the files as the steps of cycle in the input bucket, in reverse order, and return their keys by step."""
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    keys = []
+    for step, path in reversed(list(zip(steps or range(len(paths)), paths))):
+        key = f"{cycle:%Y%m%d_%H}/EUROPE/dispf{cycle + timedelta(hours=step):%y%m%d%H}"
+        data = {"date": f"{cycle:%Y%m%d}", "time": f"{cycle:%H%M}", "step": str(step), "domain": "EUROPE"}
+        s3.put_object(Bucket=bucket.name, Key=key, Body=path.read_bytes(), Metadata={"data": json.dumps(data)})
+        keys.insert(0, key)
+    return keys
+
+
+def test_prefetch_cycle(s3, grib_files, tmp_path):
+    config = _config(tmp_path)
+    keys = _put_cycle(s3, _CYCLE, grib_files[:2])
+
+    assert prefetch_cycle(config) == keys
+    # Steps arriving later are prefetched by the next poll.
+    keys += _put_cycle(s3, _CYCLE, grib_files[2:], range(2, len(grib_files)))
+    assert prefetch_cycle(config) == keys[2:]
+    assert prefetch_cycle(config) == []
+
+    for key, path in zip(keys, grib_files):
+        assert (tmp_path / "cache" / key).read_bytes() == path.read_bytes()
+    assert not list((tmp_path / "cache").rglob(".*"))
+
+
+def test_prefetch_follows_latest_cycle(s3, grib_files, tmp_path):
+    config = _config(tmp_path)
+    _put_cycle(s3, _CYCLE - timedelta(hours=12), grib_files[:2])
+    keys = _put_cycle(s3, _CYCLE, grib_files[:2])
+
+    prefetch(config, once=True)
+
+    assert sorted(path.relative_to(tmp_path / "cache").as_posix()
+                  for path in (tmp_path / "cache").rglob("dispf*")) == keys
+
+
+def test_prefetch_cycle_lists_latest_cycle_only(s3, grib_files, tmp_path, monkeypatch):
+    _put_cycle(s3, _CYCLE - timedelta(hours=12), grib_files[:2])
+    keys = _put_cycle(s3, _CYCLE, grib_files[:2])
+    prefixes = []
+    list_objs_in_bucket = prefetch_module.list_objs_in_bucket
+
+    def listing(*args, prefix: str = "", **kwargs):
+        prefixes.append(prefix)
+        return list_objs_in_bucket(*args, prefix=prefix, **kwargs)
+
+    monkeypatch.setattr(prefetch_module, "list_objs_in_bucket", listing)
+
+    assert prefetch_cycle(_config(tmp_path)) == keys
+    # Without a manifest, only the objects under the prefix of the latest cycle are listed and read.
+    assert prefixes == [f"{_CYCLE:%Y%m%d_%H}/"]
+
+
+def test_prefetch_cycle_from_manifest(s3, grib_files, tmp_path):
+    keys = _put_cycle(s3, _CYCLE, grib_files)
+    manifest = build_manifest(_CYCLE, f"{_CYCLE:%Y%m%d_%H}/")
+    upload_manifest(manifest)
+
+    with phase("test_prefetch") as timing:
+        downloaded = prefetch_cycle(_config(tmp_path), _CYCLE)
+
+    assert downloaded == keys
+    # The manifest and the objects are read with one GET each, the bucket is not listed.
+    assert timing.requests == 1 + len(keys)
+
+
+def test_prefetch_cycle_evicts_older_cycles(s3, grib_files, tmp_path, monkeypatch):
+    size = grib_files[0].stat().st_size
+    old = tmp_path / "cache" / "20241210_00" / "EUROPE" / "dispf24121000"
+    old.parent.mkdir(parents=True)
+    old.write_bytes(b"\0" * size)
+    os.utime(old, (0, 0))
+    keys = _put_cycle(s3, _CYCLE, [grib_files[0]] * 3)
+    walks = []
+    rglob = Path.rglob
+    monkeypatch.setattr(Path, "rglob", lambda self, pattern: walks.append(self) or rglob(self, pattern))
+
+    downloaded = prefetch_cycle(_config(tmp_path, max_disk_usage=2 * size), _CYCLE)
+
+    # The file of the older cycle is removed first, and the cache is full once two files of the cycle are cached.
+    assert not old.exists()
+    assert downloaded == keys[:2]
+    # The cache is walked once per poll, not before every download.
+    assert walks == [tmp_path / "cache"]
+
+
+def test_throttle(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(prefetch_module.time, "monotonic", lambda: 0.)
+    monkeypatch.setattr(prefetch_module.time, "sleep", sleeps.append)
+
+    throttle = _Throttle(max_bandwidth=1000)
+    throttle.downloaded(500)
+    throttle.downloaded(1500)
+    _Throttle(max_bandwidth=None).downloaded(10 ** 9)
+
+    assert sleeps == [0.5, 2.]
+
+
+def test_link_cached(tmp_path):
+    cache_dir, data_dir = tmp_path / "cache", tmp_path / "data"
+    cached = cache_dir / "20241210_12" / "EUROPE" / "dispf24121013"
+    cached.parent.mkdir(parents=True)
+    cached.write_bytes(b"GRIB")
+    data_dir.mkdir()
+
+    missing = link_cached(["20241210_12/EUROPE/dispf24121013", "20241210_12/EUROPE/dispf24121014"], data_dir,
+                          cache_dir)
+
+    assert missing == ["20241210_12/EUROPE/dispf24121014"]
+    assert (data_dir / "dispf24121013").stat().st_ino == cached.stat().st_ino
+    assert not (data_dir / "dispf24121014").exists()
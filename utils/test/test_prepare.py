@@ -1,5 +1,7 @@
+import json
 import os
 import shutil
+import subprocess
 from datetime import datetime
 from pathlib import Path
 from unittest.mock import patch
@@ -7,19 +9,26 @@ from unittest.mock import patch
 import pytest
 import yaml
 
+from flexpart_ifs_utils.catalogue import GribCatalogue
+from flexpart_ifs_utils.config.service_settings import MPIConfig, OpenMPConfig
 from flexpart_ifs_utils.grib_utils import GribMetadata
 from flexpart_ifs_utils.model import Model
-from flexpart_ifs_utils.prepare_flexpart import (_configure_namelist,
+from flexpart_ifs_utils.prepare_flexpart import (OutputGrid,
+                                                 _configure_namelist,
                                                  _filter_config,
                                                  _generate_available,
                                                  _get_start_end,
                                                  _get_valid_datetime,
                                                  _write_job_script,
+                                                 _write_outgrid,
+                                                 flexpart_executable,
                                                  prepare_job_directory,
-                                                 render_template, select_files)
+                                                 read_outgrid, render_template,
+                                                 select_files)
 
 MOCK_MD_EXTRACTION = "flexpart_ifs_utils.grib_utils.extract_metadata_from_grib_file"
 MOCK_LIST_OBJS_IN_BUCKET = "flexpart_ifs_utils.prepare_flexpart.list_objs_in_bucket"
+MOCK_READ_MANIFEST = "flexpart_ifs_utils.prepare_flexpart.read_manifest"
 
 @pytest.fixture
 def mock_logger(mocker):
@@ -101,6 +110,51 @@ def test_write_job_script(tmp_path, mock_config):
         assert f"export {i[1:]}={data[i[1:].lower()]}" in job.read_text()
 
 
+@pytest.mark.parametrize("launcher, binding, expected", [
+    ("mpirun", "socket", "mpirun -n $FLEXPART_MPI_RANKS --bind-to socket $FLEXPART_EXE -vvv"),
+    ("mpirun", None, "mpirun -n $FLEXPART_MPI_RANKS $FLEXPART_EXE -vvv"),
+    ("srun", "cores", "srun --ntasks=$FLEXPART_MPI_RANKS --cpus-per-task=4 --cpu-bind=cores $FLEXPART_EXE -vvv"),
+])
+def test_write_job_script_mpi(tmp_path, launcher, binding, expected):
+    openmp_config = OpenMPConfig(num_threads=4, stack_size="100M",
+                                 mpi=MPIConfig(ranks=3, launcher=launcher, binding=binding))
+
+    _write_job_script(tmp_path / "job", flexpart_executable(tmp_path, openmp_config), openmp_config)
+
+    lines = (tmp_path / "job").read_text().splitlines()
+    assert f"export FLEXPART_EXE={tmp_path / 'bin' / 'FLEXPART_MPI'}" in lines
+    assert "export FLEXPART_MPI_RANKS=3" in lines
+    assert "export OMP_NUM_THREADS=4" in lines
+    assert lines[-1] == expected
+
+
+def test_write_job_script_unknown_launcher(tmp_path):
+    openmp_config = OpenMPConfig(num_threads=4, stack_size="100M",
+                                 mpi=MPIConfig(ranks=3, launcher="aprun", binding=None))
+
+    with pytest.raises(RuntimeError, match="aprun"):
+        _write_job_script(tmp_path / "job", tmp_path / "FLEXPART_MPI", openmp_config)
+
+
+@pytest.mark.skipif(shutil.which("mpirun") is None, reason="mpirun is not installed")
+def test_job_script_mpirun(tmp_path, monkeypatch):
+    # A stand-in for FLEXPART_MPI printing its rank and threads, run by two ranks on this node
+    flexpart_exe = tmp_path / "bin" / "FLEXPART_MPI"
+    flexpart_exe.parent.mkdir()
+    flexpart_exe.write_text('#!/bin/bash\necho "rank $OMPI_COMM_WORLD_RANK threads $OMP_NUM_THREADS"\n')
+    flexpart_exe.chmod(0o755)
+    openmp_config = OpenMPConfig(num_threads=2, stack_size="100M",
+                                 mpi=MPIConfig(ranks=2, launcher="mpirun", binding="none"))
+    _write_job_script(tmp_path / "job", flexpart_executable(tmp_path, openmp_config), openmp_config)
+    monkeypatch.setenv("OMPI_ALLOW_RUN_AS_ROOT", "1")
+    monkeypatch.setenv("OMPI_ALLOW_RUN_AS_ROOT_CONFIRM", "1")
+    monkeypatch.setenv("OMPI_MCA_rmaps_base_oversubscribe", "1")
+
+    result = subprocess.run(["bash", tmp_path / "job"], capture_output=True, text=True, check=True, timeout=60)
+
+    assert sorted(result.stdout.splitlines()) == ["rank 0 threads 2", "rank 1 threads 2"]
+
+
 def test_generate_available(tmp_path):
 
     def side_effect(arg):
@@ -223,6 +277,18 @@ def test_prepare_job_directory(tmp_path: Path, references):
 
 
 
+def test_write_outgrid(tmp_path, references):
+    outgrid = tmp_path / "OUTGRID"
+    shutil.copyfile(references / 'BEZ/input' / "OUTGRID", outgrid)
+    grid = OutputGrid(outlon0=-32., outlat0=27.5, numxgrid=321, numygrid=161, dxout=0.25, dyout=0.25)
+
+    _write_outgrid(outgrid, grid)
+
+    assert read_outgrid(outgrid) == grid
+    assert "OUTHEIGHTS=500.,2000.,10000." in outgrid.read_text()
+    assert "! Geographical longitude of lower left corner" in outgrid.read_text()
+
+
 def test_configure_namelist(tmp_path, references):
     command_namelist: Path = references / 'BEZ/input' / "COMMAND"
     command_copy = tmp_path / command_namelist.name
@@ -290,12 +356,13 @@ def test_select_files(tmp_path, step_unit):
         str(tmp_path / "9000"),
     ]
 
-    with patch(MOCK_LIST_OBJS_IN_BUCKET, spec=True) as mock_list_bucket:
-        mock_list_bucket.return_value = {key: GribMetadata(
-            date = DATE,
-            time = TIME,
-            step = int(str(key).split('/')[-1][0])*multiplier,
-            ) for key in keys}
+    with patch(MOCK_LIST_OBJS_IN_BUCKET, spec=True) as mock_list_bucket, \
+            patch(MOCK_READ_MANIFEST, return_value=None):
+        mock_list_bucket.return_value = GribCatalogue.from_metadata((key, {"data": json.dumps({
+            "date": DATE,
+            "time": TIME,
+            "step": int(str(key).split('/')[-1][0])*multiplier,
+            })}) for key in keys)
         print(keys)
         subset = select_files(RUNTIME_CONF,
                             forecast_datetime=f"{DATE}{TIME}",
@@ -314,6 +381,48 @@ def test_select_files(tmp_path, step_unit):
         assert len(subset) == 6
         assert set(subset) == expected
 
+@pytest.mark.parametrize("forecast_datetime", ["2024050112", "202405011200"])
+def test_select_files_latest_cycle(forecast_datetime):
+    """The files of the cycle of the forecast datetime are selected, not those of the earlier cycle."""
+    runtime_conf = {"IBDATE": "20240501", "IBTIME": 140000, "IEDATE": "20240501", "IETIME": 160000}
+    listing = GribCatalogue.from_records(
+        (f"20240501_{time[:2]}/step{step:02}", {"date": "20240501", "time": time, "step": step})
+        for time in ("0000", "1200") for step in range(19)
+    )
+
+    with patch(MOCK_READ_MANIFEST, return_value=None), patch(MOCK_LIST_OBJS_IN_BUCKET, return_value=listing):
+        keys = select_files(runtime_conf, forecast_datetime=forecast_datetime, step_unit="hours",
+                            model=Model.IFS_HRES_EUROPE)
+
+    assert keys == [f"20240501_12/step{step:02}" for step in range(1, 5)]
+
+
+@pytest.mark.parametrize("forecast_datetime", ["2024050112", "202405011200"])
+@pytest.mark.parametrize("manifest_steps, listed", [(range(0, 9), False), (range(2, 9), True)])
+def test_select_files_from_manifest(manifest_steps, listed, forecast_datetime):
+    """
+    The manifest of the cycle is used if it covers the simulation, from the field before its start, otherwise
+    the bucket is listed.
+    """
+    runtime_conf = {"IBDATE": "20240501", "IBTIME": 140000, "IEDATE": "20240501", "IETIME": 180000}
+    manifest = GribCatalogue.from_records(
+        (f"20240501_12/dispf240501{12 + step:02}", {"date": "20240501", "time": "1200", "step": step})
+        for step in manifest_steps
+    )
+    listing = GribCatalogue.from_records(
+        (f"listed/dispf240501{12 + step:02}", {"date": "20240501", "time": "1200", "step": step}) for step in range(9)
+    )
+
+    with patch(MOCK_READ_MANIFEST, return_value=manifest) as mock_read_manifest, \
+            patch(MOCK_LIST_OBJS_IN_BUCKET, return_value=listing) as mock_list_bucket:
+        keys = select_files(runtime_conf, forecast_datetime=forecast_datetime, step_unit="hours",
+                            model=Model.IFS_HRES_EUROPE)
+
+    mock_read_manifest.assert_called_once_with(datetime(2024, 5, 1, 12))
+    assert mock_list_bucket.called == listed
+    assert keys == [f"{'listed' if listed else '20240501_12'}/dispf240501{hour}" for hour in range(13, 19)]
+
+
 def test_get_start_end():
     config = {"IBDATE": "20230101", "IBTIME": 120000, "IEDATE": "20230201", "IETIME": 220000}
 
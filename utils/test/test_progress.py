@@ -0,0 +1,106 @@
+import json
+
+import pytest
+
+from flexpart_ifs_utils.progress import (PROGRESS_FILE, _simulation_length,
+                                         parse_progress_line, run_job)
+
+_COMMAND = """&COMMAND
+ LDIRECT=               1,
+ IBDATE=         20241210,
+ IBTIME=           000000,
+ IEDATE=         20241210,
+ IETIME=           030000,
+ /
+"""
+
+
+@pytest.fixture
+def job_dir(tmp_path):
+    (tmp_path / "input").mkdir()
+    (tmp_path / "input" / "COMMAND").write_text(_COMMAND, encoding="utf-8")
+    return tmp_path
+
+
+def _write_job(job_dir, body):
+    (job_dir / "job").write_text(f"#!/bin/bash\nexport OMP_NUM_THREADS=4\n\n{body}", encoding="utf-8")
+
+
+@pytest.mark.parametrize("line, expected", [
+    ("         3600 Seconds simulated:         12000 Particles:    Uncertainty:   0.000  0.000  0.000", (3600, 12000)),
+    (" Simulated     1.0 hours (         3600 s),         12000 particles", (3600, 12000)),
+    ("         3600 SECONDS SIMULATED:         12000 PARTICLES:    Uncertainty:   0.000  0.000  0.000", (3600, 12000)),
+    ("        -7200 Seconds simulated:           500 Particles:    Uncertainty:   0.000  0.000  0.000", (7200, 500)),
+    (" timemanager> SYSTEM CLOCK   12.3450000", None),
+    ("Read wind fields: DONE", None),
+])
+def test_parse_progress_line(line, expected):
+    assert parse_progress_line(line) == expected
+
+
+def test_simulation_length(job_dir):
+    assert _simulation_length(job_dir / "input" / "COMMAND") == 3 * 3600
+
+
+def test_run_job(job_dir, capsys):
+    _write_job(job_dir, "\n".join([
+        "echo ' Simulated     0.0 hours (            0 s),             0 particles'",
+        "echo ' timemanager> SYSTEM CLOCK   0.1'",
+        "sleep 0.1",
+        "echo '         3600 Seconds simulated:          1000 Particles:    Uncertainty:   0.000  0.000  0.000'",
+        "sleep 0.1",
+        "echo '         7200 Seconds simulated:          2000 Particles:    Uncertainty:   0.000  0.000  0.000'",
+        "echo 'CONGRATULATIONS: YOU HAVE SUCCESSFULLY COMPLETED A FLEXPART MODEL RUN!'",
+    ]))
+
+    progress = run_job(job_dir)
+
+    assert "SYSTEM CLOCK" in capsys.readouterr().out
+    assert progress.returncode == 0
+    assert progress.completed
+    assert progress.num_threads == 4
+    assert progress.num_ranks is None
+    assert progress.total_seconds == 10800
+    assert [step.simulated_seconds for step in progress.steps] == [0, 3600, 7200]
+    assert progress.particles == 2000
+    assert progress.simulated_hours_per_wall_second > 0
+    # A third of the simulation remains, at the throughput since the first progress line
+    stepping_time = progress.steps[-1].wall_time - progress.steps[0].wall_time
+    assert progress.eta_seconds == pytest.approx(stepping_time / 2)
+
+    written = json.loads((job_dir / PROGRESS_FILE).read_text(encoding="utf-8"))
+    assert written["completed"]
+    assert len(written["steps"]) == 3
+
+
+def test_run_job_mpi(job_dir):
+    """The progress lines of FLEXPART_MPI, written by timemanager_mpi.f90 in upper case."""
+    _write_job(job_dir, "\n".join([
+        "export FLEXPART_MPI_RANKS=2",
+        "echo ' Simulated     0.0 hours (            0 s),             0 particles'",
+        "sleep 0.1",
+        "echo '         3600 SECONDS SIMULATED:          1000 PARTICLES:    Uncertainty:   0.000  0.000  0.000'",
+        "sleep 0.1",
+        "echo '         7200 SECONDS SIMULATED:          2000 PARTICLES:    Uncertainty:   0.000  0.000  0.000'",
+        "echo 'CONGRATULATIONS: YOU HAVE SUCCESSFULLY COMPLETED A FLEXPART MODEL RUN!'",
+    ]))
+
+    progress = run_job(job_dir)
+
+    assert progress.completed
+    assert progress.num_ranks == 2
+    assert [step.simulated_seconds for step in progress.steps] == [0, 3600, 7200]
+    assert progress.particles == 2000
+    assert progress.simulated_hours_per_wall_second > 0
+    stepping_time = progress.steps[-1].wall_time - progress.steps[0].wall_time
+    assert progress.eta_seconds == pytest.approx(stepping_time / 2)
+
+
+def test_run_job_failure(job_dir):
+    _write_job(job_dir, "echo 'Reading input'\nexit 3\n")
+
+    progress = run_job(job_dir)
+
+    assert progress.returncode == 3
+    assert not progress.completed
+    assert not progress.steps
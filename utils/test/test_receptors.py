@@ -0,0 +1,90 @@
+import csv
+import os
+from pathlib import Path
+
+import netCDF4
+import numpy as np
+import pytest
+
+from flexpart_ifs_utils.config.service_settings import ReceptorsConfig
+from flexpart_ifs_utils.receptors import (Receptor, bilinear_weights,
+                                          extract_receptors,
+                                          extract_receptors_from_file,
+                                          read_receptors)
+
+# On the grid node of index (3, 2), halfway between the nodes (5, 4) to (6, 5), and outside the grid
+_RECEPTORS = [
+    Receptor(name="node", longitude=-9.7, latitude=35.2),
+    Receptor(name="centre", longitude=-9.45, latitude=35.45),
+    Receptor(name="outside", longitude=20., latitude=35.2),
+]
+
+
+def test_read_receptors(tmp_path):
+    options = Path(os.environ['FLEXPART_PREFIX']) / "share" / "options" / "RECEPTORS"
+    csv_path = tmp_path / "receptors.csv"
+    csv_path.write_text("name,longitude,latitude\nZurich,8.54,47.37\nBern,7.45,46.95\n", encoding="utf-8")
+
+    assert read_receptors(options)[:2] == [Receptor(name="receptor 1", longitude=0., latitude=0.),
+                                           Receptor(name="receptor 2", longitude=1., latitude=0.)]
+    assert [r.name for r in read_receptors(csv_path)] == ["Zurich", "Bern"]
+
+
+def test_bilinear_weights():
+    longitude, latitude = -10. + 0.1 * np.arange(40), 35. + 0.1 * np.arange(30)
+    field = np.add.outer(2. * latitude, longitude)
+
+    values = bilinear_weights(_RECEPTORS, longitude, latitude).apply(field[np.newaxis])
+
+    # A linear field is interpolated exactly.
+    assert values[0, :2] == pytest.approx([2. * 35.2 - 9.7, 2. * 35.45 - 9.45])
+    assert np.isnan(values[0, 2])
+
+
+def test_bilinear_weights_single_row():
+    """Receptors on a grid of a single row are interpolated along the row, or outside it."""
+    longitude, latitude = -10. + 0.1 * np.arange(40), np.array([35.2])
+    field = np.add.outer(2. * latitude, longitude)
+    receptors = [Receptor(name="row", longitude=-9.45, latitude=35.2),
+                 Receptor(name="off", longitude=-9.45, latitude=35.3)]
+
+    values = bilinear_weights(receptors, longitude, latitude).apply(field[np.newaxis])
+
+    assert values[0, 0] == pytest.approx(2. * 35.2 - 9.45)
+    assert np.isnan(values[0, 1])
+
+
+def test_extract_receptors_from_file(tmp_path, grid_conc_factory):
+    path = grid_conc_factory(tmp_path / "grid_conc_20241210000000.nc")
+
+    out_path = extract_receptors_from_file(path, _RECEPTORS, time_chunk=2)
+
+    with open(out_path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    with netCDF4.Dataset(path) as ds:
+        conc = ds["spec001_mr"][0, 0]
+        wet = ds["WD_spec001"][0, 0]
+    assert out_path.name == "receptors_20241210000000.csv"
+    assert len(rows) == len(_RECEPTORS) * 5
+    assert [row["time"] for row in rows[:2]] == ["2024-12-10T03:00:00Z", "2024-12-10T06:00:00Z"]
+    node = [row for row in rows if row["receptor"] == "node"]
+    assert [float(row["spec001_mr_500m"]) for row in node] == pytest.approx(conc[:, 0, 2, 3], rel=1e-5)
+    assert [float(row["spec001_mr_10000m"]) for row in node] == pytest.approx(conc[:, 2, 2, 3], rel=1e-5)
+    centre = [row for row in rows if row["receptor"] == "centre"]
+    assert [float(row["WD_spec001"]) for row in centre] == pytest.approx(wet[:, 4:6, 5:7].mean(axis=(1, 2)),
+                                                                         rel=1e-5)
+    assert all(row["spec001_mr_500m"] == "" for row in rows if row["receptor"] == "outside")
+
+
+def test_extract_receptors(tmp_path, grid_conc_factory):
+    for site in ("BEZ", "LEI"):
+        (tmp_path / site / "output").mkdir(parents=True)
+        grid_conc_factory(tmp_path / site / "output" / "grid_conc_20241210000000.nc")
+    receptors_path = tmp_path / "receptors.csv"
+    receptors_path.write_text("name,longitude,latitude\nnode,-9.7,35.2\n", encoding="utf-8")
+    config = ReceptorsConfig(path=str(receptors_path), sites=["BEZ"], time_chunk=4)
+
+    out_paths = extract_receptors(tmp_path, config, max_workers=1)
+
+    assert out_paths == [tmp_path / "BEZ" / "output" / "receptors_20241210000000.csv"]
+    assert not (tmp_path / "LEI" / "output" / "receptors_20241210000000.csv").exists()
@@ -0,0 +1,90 @@
+import logging
+
+import numpy as np
+import pytest
+from eccodes import (codes_get_long, codes_get_message, codes_get_string,
+                     codes_get_values, codes_grib_new_from_file,
+                     codes_grib_new_from_samples, codes_release, codes_set,
+                     codes_set_string, codes_set_values)
+
+from flexpart_ifs_utils.config.service_settings import RepackConfig
+from flexpart_ifs_utils.grib_utils import check_grib_framing
+from flexpart_ifs_utils.repack import repack_grib_file, repack_input
+
+_VALUES = 280. + 10. * np.sin(np.linspace(0., 20., 16 * 31))
+
+
+def _message(sample: str, packing_type: str = "grid_simple") -> bytes:
+    gid = codes_grib_new_from_samples(sample)
+    codes_set(gid, "bitsPerValue", 16)
+    codes_set_string(gid, "packingType", packing_type)
+    codes_set_values(gid, _VALUES)
+    message = codes_get_message(gid)
+    codes_release(gid)
+    return message
+
+
+def _read(path) -> list[tuple[str, int, np.ndarray]]:
+    messages = []
+    with open(path, "rb") as f:
+        while (gid := codes_grib_new_from_file(f)) is not None:
+            messages.append(
+                (codes_get_string(gid, "packingType"), codes_get_long(gid, "bitsPerValue"), codes_get_values(gid))
+            )
+            codes_release(gid)
+    return messages
+
+
+@pytest.mark.parametrize("packing_type, expected_repacked", [
+    ("grid_ccsds", 1),
+    ("grid_simple", 1),
+    ("grid_second_order", 2),
+])
+def test_repack_grib_file(tmp_path, packing_type, expected_repacked):
+    path = tmp_path / "dispf24121000"
+    path.write_bytes(_message("regular_ll_sfc_grib2") + _message("regular_ll_pl_grib2", "grid_ccsds"))
+
+    n_repacked = repack_grib_file(path, packing_type)
+
+    assert n_repacked == expected_repacked
+    assert check_grib_framing(path) == 2
+    for actual_packing_type, bits_per_value, values in _read(path):
+        assert (actual_packing_type, bits_per_value) == (packing_type, 16)
+        assert np.allclose(values, _VALUES, atol=1e-3)
+
+
+def test_repack_grib_file_bits_per_value(tmp_path):
+    path = tmp_path / "dispf24121000"
+    path.write_bytes(_message("regular_ll_sfc_grib2", "grid_ccsds"))
+
+    repack_grib_file(path, "grid_simple", bits_per_value=24)
+
+    [(packing_type, bits_per_value, values)] = _read(path)
+    assert (packing_type, bits_per_value) == ("grid_simple", 24)
+    assert np.allclose(values, _VALUES, atol=1e-5)
+
+
+def test_repack_grib_file_unsupported(tmp_path, caplog):
+    """GRIB1 has no CCSDS packing, the message is kept in its packing."""
+    path = tmp_path / "dispc24121000"
+    path.write_bytes(_message("regular_ll_sfc_grib1") + _message("regular_ll_sfc_grib2"))
+
+    with caplog.at_level(logging.WARNING):
+        n_repacked = repack_grib_file(path, "grid_ccsds")
+
+    assert n_repacked == 1
+    assert [packing_type for packing_type, _, _ in _read(path)] == ["grid_simple", "grid_ccsds"]
+    assert "1 messages of" in caplog.text
+
+
+def test_repack_input(tmp_path):
+    paths = [tmp_path / f"dispf241210{hour:02}" for hour in range(4)]
+    for path in paths:
+        path.write_bytes(_message("regular_ll_sfc_grib2") * 3)
+    size_before = sum(path.stat().st_size for path in paths)
+
+    repack_input(paths, RepackConfig(packing_type="grid_ccsds", bits_per_value=None, max_workers=2))
+
+    assert sum(path.stat().st_size for path in paths) < size_before
+    assert all(packing_type == "grid_ccsds" for path in paths for packing_type, _, _ in _read(path))
+    assert not list(tmp_path.glob(".*.part"))
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import tempfile
 from pathlib import Path
@@ -7,10 +8,13 @@ import pytest
 
 from flexpart_ifs_utils import CONFIG
 from flexpart_ifs_utils.config.service_settings import Bucket
-from flexpart_ifs_utils.grib_utils import extract_metadata_from_grib_file
+from flexpart_ifs_utils import s3_utils
+from flexpart_ifs_utils.grib_utils import (_get_valid_datetime,
+                                           extract_metadata_from_grib_file)
+from flexpart_ifs_utils.timing import phase
 from flexpart_ifs_utils.s3_utils import (download_keys_from_bucket,
                                          list_objs_in_bucket,
-                                         upload_output)
+                                         upload_output, upload_store)
 
 
 def test_list_objs_in_bucket(s3, model_data: Path):
@@ -33,7 +37,25 @@ def test_list_objs_in_bucket(s3, model_data: Path):
 
     # Validate the results
     assert len(result) == 2*len(path_list)
-    assert {k for k in result} == {str(path) for path in path_list} | {f"{path}_c" for path in path_list}
+    assert set(result.keys) == {str(path) for path in path_list} | {f"{path}_c" for path in path_list}
+
+
+def test_list_objs_in_bucket_without_metadata(s3, model_data: Path):
+    """Objects of other producers are catalogued from the headers of their first GRIB message."""
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    path_list = sorted(model_data.iterdir())[:2]
+    _add_files_to_bucket(bucket, path_list, s3)
+    s3.put_object(Bucket=bucket.name, Key="README", Body=b"Not a GRIB file")
+
+    with phase("test_list") as timing:
+        result = list_objs_in_bucket(datetime(2024, 12, 10), datetime(2024, 12, 11), bucket=bucket)
+
+    assert sorted(result.keys) == [path.name for path in path_list]
+    # One HEAD and one ranged GET of the headers per object
+    assert timing.requests == 1 + 2 * (len(path_list) + 1)
+    for path, valid_time in zip(result.keys, result.valid_times("hours")):
+        metadata = extract_metadata_from_grib_file(model_data / path)
+        assert valid_time == _get_valid_datetime(model_data / path, metadata)
 
 
 def test_download_keys_from_bucket(s3, model_data: Path):
@@ -45,9 +67,13 @@ def test_download_keys_from_bucket(s3, model_data: Path):
     _add_files_to_bucket(bucket, path_list, s3)
 
     # Use a temporary directory to download files
-    with tempfile.TemporaryDirectory() as tmpdirname:
+    with tempfile.TemporaryDirectory() as tmpdirname, phase("test_download") as timing:
         download_keys_from_bucket([str(f.name) for f in path_list], Path(tmpdirname), bucket)
 
+        assert timing.objects == len(path_list)
+        assert timing.bytes == sum(f.stat().st_size for f in path_list)
+        assert timing.requests >= len(path_list)
+
         # Verify that all files are downloaded
         files_downloaded = [f.name for f in Path(tmpdirname).iterdir()]
         assert len(path_list) == len(files_downloaded)
@@ -55,6 +81,34 @@ def test_download_keys_from_bucket(s3, model_data: Path):
             assert file.name in files_downloaded
 
 
+@pytest.mark.parametrize("metadata", [{}, {"sha256": "checksum"}])
+def test_download_keys_from_bucket_verifies_checksum(s3, model_data: Path, tmp_path, metadata):
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    path = next(model_data.iterdir())
+    data = path.read_bytes()
+    if metadata:
+        metadata["sha256"] = hashlib.sha256(data).hexdigest()
+    s3.put_object(Bucket=bucket.name, Key=path.name, Body=data, Metadata=metadata)
+
+    download_keys_from_bucket([path.name], tmp_path, bucket)
+    assert (tmp_path / path.name).read_bytes() == data
+
+    # An object whose content does not match its checksum is rejected, and not left in the directory.
+    s3.put_object(Bucket=bucket.name, Key="corrupt", Body=data[:-1] + b"8",
+                  Metadata={"sha256": hashlib.sha256(data).hexdigest()})
+    with pytest.raises(RuntimeError, match="sha256 checksum of corrupt"):
+        download_keys_from_bucket(["corrupt"], tmp_path, bucket)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [path.name]
+
+
+def test_download_keys_from_bucket_checks_grib_framing(s3, model_data: Path, tmp_path):
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    s3.put_object(Bucket=bucket.name, Key="truncated", Body=next(model_data.iterdir()).read_bytes()[:-100])
+
+    with pytest.raises(RuntimeError, match="truncated"):
+        download_keys_from_bucket(["truncated"], tmp_path, bucket)
+
+
 def test_upload_output(s3, model_data: Path):
 
     # given
@@ -75,6 +129,36 @@ def test_upload_output(s3, model_data: Path):
         with open(path, mode='rb') as f:
             assert actual == f.read()
 
+def test_keep_clients(monkeypatch):
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    assert s3_utils._create_s3_client(bucket) is not s3_utils._create_s3_client(bucket)
+
+    monkeypatch.setattr(s3_utils, "_clients", None)
+    s3_utils.keep_clients()
+
+    assert s3_utils._create_s3_client(bucket) is s3_utils._create_s3_client(CONFIG.main.aws.s3.output)
+    other_retries = bucket.model_copy(update={"retries": 1})
+    assert s3_utils._create_s3_client(bucket) is not s3_utils._create_s3_client(other_retries)
+
+
+def test_upload_store(s3, tmp_path: Path):
+
+    # given
+    bucket = CONFIG.main.aws.s3.output
+    store = tmp_path / "grid_conc_20240607120000.zarr"
+    (store / "spec001_mr").mkdir(parents=True)
+    (store / ".zmetadata").write_text("{}")
+    (store / "spec001_mr" / "0.0.0").write_bytes(b"chunk")
+
+    # when
+    upload_store(store, 'ABC', '2024060712', bucket)
+
+    # then
+    prefix = "20240607_12/ABC/grid_conc_20240607120000.zarr"
+    keys = {obj["Key"] for obj in s3.list_objects(Bucket = bucket.name)["Contents"]}
+    assert keys == {f"{prefix}/.zmetadata", f"{prefix}/spec001_mr/0.0.0"}
+    assert s3.get_object(Bucket = bucket.name, Key = f"{prefix}/spec001_mr/0.0.0")["Body"].read() == b"chunk"
+
 def _add_files_to_bucket(bucket: Bucket, files: list[Path], s3) -> None:
 
     for path in files:
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import os
+from datetime import datetime
+from unittest import mock
+
+import boto3
+import pytest
+from moto.server import ThreadedMotoServer
+
+from flexpart_ifs_utils import CONFIG
+from flexpart_ifs_utils.config.service_settings import TransferConfig
+from flexpart_ifs_utils.s3_async import (download_keys, list_objects_metadata,
+                                         map_bounded, upload_files)
+from flexpart_ifs_utils.s3_utils import (download_keys_from_bucket,
+                                         list_objs_in_bucket, upload_output)
+from flexpart_ifs_utils.timing import phase
+
+_S3_SERVER_HOST = "127.0.0.1"
+_S3_SERVER_PORT = 5557
+
+# Multipart upload parts must be at least 5 MiB, except for the last one
+_PART_SIZE = 5 * 1024 * 1024
+
+
+@pytest.fixture(scope="module")
+def s3_server():
+    server = ThreadedMotoServer(ip_address=_S3_SERVER_HOST, port=_S3_SERVER_PORT)
+    with mock.patch.dict(os.environ, {
+        "AWS_ENDPOINT_URL": f"http://{_S3_SERVER_HOST}:{_S3_SERVER_PORT}",
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_DEFAULT_REGION": "us-east-1",
+    }):
+        server.start()
+        try:
+            yield server
+        finally:
+            server.stop()
+
+
+@pytest.fixture
+def s3_client(s3_server):
+    client = boto3.Session().client("s3")
+    for bucket in (CONFIG.main.aws.s3.nwp_model_data, CONFIG.main.aws.s3.output):
+        client.create_bucket(Bucket=bucket.name)
+    yield client
+    for bucket in (CONFIG.main.aws.s3.nwp_model_data, CONFIG.main.aws.s3.output):
+        for obj in client.list_objects_v2(Bucket=bucket.name).get("Contents", []):
+            client.delete_object(Bucket=bucket.name, Key=obj["Key"])
+        client.delete_bucket(Bucket=bucket.name)
+
+
+@pytest.fixture
+def transfer():
+    return TransferConfig(engine="asyncio", max_concurrency=4, part_size=_PART_SIZE)
+
+
+@pytest.fixture
+def asyncio_engine(transfer):
+    with mock.patch.object(CONFIG.main.aws, "transfer", transfer):
+        yield
+
+
+def test_map_bounded():
+    in_flight = 0
+    max_in_flight = 0
+
+    async def square(x):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        await asyncio.sleep(0.001)
+        in_flight -= 1
+        return x * x
+
+    results = asyncio.run(map_bounded(square, iter(range(50)), 3))
+
+    assert results == [x * x for x in range(50)]
+    assert max_in_flight == 3
+
+
+def test_list_objects_metadata(s3_client, transfer):
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    for i in range(20):
+        s3_client.put_object(Bucket=bucket.name, Key=f"20241210_00/EUROPE/dispf241210{i:02}", Body=b"GRIB",
+                             Metadata={"data": json.dumps({"date": "20241210", "time": "0000", "step": str(i)})})
+
+    with phase("test_list") as timing:
+        metadata = list_objects_metadata(bucket, transfer)
+
+    assert len(metadata) == 20
+    assert json.loads(metadata["20241210_00/EUROPE/dispf24121005"]["data"])["step"] == "5"
+    # One listing and one HEAD per object
+    assert timing.requests == 21
+
+
+def test_download_keys(s3_client, transfer, tmp_path):
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    bodies = {"a/small": os.urandom(1000), "b/empty": b"", "c/large": os.urandom(2 * _PART_SIZE + 123)}
+    for key, body in bodies.items():
+        s3_client.put_object(Bucket=bucket.name, Key=key, Body=body)
+
+    with phase("test_download") as timing:
+        download_keys(list(bodies), tmp_path, bucket, transfer)
+
+    for key, body in bodies.items():
+        assert (tmp_path / key.split("/")[-1]).read_bytes() == body
+    assert timing.objects == 3
+    assert timing.bytes == sum(len(body) for body in bodies.values())
+
+
+def test_download_keys_checksum_mismatch(s3_client, transfer, tmp_path):
+    bucket = CONFIG.main.aws.s3.nwp_model_data
+    s3_client.put_object(Bucket=bucket.name, Key="corrupt", Body=b"GRIB", Metadata={"sha256": "0" * 64})
+
+    with pytest.raises(RuntimeError, match="sha256 checksum of corrupt"):
+        download_keys(["corrupt"], tmp_path, bucket, transfer)
+    assert not list(tmp_path.iterdir())
+
+
+def test_upload_files_multipart(s3_client, transfer, tmp_path):
+    bucket = CONFIG.main.aws.s3.output
+    small, large = tmp_path / "small.nc", tmp_path / "large.nc"
+    small.write_bytes(os.urandom(100))
+    large.write_bytes(os.urandom(2 * _PART_SIZE + 10))
+
+    upload_files([(small, "x/small.nc"), (large, "x/large.nc")], bucket, transfer, {"site": "BEZ"})
+
+    for path, key in ((small, "x/small.nc"), (large, "x/large.nc")):
+        obj = s3_client.get_object(Bucket=bucket.name, Key=key)
+        assert obj["Body"].read() == path.read_bytes()
+        assert obj["Metadata"] == {"site": "BEZ"}
+    assert s3_client.head_object(Bucket=bucket.name, Key="x/large.nc")["ETag"].endswith('-3"')
+
+
+def test_s3_utils_with_asyncio_engine(s3_client, asyncio_engine, model_data, tmp_path):
+    """The functions of s3_utils behave the same with the asyncio engine configured."""
+    input_bucket = CONFIG.main.aws.s3.nwp_model_data
+    grib_files = sorted(model_data.iterdir())[:3]
+    for step, path in enumerate(grib_files):
+        s3_client.put_object(Bucket=input_bucket.name, Key=f"dispf2412100{step}", Body=path.read_bytes(),
+                             Metadata={"data": json.dumps({"date": "20241210", "time": "0000", "step": str(step)})})
+
+    objs = list_objs_in_bucket(datetime(2024, 12, 10), datetime(2024, 12, 11))
+    assert sorted(objs.keys) == ["dispf24121000", "dispf24121001", "dispf24121002"]
+    assert objs.select(datetime(2024, 12, 10, 2), datetime(2024, 12, 10, 2), "hours") == ["dispf24121002"]
+
+    download_keys_from_bucket(sorted(objs.keys), tmp_path / "data")
+    assert (tmp_path / "data" / "dispf24121002").read_bytes() == grib_files[2].read_bytes()
+
+    output_dir = tmp_path / "jobs" / "BEZ" / "output"
+    output_dir.mkdir(parents=True)
+    (output_dir / "grid_conc_20241210000000.nc").write_bytes(b"netcdf")
+    upload_output(tmp_path / "jobs", "BEZ", "2024121000", parent="output")
+
+    obj = s3_client.get_object(Bucket=CONFIG.main.aws.s3.output.name,
+                               Key="20241210_00/BEZ/grid_conc_20241210000000.nc")
+    assert obj["Body"].read() == b"netcdf"
+    assert obj["Metadata"] == {"date": "20241210", "time": "00", "site": "BEZ"}
@@ -0,0 +1,90 @@
+import os
+
+import pytest
+
+from flexpart_ifs_utils.config.service_settings import ScratchConfig
+from flexpart_ifs_utils.prepare_flexpart import _write_pathnames
+from flexpart_ifs_utils.progress import run_job
+from flexpart_ifs_utils.scratch import scratch_run_dir, stage_input
+
+_COMMAND = """&COMMAND
+ IBDATE=         20241210,
+ IBTIME=           000000,
+ IEDATE=         20241210,
+ IETIME=           010000,
+ /
+"""
+
+_AVAILABLE = """DATE     TIME        FILENAME
+YYYYMMDD HHMISS
+________ ______      __________________
+20241210 000000      dispf2024121000
+20241210 010000      dispf2024121001
+"""
+
+# A stand-in for Flexpart reading the pathnames file of its working directory, listing the input files
+# and writing a file to the output directory
+_JOB = """#!/bin/bash
+export OMP_NUM_THREADS=1
+{ read input; read output; read data; } < pathnames
+ls "$data" > "$output/grid_conc_20241210000000.nc"
+echo 'CONGRATULATIONS: YOU HAVE SUCCESSFULLY COMPLETED A FLEXPART MODEL RUN!'
+"""
+
+
+@pytest.fixture
+def job_dir(tmp_path):
+    """A job directory of BEZ whose data directory links to two input files of the Europe domain."""
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    for name in ("dispf2024121000", "dispf2024121001"):
+        (data_dir / name).write_bytes(name.encode())
+    (data_dir / "unused").write_bytes(b"")
+
+    job_dir = tmp_path / "jobs" / "BEZ"
+    (job_dir / "input").mkdir(parents=True)
+    (job_dir / "output").mkdir()
+    (job_dir / "input" / "COMMAND").write_text(_COMMAND, encoding="utf-8")
+    (job_dir / "input" / "AVAILABLE").write_text(_AVAILABLE, encoding="utf-8")
+    os.symlink(data_dir, job_dir / "data")
+    _write_pathnames(job_dir, job_dir / "input", job_dir / "output", job_dir / "data", job_dir / "input" / "AVAILABLE")
+    (job_dir / "job").write_text(_JOB, encoding="utf-8")
+    return job_dir
+
+
+@pytest.mark.parametrize("stage", [True, False])
+def test_scratch_run_dir(job_dir, tmp_path, stage):
+    config = ScratchConfig(path=str(tmp_path / "scratch"), stage_input=stage)
+
+    with scratch_run_dir(job_dir, config) as run_dir:
+        progress = run_job(job_dir, run_dir)
+        pathnames = (run_dir / "pathnames").read_text().splitlines()
+
+    assert progress.completed
+    assert pathnames[:2] == [f"{job_dir / 'input'}/", f"{run_dir / 'output'}/"]
+    assert pathnames[2] == (f"{run_dir / 'data'}/" if stage else f"{job_dir / 'data'}/")
+    # Only the files listed in AVAILABLE are staged.
+    listed = ["dispf2024121000", "dispf2024121001"] if stage else ["dispf2024121000", "dispf2024121001", "unused"]
+    assert (job_dir / "output" / "grid_conc_20241210000000.nc").read_text().split() == listed
+    assert not run_dir.exists()
+    assert (job_dir / "pathnames").read_text().splitlines()[1] == f"{job_dir / 'output'}/"
+
+
+def test_scratch_run_dir_moves_output_of_failed_run(job_dir, tmp_path):
+    config = ScratchConfig(path=str(tmp_path / "scratch"), stage_input=False)
+
+    with pytest.raises(RuntimeError):
+        with scratch_run_dir(job_dir, config) as run_dir:
+            (run_dir / "output" / "partial").write_text("partial")
+            raise RuntimeError("Flexpart failed")
+
+    assert (job_dir / "output" / "partial").read_text() == "partial"
+    assert not run_dir.exists()
+
+
+def test_stage_input(job_dir, tmp_path):
+    staged_dir = stage_input(job_dir / "data", tmp_path / "staged", [job_dir / "input" / "AVAILABLE"])
+
+    assert sorted(path.name for path in staged_dir.iterdir()) == ["dispf2024121000", "dispf2024121001"]
+    # Hard linked on the same file system
+    assert (staged_dir / "dispf2024121000").stat().st_ino == (tmp_path / "data" / "dispf2024121000").stat().st_ino
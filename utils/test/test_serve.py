@@ -0,0 +1,179 @@
+import json
+import os
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+
+from flexpart_ifs_utils import serve
+from flexpart_ifs_utils.config.service_settings import ServeConfig
+from flexpart_ifs_utils.model import Model
+from flexpart_ifs_utils.serve import (DirectoryQueue, RunRequest, SqliteQueue,
+                                      execute_request, open_queue,
+                                      serve_requests)
+from flexpart_ifs_utils.timing import TIMINGS_FILE, phase, records
+
+_ENVIRONMENT = {
+    "EMISSION_START_YYYY": "2024", "EMISSION_START_MM": "12", "EMISSION_START_DD": "10", "EMISSION_START_ZZ": "00",
+    "EMISSION_END_YYYY": "2024", "EMISSION_END_MM": "12", "EMISSION_END_DD": "10", "EMISSION_END_ZZ": "06",
+    "SIMULATION_END_YYYY": "2024", "SIMULATION_END_MM": "12", "SIMULATION_END_DD": "11", "SIMULATION_END_ZZ": "00",
+}
+
+
+def _request(request_id: str, sites: list[str] | None = None) -> RunRequest:
+    return RunRequest(id=request_id, sites=sites or ["BEZ"], forecast_datetime="2024121000",
+                      model=Model.IFS_HRES_EUROPE, environment=_ENVIRONMENT)
+
+
+def _config(queue_type: str, path: Path, max_concurrent_runs: int = 2) -> ServeConfig:
+    return ServeConfig(queue_type=queue_type, queue_path=str(path), max_concurrent_runs=max_concurrent_runs,
+                       poll_interval=0.05)
+
+
+def _state(queue, request_id: str) -> tuple[str, str | None]:
+    if isinstance(queue, SqliteQueue):
+        return queue.state(request_id)
+    for state in ("incoming", "claimed", "done", "failed"):
+        for path in (queue.path / state).glob(f"*_{request_id}.json"):
+            return state, json.loads(path.read_text()).get("error")
+    raise KeyError(request_id)
+
+
+def _execute_in_worker(request: RunRequest, jobs_root: Path, flexpart_dir: Path) -> int:
+    """Stand-in of execute_request, recording the worker process executing each request."""
+    (jobs_root / f"{request.id}.pid").write_text(str(os.getpid()))
+    if request.id == "broken":
+        raise RuntimeError("Release site BEZ does not match any known to Flexpart.")
+    if request.id == "killed":
+        # As a worker killed out of memory
+        os._exit(137)
+    return 1 if request.id == "failing" else 0
+
+
+@pytest.fixture(params=["directory", "sqlite"])
+def queue_config(request, tmp_path) -> ServeConfig:
+    return _config(request.param, tmp_path / ("queue.sqlite" if request.param == "sqlite" else "queue"))
+
+
+def test_queue(queue_config):
+    queue = open_queue(queue_config)
+    for request_id in ("a", "b", "c"):
+        queue.put(_request(request_id))
+
+    claimed = [queue.claim(), queue.claim()]
+    queue.complete(claimed[0])
+    queue.complete(claimed[1], "Flexpart exited with code 1")
+
+    assert [request.id for request in claimed] == ["a", "b"]
+    assert claimed[0] == _request("a")
+    assert _state(queue, "a") == ("done", None)
+    assert _state(queue, "b") == ("failed", "Flexpart exited with code 1")
+    assert queue.claim().id == "c"
+    assert queue.claim() is None
+
+
+@pytest.mark.parametrize("queue_type", ["directory", "sqlite"])
+def test_queue_claimed_once(tmp_path, queue_type):
+    """Daemons sharing a queue each claim different requests."""
+    config = _config(queue_type, tmp_path / "queue")
+    queues = [open_queue(config), open_queue(config)]
+    for i in range(6):
+        queues[0].put(_request(str(i)))
+
+    claimed = [queues[i % 2].claim() for i in range(7)]
+
+    assert sorted(request.id for request in claimed[:6]) == [str(i) for i in range(6)]
+    assert claimed[6] is None
+
+
+def test_open_queue_unknown(tmp_path):
+    with pytest.raises(RuntimeError, match="Unknown queue type kafka"):
+        open_queue(_config("kafka", tmp_path))
+
+
+def test_serve_requests(queue_config, tmp_path, monkeypatch):
+    monkeypatch.setattr(serve, "execute_request", _execute_in_worker)
+    queue = open_queue(queue_config)
+    request_ids = ["a", "failing", "b", "broken", "c", "d"]
+    for request_id in request_ids:
+        queue.put(_request(request_id))
+    jobs_root = tmp_path / "jobs"
+    jobs_root.mkdir()
+
+    serve_requests(queue, queue_config, jobs_root, tmp_path / "flexpart", drain=True)
+
+    assert {request_id: _state(queue, request_id)[0] for request_id in request_ids} == {
+        "a": "done", "failing": "failed", "b": "done", "broken": "failed", "c": "done", "d": "done"
+    }
+    assert _state(queue, "failing")[1] == "Flexpart exited with code 1"
+    assert _state(queue, "broken")[1] == "RuntimeError: Release site BEZ does not match any known to Flexpart."
+    # The requests are executed by workers kept across requests.
+    pids = {(jobs_root / f"{request_id}.pid").read_text() for request_id in request_ids}
+    assert len(pids) <= queue_config.max_concurrent_runs
+    assert str(os.getpid()) not in pids
+
+
+def test_serve_requests_worker_died(queue_config, tmp_path, monkeypatch):
+    """The request of a dead worker fails, the next request is returned to the queue and executed by new workers."""
+    monkeypatch.setattr(serve, "execute_request", _execute_in_worker)
+    config = queue_config.model_copy(update={"max_concurrent_runs": 1})
+    queue = open_queue(config)
+    request_ids = ["killed", "a", "b"]
+    for request_id in request_ids:
+        queue.put(_request(request_id))
+    jobs_root = tmp_path / "jobs"
+    jobs_root.mkdir()
+
+    serve_requests(queue, config, jobs_root, tmp_path / "flexpart", drain=True)
+
+    assert {request_id: _state(queue, request_id)[0] for request_id in request_ids} == {
+        "killed": "failed", "a": "done", "b": "done"
+    }
+    assert _state(queue, "killed")[1].startswith("BrokenProcessPool: ")
+    assert (jobs_root / "a.pid").read_text() != (jobs_root / "killed.pid").read_text()
+
+
+def test_queue_release(queue_config):
+    queue = open_queue(queue_config)
+    for request_id in ("a", "b"):
+        queue.put(_request(request_id))
+
+    queue.release(queue.claim())
+
+    assert _state(queue, "a")[0] in ("incoming", "queued")
+    assert queue.claim().id == "a"
+
+
+def test_execute_request(tmp_path):
+    def generate(forecast_datetime, site, jobs_dir, flexpart_dir, model, *, environment):
+        with phase("prepare_job_directory"):
+            (jobs_dir / site).mkdir(parents=True)
+        return jobs_dir / site
+
+    jobs_root = tmp_path / "jobs"
+    with patch("flexpart_ifs_utils.serve.generate", side_effect=generate) as mock_generate, \
+            patch("flexpart_ifs_utils.serve.run", side_effect=[0, 3]) as mock_run, \
+            patch("flexpart_ifs_utils.serve.postprocess") as mock_postprocess, \
+            patch("flexpart_ifs_utils.serve.upload") as mock_upload:
+        returncode = execute_request(_request("r1", ["BEZ", "LEI"]), jobs_root, tmp_path / "flexpart")
+
+    assert returncode == 3
+    assert [(call.args, call.kwargs) for call in mock_generate.call_args_list] == [
+        (("2024121000", site, jobs_root / "r1" / site, tmp_path / "flexpart", Model.IFS_HRES_EUROPE),
+         {"environment": _ENVIRONMENT})
+        for site in ("BEZ", "LEI")
+    ]
+    assert [call.args for call in mock_run.call_args_list] == [
+        (jobs_root / "r1" / site / site,) for site in ("BEZ", "LEI")
+    ]
+    # The input files are downloaded once, into the data directory of the request.
+    for site in ("BEZ", "LEI"):
+        assert (jobs_root / "r1" / site / "data").resolve() == jobs_root / "r1" / "data"
+    # The failed run of LEI is not postprocessed nor uploaded.
+    mock_postprocess.assert_called_once_with(jobs_root / "r1" / "BEZ")
+    mock_upload.assert_called_once_with(jobs_root / "r1" / "BEZ", "BEZ", "2024121000")
+    # Each job directory has the timings of its own run only.
+    for site in ("BEZ", "LEI"):
+        timings = json.loads((jobs_root / "r1" / site / site / TIMINGS_FILE).read_text())
+        assert [timing["name"] for timing in timings] == ["prepare_job_directory", "generate_command"]
+    assert not records()
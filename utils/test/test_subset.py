@@ -0,0 +1,130 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+from eccodes import (codes_get_array, codes_get_long, codes_get_message,
+                     codes_get_values, codes_grib_new_from_file,
+                     codes_grib_new_from_samples, codes_release, codes_set,
+                     codes_set_values)
+
+from flexpart_ifs_utils.config.service_settings import SubsetConfig
+from flexpart_ifs_utils.grib_utils import check_grib_framing
+from flexpart_ifs_utils.prepare_flexpart import OutputGrid
+from flexpart_ifs_utils.subset import (Domain, crop_grib_file, grid_domain,
+                                       subset_domains, subset_release)
+
+_CONFIG = SubsetConfig(lon_extent=40., lat_extent=20., margin=5., max_workers=2)
+# The global output grid of OUTGRID.g
+_OUTGRID = OutputGrid(outlon0=-179.5, outlat0=-90., numxgrid=1440, numygrid=720, dxout=0.25, dyout=0.25)
+_NEST = Domain(west=-10., south=35., east=47., north=65.)
+
+
+def _field(lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    """A field whose value identifies its grid point."""
+    return np.round(lats[:, None] * 1000. + lons[None, :] % 360., 3)
+
+
+def _message(sample: str, west: float, north: float, ni: int, nj: int, increment: float) -> bytes:
+    gid = codes_grib_new_from_samples(sample)
+    codes_set(gid, "Ni", ni)
+    codes_set(gid, "Nj", nj)
+    codes_set(gid, "iDirectionIncrementInDegrees", increment)
+    codes_set(gid, "jDirectionIncrementInDegrees", increment)
+    codes_set(gid, "latitudeOfFirstGridPointInDegrees", north)
+    codes_set(gid, "latitudeOfLastGridPointInDegrees", north - (nj - 1) * increment)
+    codes_set(gid, "longitudeOfFirstGridPointInDegrees", west % 360.)
+    codes_set(gid, "longitudeOfLastGridPointInDegrees", (west + (ni - 1) * increment) % 360.)
+    codes_set(gid, "bitsPerValue", 24)
+    lons = west + increment * np.arange(ni)
+    lats = north - increment * np.arange(nj)
+    codes_set_values(gid, _field(lons, lats).ravel())
+    message = codes_get_message(gid)
+    codes_release(gid)
+    return message
+
+
+def _read(path: Path) -> list[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    fields = []
+    with open(path, "rb") as f:
+        while (gid := codes_grib_new_from_file(f)) is not None:
+            shape = (codes_get_long(gid, "Nj"), codes_get_long(gid, "Ni"))
+            fields.append((
+                codes_get_array(gid, "longitudes").reshape(shape)[0],
+                codes_get_array(gid, "latitudes").reshape(shape)[:, 0],
+                codes_get_values(gid).reshape(shape),
+            ))
+            codes_release(gid)
+    return fields
+
+
+@pytest.fixture
+def data_dir(tmp_path) -> Path:
+    """Global fields on a 1 degree grid for two steps, of both editions, and the fields of the nested domain."""
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    for name in ("dispc24121000", "dispc24121003"):
+        (data_dir / name).write_bytes(b"".join(
+            _message(sample, 0., 90., 360, 181, 1.) for sample in ("regular_ll_sfc_grib1", "regular_ll_pl_grib2")
+        ))
+    (data_dir / "dispf24121000").write_bytes(_message("regular_ll_sfc_grib2", -10., 65., 115, 61, 0.5))
+    return data_dir
+
+
+def test_subset_domains():
+    grid, domain = subset_domains(_OUTGRID, 8.2284, 47.5519, None, _CONFIG)
+
+    assert grid == OutputGrid(outlon0=-32., outlat0=27.5, numxgrid=321, numygrid=161, dxout=0.25, dyout=0.25)
+    assert domain == Domain(west=-37., south=22.5, east=53.25, north=72.75)
+
+
+def test_subset_domains_nest_and_poles():
+    grid, domain = subset_domains(_OUTGRID, 8.2284, 80., _NEST, _CONFIG)
+
+    assert (grid.outlat0, grid.outlat0 + grid.numygrid * grid.dyout) == (60., 90.)
+    # The nest extends the domain to the south and the east, and the domain stops at the pole.
+    assert domain == Domain(west=-37., south=30., east=53.25, north=90.)
+
+
+@pytest.mark.parametrize("domain", [
+    Domain(west=-37., south=22.5, east=53.25, north=72.75),
+    Domain(west=100., south=-80., east=120., north=-60.),
+    Domain(west=-200., south=-90., east=200., north=90.),
+])
+def test_crop_grib_file(data_dir, tmp_path, domain):
+    dst = tmp_path / "dispc24121000"
+
+    assert crop_grib_file(data_dir / "dispc24121000", dst, domain) == 2
+
+    assert check_grib_framing(dst) == 2
+    for lons, lats, values in _read(dst):
+        # The cropped grid covers the domain with the grid points of the global grid, across Greenwich.
+        assert lats[0] >= domain.north > lats[0] - 1. or lats[0] == 90.
+        assert lats[-1] <= domain.south < lats[-1] + 1. or lats[-1] == -90.
+        assert np.allclose(np.diff(lons) % 360., 1.)
+        assert np.allclose(values, _field(lons, lats), atol=1e-2)
+    assert dst.stat().st_size < (data_dir / "dispc24121000").stat().st_size or domain.east - domain.west >= 360.
+
+
+def test_crop_grib_file_outside_grid(data_dir, tmp_path):
+    with pytest.raises(RuntimeError, match="do not overlap"):
+        crop_grib_file(data_dir / "dispf24121000", tmp_path / "dispf24121000", Domain(
+            west=100., south=-80., east=120., north=-60.
+        ))
+    assert not list(tmp_path.glob(".dispf*"))
+
+
+def test_grid_domain(data_dir):
+    assert grid_domain(data_dir / "dispf24121000") == _NEST
+
+
+def test_subset_release(data_dir, tmp_path):
+    subset_dir = tmp_path / "subset" / "BEZ"
+    configuration = {"releases": {"LON1": 8.2284, "LAT1": 47.5519}}
+
+    grid = subset_release(configuration, data_dir, subset_dir, _OUTGRID, _CONFIG)
+
+    assert grid.outlon0 == -32.
+    assert sorted(path.name for path in subset_dir.iterdir()) == ["dispc24121000", "dispc24121003", "dispf24121000"]
+    assert (subset_dir / "dispf24121000").is_symlink()
+    lons, lats, _ = _read(subset_dir / "dispc24121003")[0]
+    assert (lons[0] % 360., lons[-1], lats[0], lats[-1]) == (323., 54., 73., 22.)
@@ -0,0 +1,47 @@
+import json
+
+from flexpart_ifs_utils import timing
+from flexpart_ifs_utils.timing import count, phase, timed, write_timings
+
+
+def test_phase_counts_nested():
+    with phase("outer") as outer:
+        count(objects=1)
+        with phase("inner") as inner:
+            count(nbytes=100, objects=2, requests=3)
+
+    assert (inner.bytes, inner.objects, inner.requests) == (100, 2, 3)
+    assert (outer.bytes, outer.objects, outer.requests) == (100, 3, 3)
+    assert outer.wall_time >= inner.wall_time > 0
+    assert outer.process_peak_rss_kb > 0
+    assert [t.name for t in timing.records()[-2:]] == ["inner", "outer"]
+
+
+def test_timed():
+
+    @timed("decorated")
+    def work(n: int) -> int:
+        count(objects=n)
+        return n
+
+    assert work(4) == 4
+    assert timing.records()[-1].name == "decorated"
+    assert timing.records()[-1].objects == 4
+
+
+def test_write_timings_appends(tmp_path, monkeypatch):
+    monkeypatch.setattr(timing, "_records", [])
+
+    with phase("generate"):
+        pass
+    write_timings(tmp_path)
+
+    monkeypatch.setattr(timing, "_records", [])
+    with phase("upload"):
+        pass
+    write_timings(tmp_path)
+
+    timings = json.loads((tmp_path / "timings.json").read_text())
+    assert [t["name"] for t in timings] == ["generate", "upload"]
+    assert set(timings[0]) == {"name", "wall_time", "bytes", "objects", "requests",
+                               "process_peak_rss_kb", "children_peak_rss_kb"}